@@ -4,8 +4,11 @@
 import numpy as np
 import sys
 import warnings
+import itertools
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
 from .. import kern
-from ..util.linalg import dtrtrs
+from ..util.linalg import dtrtrs, dtrtri
 from model import Model
 from parameterization import ObservableArray
 from .. import likelihoods
@@ -73,6 +76,46 @@ class GP(Model):
     def log_likelihood(self):
         return self._log_marginal_likelihood
 
+    def append_data(self, Xnew, Ynew, Y_metadata=None, window=None):
+        """
+        Add the observations Xnew, Ynew to the model, updating the posterior
+        incrementally (see
+        :py:meth:`~GPy.inference.latent_function_inference.exact_gaussian_inference.ExactGaussianInference.append`)
+        in O(N^2 k) for k new points, instead of redoing the inference in O(N^3).
+
+        The kernel and likelihood parameters are held fixed: the gradients are
+        not updated, they are recomputed as soon as the parameters change.
+
+        :param Xnew: the new inputs (k x input_dim)
+        :param Ynew: the new outputs (k x output_dim)
+        :param Y_metadata: the metadata of the new outputs, if the model has metadata
+        :param int window: if given, drop the oldest points (see :py:meth:`remove_data`), so that at most window points are kept
+        """
+        assert hasattr(self.inference_method, 'append'), "incremental updates need exact Gaussian inference"
+        assert isinstance(self.X, ObservableArray), "incremental updates only for fixed inputs"
+        self.posterior, self._log_marginal_likelihood = self.inference_method.append(self.posterior, self.kern, self.X, Xnew, self.likelihood, self.Y, Ynew, Y_metadata)
+        self.X = ObservableArray(np.vstack((self.X, Xnew)))
+        self.Y = ObservableArray(np.vstack((self.Y, Ynew)))
+        if self.Y_metadata is not None:
+            self.Y_metadata = ObservableArray(np.vstack((self.Y_metadata, Y_metadata)))
+        self.num_data = self.X.shape[0]
+        if window is not None and self.num_data > window:
+            self.remove_data(self.num_data - window)
+
+    def remove_data(self, num):
+        """
+        Remove the num oldest (first) observations from the model, updating
+        the posterior incrementally in O(N^2 num), with the parameters held
+        fixed as in :py:meth:`append_data`.
+        """
+        assert hasattr(self.inference_method, 'remove_leading'), "incremental updates need exact Gaussian inference"
+        self.posterior, self._log_marginal_likelihood = self.inference_method.remove_leading(self.posterior, self.Y, num)
+        self.X = ObservableArray(np.array(self.X[num:]))
+        self.Y = ObservableArray(np.array(self.Y[num:]))
+        if self.Y_metadata is not None:
+            self.Y_metadata = ObservableArray(np.array(self.Y_metadata[num:]))
+        self.num_data = self.X.shape[0]
+
     def _raw_predict(self, _Xnew, full_cov=False):
         """
         Internal helper function for making predictions, does not account
@@ -84,21 +127,65 @@ class GP(Model):
 
         """
         Kx = self.kern.K(_Xnew, self.X).T
-        #LiKx, _ = dtrtrs(self.posterior.woodbury_chol, np.asfortranarray(Kx), lower=1)
-        WiKx = np.dot(self.posterior.woodbury_inv, Kx)
         mu = np.dot(Kx.T, self.posterior.woodbury_vector)
         if full_cov:
             Kxx = self.kern.K(_Xnew)
-            #var = Kxx - tdot(LiKx.T)
-            var = np.dot(Kx.T, WiKx)
+            var = self.posterior.predictive_variance(Kx, Kxx)
         else:
             Kxx = self.kern.Kdiag(_Xnew)
-            #var = Kxx - np.sum(LiKx*LiKx, 0)
-            var = Kxx - np.sum(WiKx*Kx, 0)
+            var = self.posterior.predictive_variance(Kx, Kxx)
             var = var.reshape(-1, 1)
         return mu, var
 
-    def predict(self, Xnew, full_cov=False, **likelihood_args):
+    def _raw_predict_batches(self, Xnew, batch_size=1000, full_cov=False, n_jobs=1):
+        """
+        Generator over the latent function predictions for consecutive batches
+        of (at most) batch_size rows of Xnew, see :py:meth:`_raw_predict`.
+        Memory needed is bounded by the batch size, not the number of test points.
+
+        If n_jobs is not 1, the batches are predicted in a pool of n_jobs
+        threads (n_jobs=-1: one thread per cpu). The heavy lifting is done by
+        BLAS, which releases the GIL. Batches are yielded in order.
+
+        :returns: (batch, mu, var) for each batch, where batch is the slice into Xnew
+        """
+        batches = [slice(start, min(start + batch_size, Xnew.shape[0])) for start in xrange(0, Xnew.shape[0], batch_size)]
+        if n_jobs == -1:
+            n_jobs = mp.cpu_count()
+        if n_jobs == 1 or len(batches) < 2:
+            for batch in batches:
+                mu, var = self._raw_predict(Xnew[batch], full_cov=full_cov)
+                yield batch, mu, var
+            return
+        # predict the first batch in this thread, so that the (lazily computed)
+        # posterior quantities are in place before the threads share them
+        mu, var = self._raw_predict(Xnew[batches[0]], full_cov=full_cov)
+        yield batches[0], mu, var
+        pool = ThreadPool(min(n_jobs, len(batches) - 1))
+        try:
+            for batch, (mu, var) in itertools.izip(batches[1:], pool.imap(lambda b: self._raw_predict(Xnew[b], full_cov=full_cov), batches[1:])):
+                yield batch, mu, var
+        finally:
+            pool.terminate()
+
+    def predict_batches(self, Xnew, batch_size=1000, full_cov=False, n_jobs=1, **likelihood_args):
+        """
+        Generator over the predictions (see :py:meth:`predict`) for consecutive
+        batches of (at most) batch_size rows of Xnew. Use this to stream
+        predictions for large numbers of test points.
+
+        :param Xnew: The points at which to make a prediction
+        :type Xnew: np.ndarray, Nnew x self.input_dim
+        :param int batch_size: number of test points per batch
+        :param full_cov: whether to return the full covariance matrix for each batch
+        :param int n_jobs: number of threads predicting batches in parallel (-1: one per cpu)
+        :returns: (batch, mean, var, lower, upper) for each batch, where batch is the slice into Xnew
+        """
+        for batch, mu, var in self._raw_predict_batches(Xnew, batch_size, full_cov, n_jobs):
+            mean, var, _025pm, _975pm = self.likelihood.predictive_values(mu, var, full_cov, **likelihood_args)
+            yield batch, mean, var, _025pm, _975pm
+
+    def predict(self, Xnew, full_cov=False, batch_size=None, n_jobs=1, **likelihood_args):
         """
         Predict the function(s) at the new point(s) Xnew.
 
@@ -112,12 +199,32 @@ class GP(Model):
                        full_cov=False, Nnew x Nnew otherwise
         :returns: lower and upper boundaries of the 95% confidence intervals,
                   Numpy arrays,  Nnew x self.input_dim
+        :param int batch_size: if given, predict batch_size points at a time
+                               (only for full_cov=False), see :py:meth:`predict_batches`
+        :param int n_jobs: number of threads to predict batches in parallel (-1: one per cpu),
+                           if batch_size is not given, the test points are split evenly over the threads
+                           (with full_cov, n_jobs is ignored and all points are predicted at once)
 
 
            If full_cov and self.input_dim > 1, the return shape of var is Nnew x Nnew x self.input_dim. If self.input_dim == 1, the return shape is Nnew x Nnew.
            This is to allow for different normalizations of the output dimensions.
 
         """
+        if n_jobs == -1:
+            n_jobs = mp.cpu_count()
+        if batch_size is None and n_jobs != 1 and not full_cov:
+            batch_size = max(1, int(np.ceil(Xnew.shape[0] / float(n_jobs))))
+        if batch_size is not None and Xnew.shape[0] > 0:
+            assert not full_cov, "batched prediction only for the diagonal of the covariance"
+            out = None
+            for batch, mean, var, _025pm, _975pm in self.predict_batches(Xnew, batch_size, n_jobs=n_jobs, **likelihood_args):
+                if out is None:
+                    #allocate the results once, and fill in batch by batch
+                    out = [None if r is None else np.empty((Xnew.shape[0],) + r.shape[1:]) for r in (mean, var, _025pm, _975pm)]
+                for o, r in zip(out, (mean, var, _025pm, _975pm)):
+                    if o is not None: o[batch] = r
+            return tuple(out)
+
         #predict the latent function values
         mu, var = self._raw_predict(Xnew, full_cov=full_cov)
 
@@ -125,6 +232,37 @@ class GP(Model):
         mean, var, _025pm, _975pm = self.likelihood.predictive_values(mu, var, full_cov, **likelihood_args)
         return mean, var, _025pm, _975pm
 
+    def export_predictor(self):
+        """
+        Export a compact, picklable snapshot of the current posterior, which
+        predicts (see :py:meth:`GPy.core.predictor.Predictor.predict`) without
+        the kernel and parameter machinery of the model. Only needs numpy.
+
+        Changes to the model after the export do not affect the predictor.
+        """
+        return self._export_predictor(self.X)
+
+    def _export_predictor(self, X):
+        from predictor import Predictor, freeze_kern
+        posterior = self.posterior
+        if posterior._solve_with_chol:
+            Li, Wi = dtrtri(posterior.woodbury_chol), None
+        else:
+            Li, Wi = None, posterior.woodbury_inv
+            if Wi.ndim != 2:
+                raise NotImplementedError, "cannot export a posterior with one woodbury inverse per output"
+        noise_variance = float(self.likelihood.variance) if isinstance(self.likelihood, Gaussian) else None
+        return Predictor(freeze_kern(self.kern, X), posterior.woodbury_vector, Li=Li, Wi=Wi, noise_variance=noise_variance)
+
+    def set_precision(self, dtype):
+        """
+        Set the floating point type (np.float64 or np.float32) in which the
+        kernel matrices of this model are computed. The inference keeps its
+        choleskies, solves and gradients in float64, see
+        :py:meth:`GPy.kern._src.kern.Kern.set_precision` for the accuracy.
+        """
+        self.kern.set_precision(dtype)
+
     def posterior_samples_f(self,X,size=10, full_cov=True):
         """
         Samples the posterior GP at the points X.
@@ -222,9 +360,15 @@ class GP(Model):
                 self.kern,
                 self.likelihood,
                 self.output_dim,
+                self.Y,
+                self.Y_metadata,
+                self.inference_method,
                 ]
 
     def _setstate(self, state):
+        self.inference_method = state.pop()
+        self.Y_metadata = state.pop()
+        self.Y = state.pop()
         self.output_dim = state.pop()
         self.likelihood = state.pop()
         self.kern = state.pop()
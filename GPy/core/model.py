@@ -5,11 +5,15 @@
 from .. import likelihoods
 from ..inference import optimization
 from ..util.misc import opt_wrapper
+from ..util import caching
 from parameterization import Parameterized
 import multiprocessing as mp
 import numpy as np
 from numpy.linalg.linalg import LinAlgError
 import itertools
+import time
+import sys
+import traceback
 # import numdifftools as ndt
 
 class Model(Parameterized):
@@ -55,7 +59,8 @@ class Model(Parameterized):
         self.priors = state.pop()
         Parameterized._setstate(self, state)
 
-    def optimize_restarts(self, num_restarts=10, robust=False, verbose=True, parallel=False, num_processes=None, **kwargs):
+    def optimize_restarts(self, num_restarts=10, robust=False, verbose=True, parallel=False, num_processes=None,
+                          time_budget=None, dominance_margin=None, dominance_evals=50, **kwargs):
         """
         Perform random restarts of the model, and set the model to the best
         seen solution.
@@ -70,13 +75,24 @@ class Model(Parameterized):
         :type num_restarts: int
         :param robust: whether to handle exceptions silently or not (default False)
         :type robust: bool
-        :param parallel: whether to run each restart as a separate process. It relies on the multiprocessing module.
+        :param parallel: whether to run the restarts in a pool of worker processes. It relies on the multiprocessing module.
         :type parallel: bool
         :param num_processes: number of workers in the multiprocessing pool
         :type numprocesses: int
+        :param time_budget: time in seconds after which the restarts are stopped,
+            a stopped restart reports the best parameters it has seen
+        :type time_budget: float
+        :param dominance_margin: if given, a restart is stopped (as dominated) once it has
+            evaluated the objective dominance_evals times and the best objective it has seen is
+            worse than the best finished restart by more than dominance_margin * (1 + abs(best))
+        :type dominance_margin: float
+        :param dominance_evals: number of objective evaluations before a restart can be dominated
+        :type dominance_evals: int
 
         \*\*kwargs are passed to the optimizer. They can be:
 
+        :param optimizer: which optimizer to use (defaults to self.preferred optimizer)
+        :type optimizer: string
         :param max_f_eval: maximum number of function evaluations
         :type max_f_eval: int
         :param max_iters: maximum number of iterations
@@ -88,44 +104,57 @@ class Model(Parameterized):
         multiprocessing pool is automatically set to the number of processors
         on the current machine.
 
+        .. note:: The worker processes are forked once and inherit the model,
+        only the starting parameters of the restarts are sent to them. The
+        results come back as the restarts finish (in any order).
+
         """
         initial_parameters = self._get_params_transformed()
+        starts = [self._random_params_transformed() for _ in range(num_restarts)]
+        deadline = None if time_budget is None else time.time() + time_budget
+        # the best finished restart so far, shared with the workers
+        best = mp.Value('d', np.inf)
 
-        if parallel:
-            try:
-                jobs = []
-                pool = mp.Pool(processes=num_processes)
-                for i in range(num_restarts):
-                    self.randomize()
-                    job = pool.apply_async(opt_wrapper, args=(self,), kwds=kwargs)
-                    jobs.append(job)
-
-                pool.close()  # signal that no more data coming in
-                pool.join()  # wait for all the tasks to complete
-            except KeyboardInterrupt:
-                print "Ctrl+c received, terminating and joining pool."
+        problem = (self, kwargs, best, deadline, dominance_margin, dominance_evals)
+        pool, runs = None, []
+        try:
+            if parallel:
+                # the workers inherit the problem at the fork (initargs are not pickled)
+                pool = mp.Pool(processes=num_processes, initializer=_init_restart_worker, initargs=(problem,))
+                results = pool.imap_unordered(_run_restart, enumerate(starts))
+            else:
+                results = (_run_restart(job, problem) for job in enumerate(starts))
+
+            for k, (i, opt, error) in enumerate(results):
+                if error is not None:
+                    if robust:
+                        print("Warning - optimization restart {0}/{1} failed".format(i + 1, num_restarts))
+                        continue
+                    e, tb = error
+                    if isinstance(tb, basestring):
+                        # tracebacks cannot be pickled, the workers send them formatted
+                        sys.stderr.write("Traceback of optimization restart {0}/{1}:\n{2}".format(i + 1, num_restarts, tb))
+                        tb = None
+                    raise type(e), e, tb
+                if opt is None:
+                    if verbose:
+                        print("Optimization restart {0}/{1} not started, time budget exhausted".format(i + 1, num_restarts))
+                    continue
+                opt.model = self
+                runs.append(opt)
+                self.optimization_runs.append(opt)
+                if verbose:
+                    print("Optimization restart {0}/{1} ({2} of {1} done), f = {3}, {4}".format(i + 1, num_restarts, k + 1, opt.f_opt, opt.status))
+        except KeyboardInterrupt:
+            print "Ctrl+c received, terminating the restarts."
+        finally:
+            if pool is not None:
                 pool.terminate()
                 pool.join()
 
-        for i in range(num_restarts):
-            try:
-                if not parallel:
-                    self.randomize()
-                    self.optimize(**kwargs)
-                else:
-                    self.optimization_runs.append(jobs[i].get())
-
-                if verbose:
-                    print("Optimization restart {0}/{1}, f = {2}".format(i + 1, num_restarts, self.optimization_runs[-1].f_opt))
-            except Exception as e:
-                if robust:
-                    print("Warning - optimization restart {0}/{1} failed".format(i + 1, num_restarts))
-                else:
-                    raise e
-
-        if len(self.optimization_runs):
-            i = np.argmin([o.f_opt for o in self.optimization_runs])
-            self._set_params_transformed(self.optimization_runs[i].x_opt)
+        if len(runs) and np.isfinite(min(o.f_opt for o in runs)):
+            i = np.argmin([o.f_opt for o in runs])
+            self._set_params_transformed(runs[i].x_opt)
         else:
             self._set_params_transformed(initial_parameters)
 
@@ -148,6 +177,28 @@ class Model(Parameterized):
         """
         return self.kern.input_sensitivity()
 
+    def natural_gradient_blocks(self):
+        """
+        The blocks of Gaussian variational parameters of this model, which the
+        natural gradient optimizer (optimize('natgrad'), see
+        :py:class:`~GPy.inference.optimization.natural_gradient.opt_natgrad`)
+        moves by natural gradient steps.
+
+        Defaults to all NormalPosteriors among the (free) parameters of the
+        model. Models with variational parameters outside their parameters
+        override this.
+        """
+        from parameterization.variational import NormalPosterior
+        from ..inference.optimization.natural_gradient import NormalPosteriorBlock
+        def posteriors(p):
+            if isinstance(p, NormalPosterior):
+                return [p]
+            return [q for c in getattr(p, '_parameters_', []) for q in posteriors(c)]
+        blocks = [NormalPosteriorBlock(self, q) for q in posteriors(self)]
+        if self._has_fixes():
+            blocks = [b for b in blocks if np.all(self._fixes_[b.index])]
+        return blocks
+
     def objective_function(self, x):
         """
         The objective function passed to the optimizer. It combines
@@ -248,10 +299,25 @@ class Model(Parameterized):
         self._set_params_transformed(opt.x_opt)
 
     def optimize_SGD(self, momentum=0.1, learning_rate=0.01, iterations=20, **kwargs):
-        # assert self.Y.shape[1] > 1, "SGD only works with D > 1"
-        sgd = SGD.StochasticGD(self, iterations, learning_rate, momentum, **kwargs)  # @UndefinedVariable
-        sgd.run()
-        self.optimization_runs.append(sgd)
+        """
+        Stochastic gradient descent with momentum, see
+        :py:class:`~GPy.inference.optimization.sgd.opt_SGD`. Shortcut for
+        optimize('sgd', momentum=momentum, learning_rate=learning_rate, max_iters=iterations, **kwargs)
+        """
+        self.optimize('sgd', momentum=momentum, learning_rate=learning_rate, max_iters=iterations, **kwargs)
+
+    def next_batch(self):
+        """
+        Hook for the stochastic optimizers (see GPy.inference.optimization.sgd):
+        move the objective of the model to the next minibatch of the data.
+        The next computation of the objective (e.g. objective_and_gradients)
+        is on the new batch.
+
+        :returns: whether the model moved to a new batch. Models without
+            minibatches return False, the optimizers then run on the full
+            objective.
+        """
+        return False
 
     def _checkgrad(self, target_param=None, verbose=False, step=1e-6, tolerance=1e-3):
         """
@@ -371,3 +437,85 @@ class Model(Parameterized):
             return ret
 
 
+#===============================================================================
+# Restarts (see Model.optimize_restarts). The worker processes of the pool get
+# the restart problem at the fork (as the initargs of the pool), so they
+# inherit the model instead of receiving it pickled, and keep it in
+# _worker_restart_problem. The serial restarts pass the problem directly.
+#===============================================================================
+_worker_restart_problem = None
+
+def _init_restart_worker(problem):
+    global _worker_restart_problem
+    _worker_restart_problem = problem
+    caching.registry.after_fork()
+
+class _RestartStopped(Exception):
+    pass
+
+class _RestartTracker(object):
+    """
+    Keeps the best parameters seen by a restart, and stops the restart when
+    the time budget is exhausted or the restart is dominated.
+    """
+    def __init__(self, best, deadline, dominance_margin, dominance_evals):
+        self.best, self.deadline = best, deadline
+        self.dominance_margin, self.dominance_evals = dominance_margin, dominance_evals
+        self.f_best, self.x_best, self.evals = np.inf, None, 0
+
+    def check(self, x, f):
+        self.evals += 1
+        if f < self.f_best:
+            self.f_best, self.x_best = f, x.copy()
+        if self.deadline is not None and time.time() > self.deadline:
+            raise _RestartStopped("stopped, time budget exhausted")
+        if self.dominance_margin is not None and self.evals >= self.dominance_evals:
+            best = self.best.value
+            if self.f_best > best + self.dominance_margin*(1. + np.abs(best)):
+                raise _RestartStopped("stopped, dominated")
+
+    def f(self, f):
+        def tracked(x):
+            f_x = f(x)
+            self.check(x, f_x)
+            return f_x
+        return tracked
+
+    def f_fp(self, f_fp):
+        def tracked(x):
+            f_x, g_x = f_fp(x)
+            self.check(x, f_x)
+            return f_x, g_x
+        return tracked
+
+def _run_restart(job, problem=None):
+    """
+    Optimize the model of the restart problem (defaults to the problem of
+    the worker process) from the starting parameters of job = (i, x0).
+
+    Returns (i, optimizer, error), the optimizer is None if the time budget
+    was exhausted before the start. If the restart failed, error is the
+    exception and its traceback (formatted, in worker processes).
+    """
+    i, x0 = job
+    in_worker = problem is None
+    if in_worker:
+        problem = _worker_restart_problem
+    model, kwargs, best, deadline, dominance_margin, dominance_evals = problem
+    if deadline is not None and time.time() > deadline:
+        return i, None, None
+    kwargs = kwargs.copy()
+    tracker = _RestartTracker(best, deadline, dominance_margin, dominance_evals)
+    try:
+        opt = optimization.get_optimizer(kwargs.pop('optimizer', model.preferred_optimizer))(x0, model=model, **kwargs)
+        try:
+            opt.run(f_fp=tracker.f_fp(model.objective_and_gradients), f=tracker.f(model.objective_function), fp=model.objective_function_gradients)
+            with best.get_lock():
+                best.value = min(best.value, opt.f_opt)
+        except _RestartStopped as e:
+            opt.x_opt, opt.f_opt, opt.funct_eval, opt.status = tracker.x_best, tracker.f_best, tracker.evals, str(e)
+    except Exception as e:
+        return i, None, (e, traceback.format_exc() if in_worker else sys.exc_info()[2])
+    # do not send the model back with the result, optimize_restarts reattaches it
+    opt.model = None
+    return i, opt, None
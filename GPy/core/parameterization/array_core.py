@@ -24,7 +24,6 @@ class ObservableArray(np.ndarray, Observable):
         if not isinstance(input_array, ObservableArray):
             obj = np.atleast_1d(np.require(input_array, dtype=np.float64, requirements=['C', 'W'])).view(cls)
         else: obj = input_array
-        cls.__name__ = "ObservableArray\n     "
         super(ObservableArray, obj).__init__(*a, **kw)
         return obj
 
@@ -36,6 +35,11 @@ class ObservableArray(np.ndarray, Observable):
     def __array_wrap__(self, out_arr, context=None):
         return out_arr.view(np.ndarray)
 
+    def __setstate__(self, state):
+        super(ObservableArray, self).__setstate__(state)
+        # the observers are not pickled, their owners add them again
+        self._observer_callables_ = []
+
     def _s_not_empty(self, s):
         # this checks whether there is something picked by this slice.
         return True
@@ -25,7 +25,7 @@ class ParameterIndexOperations(object):
                 self.add(t, i)
         
     def __getstate__(self):
-        return self._properties#, self._reverse
+        return [self._properties]#, self._reverse
         
     def __setstate__(self, state):
         self._properties = state[0]
@@ -12,6 +12,11 @@ class DefaultArrayDict(defaultdict):
         """
         defaultdict.__init__(self, self.default_factory)
 
+    def __reduce__(self):
+        # the default factory is a bound method, which cannot be pickled:
+        # rebuild from the class (which sets the factory) and the items
+        return type(self), (), None, None, self.iteritems()
+
 class SetDict(DefaultArrayDict):
     def default_factory(self):
         return set()
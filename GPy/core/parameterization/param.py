@@ -106,7 +106,7 @@ class Param(OptimizationHandlable, ObservableArray):
     #===========================================================================
     # Pickling operations
     #===========================================================================
-    def __reduce_ex__(self):
+    def __reduce_ex__(self, protocol=None):
         func, args, state = super(Param, self).__reduce__()
         return func, args, (state,
                             (self.name,
@@ -134,7 +134,11 @@ class Param(OptimizationHandlable, ObservableArray):
         self._default_constraint_ = state.pop()
         self._parent_index_ = state.pop()
         self._parent_ = state.pop()
-        self.name = state.pop()
+        self._name = state.pop()
+        # not pickled, the parent connects the gradient, constraints and observers
+        self._original_ = True
+        self._gradient_array_ = numpy.zeros(self.shape, dtype=numpy.float64)
+        self.constraints = self.priors = None
     
     def copy(self, *args):
         constr = self.constraints.copy()
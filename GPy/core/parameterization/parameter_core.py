@@ -39,7 +39,12 @@ class Observable(object):
     This Object allows for observers to register with self and a (bound!) function
     as an observer. Every time the observable changes, it sends a notification with
     self as only argument to all its observers.
+
+    Additionally, every notification increases the version counter _version_
+    of this object, such that caches can check for changes in O(1)
+    (see :py:class:`~GPy.util.caching.Cacher`).
     """
+    _version_ = 0
     def __init__(self, *args, **kwargs):
         super(Observable, self).__init__()
         self._observer_callables_ = []
@@ -71,6 +76,7 @@ class Observable(object):
         :param min_priority: only notify observers with priority > min_priority
                              if min_priority is None, notify all observers in order
         """
+        self._version_ += 1
         if which is None:
             which = self
         if min_priority is None:
@@ -96,6 +102,12 @@ class Pickleable(object):
     This class allows for pickling support by Memento pattern.
     _getstate returns a memento of the class, which gets pickled.
     _setstate(<memento>) (re-)sets the state of the class to the memento 
+
+    Classes without a memento pickle their __dict__, without the observers
+    (bound methods cannot be pickled). _unpickled() is called after such a
+    __dict__ was set, to connect the object again.
+
+    Caches (see :py:class:`~GPy.util.caching.Cacher`) are pickled empty.
     """
     #===========================================================================
     # Pickling operations
@@ -116,13 +128,21 @@ class Pickleable(object):
     def __getstate__(self):
         if self._has_get_set_state():
             return self._getstate()
-        return self.__dict__
+        state = self.__dict__.copy()
+        state.pop('_observer_callables_', None)
+        return state
     def __setstate__(self, state):
         if self._has_get_set_state():
             self._setstate(state)  
             # TODO: maybe parameters_changed() here?
             return
         self.__dict__ = state
+        self._unpickled()
+    def _unpickled(self):
+        """
+        Connect this object again, after its __dict__ was unpickled.
+        """
+        pass
     def _has_get_set_state(self):
         return '_getstate' in vars(self.__class__) and '_setstate' in vars(self.__class__)
     def _getstate(self):
@@ -626,11 +646,19 @@ class OptimizationHandlable(Constrainable, Observable):
         :param float scale: scale parameter for random number generator
         :param args, kwargs: will be passed through to random number generator
         """
+        x = self._random_params_transformed(rand_gen, loc, scale, *args, **kwargs)
+        self._set_params_transformed(x) # makes sure all of the tied parameters get the same init (since there's only one prior object...)
+
+    def _random_params_transformed(self, rand_gen=np.random.normal, loc=0, scale=1, *args, **kwargs):
+        """
+        Draw a random (transformed) parameter vector as randomize does,
+        without setting it.
+        """
         # first take care of all parameters (from N(0,1))
         x = rand_gen(loc=loc, scale=scale, size=self._size_transformed(), *args, **kwargs)
         # now draw from prior where possible
         [np.put(x, ind, p.rvs(ind.size)) for p, ind in self.priors.iteritems() if not p is None]
-        self._set_params_transformed(x) # makes sure all of the tied parameters get the same init (since there's only one prior object...)
+        return x
 
     #===========================================================================
     # For shared memory arrays. This does nothing in Param, but sets the memory
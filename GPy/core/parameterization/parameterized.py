@@ -7,7 +7,7 @@ import cPickle
 import itertools
 from re import compile, _pattern_type
 from param import ParamConcatenation
-from parameter_core import Pickleable, Parameterizable, adjust_name_for_printing
+from parameter_core import Pickleable, Parameterizable, HierarchyError, adjust_name_for_printing
 from transformations import __fixed__
 from lists_and_dicts import ArrayList
 
@@ -127,8 +127,40 @@ class Parameterized(Parameterizable, Pickleable):
         self.constraints = state.pop()
         self.priors = state.pop()
         self._fixes_ = state.pop()
-        self._connect_parameters()
+        self._unpickled()
         self.parameters_changed()
+
+    def _unpickled(self):
+        """
+        Connect the unpickled parameters: share their memory with this object
+        again, and add the observers of the hierarchy again.
+        """
+        self.size = sum(p.size for p in self._parameters_)
+        self._connect_parameters()
+        self._notify_parent_change()
+        self._observer_callables_ = []
+        self.add_observer(self, self._parameters_changed_notification, -100)
+        for p in self._parameters_:
+            p.add_observer(self, self._pass_through_notify_observers, -np.inf)
+    def parameter_state(self):
+        """
+        Shallow snapshot of this object: the structure (the names of all
+        parameters) and the parameter values, without the data, caches and
+        observers. It is small and picklable, e.g. to send to workers which
+        hold a model of the same structure, see :py:meth:`set_parameter_state`.
+        """
+        return dict(names=self._get_param_names(), param_array=self._param_array_.copy())
+
+    def set_parameter_state(self, state):
+        """
+        Set the parameters from a snapshot of :py:meth:`parameter_state`,
+        taken from an object of the same structure.
+        """
+        if not numpy.array_equal(state['names'], self._get_param_names()):
+            raise HierarchyError, "the parameter state was taken from an object of a different structure"
+        self._param_array_[:] = state['param_array']
+        self._trigger_params_changed()
+
     #===========================================================================
     # Override copy to handle programmatically added observers
     #===========================================================================
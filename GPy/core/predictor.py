@@ -0,0 +1,204 @@
+# Copyright (c) 2014, GPy authors (see AUTHORS.txt).
+# Licensed under the BSD 3-clause license (see LICENSE.txt)
+
+"""
+Compact predictors for serving the posterior of a GP, see
+:py:meth:`GPy.core.gp.GP.export_predictor`.
+
+A :py:class:`Predictor` only holds numpy arrays, strings and tuples: the
+kernel is frozen into a nested tuple (see :py:func:`freeze_kern`), which is
+evaluated by the module level functions below. Evaluating a predictor needs
+nothing but numpy, and the state of a predictor (:py:meth:`Predictor.to_dict`)
+can be evaluated by the pure function :py:func:`predict`.
+"""
+
+import numpy as np
+
+def _rbf(r, power):
+    return np.exp(-0.5 * r**2)
+
+def _exponential(r, power):
+    return np.exp(-0.5 * r)
+
+def _matern32(r, power):
+    return (1. + np.sqrt(3.) * r) * np.exp(-np.sqrt(3.) * r)
+
+def _matern52(r, power):
+    return (1. + np.sqrt(5.) * r + 5./3 * r**2) * np.exp(-np.sqrt(5.) * r)
+
+def _cosine(r, power):
+    return np.cos(r)
+
+def _ratquad(r, power):
+    return np.power(1. + r**2/2., -power)
+
+_k_of_r = {'rbf':_rbf, 'exponential':_exponential, 'matern32':_matern32,
+           'matern52':_matern52, 'cosine':_cosine, 'ratquad':_ratquad}
+
+def freeze_kern(kern, X):
+    """
+    Freeze the kernel kern, evaluated against the (training) inputs X, into a
+    nested tuple of numpy arrays, floats and strings. Quantities which only
+    depend on X (e.g. the scaled inputs of stationary kernels) are precomputed.
+
+    Supported are the stationary kernels, Linear, Bias and White, and sums and
+    products of those.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    return _freeze(kern, X, np.arange(X.shape[1]))
+
+def _freeze(kern, X, cols):
+    from ..kern._src.stationary import Stationary, Exponential, Matern32, Matern52, ExpQuad, Cosine, RatQuad
+    from ..kern._src.rbf import RBF
+    from ..kern._src.linear import Linear
+    from ..kern._src.static import Bias, White
+    from ..kern._src.add import Add
+    from ..kern._src.prod import Prod
+    if isinstance(kern, Add):
+        return ('add', tuple([_freeze(p, X, cols[i_s]) for p, i_s in zip(kern._parameters_, kern.input_slices)]))
+    if isinstance(kern, Prod):
+        return ('prod', (_freeze(kern.k1, X, cols[kern.slice1]), _freeze(kern.k2, X, cols[kern.slice2])))
+    if isinstance(kern, Stationary):
+        forms = [(RBF, 'rbf'), (ExpQuad, 'rbf'), (Exponential, 'exponential'), (Matern32, 'matern32'),
+                 (Matern52, 'matern52'), (Cosine, 'cosine'), (RatQuad, 'ratquad')]
+        form = [f for c, f in forms if type(kern) is c]
+        if len(form) == 0:
+            raise NotImplementedError, "cannot freeze kernel {}".format(kern.name)
+        lengthscale = np.array(kern.lengthscale, dtype=np.float64)
+        power = float(kern.power) if isinstance(kern, RatQuad) else None
+        Xl = X[:, cols] / lengthscale
+        return ('stationary', (form[0], float(kern.variance), lengthscale, power, cols, Xl, np.sum(np.square(Xl), 1)))
+    if isinstance(kern, Linear):
+        variances = np.array(kern.variances, dtype=np.float64)
+        return ('linear', (variances, cols, X[:, cols] * variances))
+    if isinstance(kern, Bias):
+        return ('bias', (float(kern.variance), X.shape[0]))
+    if isinstance(kern, White):
+        return ('white', (float(kern.variance), X.shape[0]))
+    raise NotImplementedError, "cannot freeze kernel {}".format(kern.name)
+
+def _scaled_dist(Xl, Xl2, X2l, X2l2):
+    r2 = -2.*np.dot(Xl, X2l.T) + Xl2[:, None] + X2l2[None, :]
+    return np.sqrt(np.clip(r2, 0, np.inf))
+
+def kern_cross(frozen, Xnew):
+    """
+    The covariance between the points Xnew and the inputs the kernel was frozen with.
+    """
+    kind, p = frozen
+    if kind == 'stationary':
+        form, variance, lengthscale, power, cols, Xl, Xl2 = p
+        Xnewl = Xnew[:, cols] / lengthscale
+        return variance * _k_of_r[form](_scaled_dist(Xnewl, np.sum(np.square(Xnewl), 1), Xl, Xl2), power)
+    if kind == 'linear':
+        return np.dot(Xnew[:, p[1]], p[2].T)
+    if kind == 'add':
+        return reduce(np.add, [kern_cross(f, Xnew) for f in p])
+    if kind == 'prod':
+        return kern_cross(p[0], Xnew) * kern_cross(p[1], Xnew)
+    if kind == 'bias':
+        return np.ones((Xnew.shape[0], p[1])) * p[0]
+    return np.zeros((Xnew.shape[0], p[1]))
+
+def kern_full(frozen, Xnew):
+    """
+    The prior covariance between all points in Xnew.
+    """
+    kind, p = frozen
+    if kind == 'stationary':
+        form, variance, lengthscale, power, cols, _, _ = p
+        Xnewl = Xnew[:, cols] / lengthscale
+        Xnewl2 = np.sum(np.square(Xnewl), 1)
+        return variance * _k_of_r[form](_scaled_dist(Xnewl, Xnewl2, Xnewl, Xnewl2), power)
+    if kind == 'linear':
+        XV = Xnew[:, p[1]] * np.sqrt(p[0])
+        return np.dot(XV, XV.T)
+    if kind == 'add':
+        return reduce(np.add, [kern_full(f, Xnew) for f in p])
+    if kind == 'prod':
+        return kern_full(p[0], Xnew) * kern_full(p[1], Xnew)
+    if kind == 'bias':
+        return np.ones((Xnew.shape[0], Xnew.shape[0])) * p[0]
+    return np.eye(Xnew.shape[0]) * p[0]
+
+def kern_diag(frozen, Xnew):
+    """
+    The prior variance of the points in Xnew.
+    """
+    kind, p = frozen
+    if kind == 'stationary':
+        return np.ones(Xnew.shape[0]) * p[1] * _k_of_r[p[0]](np.zeros(1), p[3])
+    if kind == 'linear':
+        return np.sum(p[0] * np.square(Xnew[:, p[1]]), 1)
+    if kind == 'add':
+        return reduce(np.add, [kern_diag(f, Xnew) for f in p])
+    if kind == 'prod':
+        return kern_diag(p[0], Xnew) * kern_diag(p[1], Xnew)
+    return np.ones(Xnew.shape[0]) * p[0]
+
+def predict(state, Xnew, full_cov=False, include_likelihood=True):
+    """
+    Predict at the points Xnew, given the state of a :py:class:`Predictor`
+    (see :py:meth:`Predictor.to_dict`).
+
+    :returns: mean (Nnew x output_dim) and variance (Nnew x 1, or Nnew x Nnew if full_cov)
+    """
+    Xnew = np.atleast_2d(Xnew)
+    Kx = kern_cross(state['kern'], Xnew)
+    mu = np.dot(Kx, state['woodbury_vector'])
+    if state['Li'] is not None:
+        LiKx = np.dot(state['Li'], Kx.T)
+        if full_cov:
+            var = kern_full(state['kern'], Xnew) - np.dot(LiKx.T, LiKx)
+        else:
+            var = kern_diag(state['kern'], Xnew) - np.sum(LiKx*LiKx, 0)
+    else:
+        WiKx = np.dot(state['Wi'], Kx.T)
+        if full_cov:
+            var = kern_full(state['kern'], Xnew) - np.dot(Kx, WiKx)
+        else:
+            var = kern_diag(state['kern'], Xnew) - np.sum(WiKx*Kx.T, 0)
+    if include_likelihood and state['noise_variance'] is not None:
+        if full_cov:
+            var += np.eye(var.shape[0]) * state['noise_variance']
+        else:
+            var += state['noise_variance']
+    if not full_cov:
+        var = var[:, None]
+    return mu, var
+
+class Predictor(object):
+    """
+    A frozen snapshot of the posterior of a GP, for fast prediction at new
+    points. It holds the frozen kernel, the woodbury vector and either the
+    inverse Li of the cholesky factor of K + noise (exact inference) or the
+    woodbury inverse Wi. The predictor is picklable and only needs numpy.
+
+    :param kern: the frozen kernel, see :py:func:`freeze_kern`
+    :param woodbury_vector: the woodbury vector of the posterior (N x output_dim)
+    :param Li: lower triangular matrix, such that the posterior covariance is K - K Li^T Li K
+    :param Wi: woodbury inverse, such that the posterior covariance is K - K Wi K (if Li is None)
+    :param noise_variance: the variance of a Gaussian likelihood, or None
+    """
+    def __init__(self, kern, woodbury_vector, Li=None, Wi=None, noise_variance=None):
+        assert (Li is not None) or (Wi is not None), "need the (inverse) cholesky or the woodbury inverse"
+        self.kern = kern
+        self.woodbury_vector = np.asarray(woodbury_vector, dtype=np.float64)
+        self.Li = None if Li is None else np.ascontiguousarray(Li)
+        self.Wi = None if Wi is None else np.ascontiguousarray(Wi)
+        self.noise_variance = noise_variance
+
+    def predict(self, Xnew, full_cov=False, include_likelihood=True):
+        """
+        Predict at the points Xnew.
+
+        :param include_likelihood: add the noise variance of a Gaussian likelihood
+        :returns: mean (Nnew x output_dim) and variance (Nnew x 1, or Nnew x Nnew if full_cov)
+        """
+        return predict(self.__dict__, Xnew, full_cov, include_likelihood)
+
+    def to_dict(self):
+        """
+        The state of this predictor, which can be used with :py:func:`predict`.
+        """
+        return dict(self.__dict__)
@@ -4,6 +4,7 @@
 import numpy as np
 from gp import GP
 from parameterization.param import Param
+from parameterization import ObservableArray
 from ..inference.latent_function_inference import var_dtc
 from .. import likelihoods
 from parameterization.variational import VariationalPosterior
@@ -44,6 +45,8 @@ class SparseGP(GP):
 
         self.Z = Param('inducing inputs', Z)
         self.num_inducing = Z.shape[0]
+        # sufficient statistics of the data for online updates, see append_data
+        self._data_statistics = None
 
         GP.__init__(self, X, Y, kernel, likelihood, inference_method=inference_method, name=name)
 
@@ -53,9 +56,16 @@ class SparseGP(GP):
         return isinstance(self.X, VariationalPosterior)
 
     def parameters_changed(self):
+        self._data_statistics = None
         self.posterior, self._log_marginal_likelihood, self.grad_dict = self.inference_method.inference(self.kern, self.X, self.Z, self.likelihood, self.Y)
         self.likelihood.update_gradients(self.grad_dict.pop('partial_for_likelihood'))
-        if isinstance(self.X, VariationalPosterior):
+        if 'kern_gradient' in self.grad_dict:
+            #the inference streamed over the data and accumulated the gradients of the data terms
+            dL_dKmm = self.grad_dict['dL_dKmm']
+            self.kern.update_gradients_full(dL_dKmm, self.Z, None)
+            self.kern.gradient += self.grad_dict['kern_gradient']
+            self.Z.gradient = self.kern.gradients_X(dL_dKmm, self.Z) + self.grad_dict['Z_gradient']
+        elif isinstance(self.X, VariationalPosterior):
             #gradients wrt kernel
             dL_dKmm = self.grad_dict.pop('dL_dKmm')
             self.kern.update_gradients_full(dL_dKmm, self.Z, None)
@@ -80,6 +90,40 @@ class SparseGP(GP):
             self.Z.gradient = self.kern.gradients_X(self.grad_dict['dL_dKmm'], self.Z)
             self.Z.gradient += self.kern.gradients_X(self.grad_dict['dL_dKnm'].T, self.Z, self.X)
 
+    def append_data(self, Xnew, Ynew, keep_data=True):
+        """
+        Fold the observations Xnew, Ynew into the model, with the kernel and
+        likelihood parameters and Z held fixed.
+
+        The VarDTC posterior (with homoscedastic Gaussian noise) depends on the
+        data only through its sufficient statistics (see
+        :py:func:`~GPy.inference.latent_function_inference.var_dtc.sufficient_statistics`).
+        The statistics of the new data are added to the ones of the old data
+        and the posterior is refreshed from them, in O(k M^2 + M^3) for k new
+        points. The statistics of the old data are computed once, at the first
+        update after a change of the parameters.
+
+        The gradients are not updated, they are recomputed on the data of the
+        model as soon as the parameters change.
+
+        :param Xnew: the new inputs (k x input_dim)
+        :param Ynew: the new outputs (k x output_dim)
+        :param bool keep_data: whether to add the new data to X and Y. If False,
+            the model does not hold on to the new data: it is part of the
+            posterior and log likelihood, but not of the inference after a
+            change of the parameters.
+        """
+        assert not self.has_uncertain_inputs(), "online updates only for fixed inputs"
+        if self._data_statistics is None:
+            self._data_statistics = var_dtc.sufficient_statistics(self.kern, self.Z, self.X, self.Y)
+        self._data_statistics = var_dtc.add_statistics(self._data_statistics,
+                                                       var_dtc.sufficient_statistics(self.kern, self.Z, Xnew, Ynew))
+        self.posterior, self._log_marginal_likelihood = var_dtc.posterior_from_statistics(self.kern, self.Z, self.likelihood, self._data_statistics)
+        if keep_data:
+            self.X = ObservableArray(np.vstack((self.X, Xnew)))
+            self.Y = ObservableArray(np.vstack((self.Y, Ynew)))
+            self.num_data = self.X.shape[0]
+
     def _raw_predict(self, Xnew, full_cov=False):
         """
         Make a prediction for the latent function values
@@ -106,6 +150,13 @@ class SparseGP(GP):
         return mu, var
 
 
+    def export_predictor(self):
+        """
+        Export a compact, picklable snapshot of the current posterior, which
+        predicts from the inducing inputs, see :py:meth:`GPy.core.gp.GP.export_predictor`.
+        """
+        return self._export_predictor(self.Z)
+
     def _getstate(self):
         """
         Get the current state of the class,
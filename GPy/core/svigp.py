@@ -2,8 +2,16 @@
 # Licensed under the BSD 3-clause license (see LICENSE.txt)
 
 import numpy as np
-from ..util.linalg import pdinv, mdot, tdot, dpotrs, dtrtrs, jitchol, backsub_both_sides
+from ..util.linalg import pdinv, mdot, tdot, dpotrs, dpotri, dtrtrs, jitchol, backsub_both_sides
+from ..util.minibatch import MinibatchLoader
+from .. import kern
+from .. import likelihoods
 from gp import GP
+from model import Model
+from parameterization.param import Param
+from parameterization.variational import NormalPosterior, VariationalPosterior
+from ..inference.optimization.natural_gradient import CanonicalBlock
+from numpy.linalg.linalg import LinAlgError
 import time
 import sys
 
@@ -13,64 +21,72 @@ class SVIGP(GP):
 
     Stochastic Variational inference in a Gaussian Process
 
-    :param X: inputs
-    :type X: np.ndarray (N x Q)
-    :param Y: observed data
-    :type Y: np.ndarray of observations (N x D)
-    :param batchsize: the size of a h
+    The distribution q(u) of the inducing outputs is not a parameter of the
+    model: it is held in its canonical parameters (see set_vb_param and
+    get_vb_param) and updated by natural gradient steps in optimize. The
+    kernel, likelihood and inducing inputs are parameters as usual, their
+    gradients are the gradients of the (rescaled) bound on the current batch.
 
-    Additional kwargs are used as for a sparse GP. They include:
+    The minibatches are drawn by a :py:class:`~GPy.util.minibatch.MinibatchLoader`,
+    which reads the rows of X and Y (in memory or np.memmap) and prepares the
+    next batch on a background thread while the current step runs.
 
-    :param q_u: canonical parameters of the distribution sqehd into a 1D array
-    :type q_u: np.ndarray
-    :param M: Number of inducing points (optional, default 10. Ignored if Z is not None)
-    :type M: int
+    :param X: inputs
+    :type X: np.ndarray | np.memmap (N x Q)
+    :param Y: observed data
+    :type Y: np.ndarray | np.memmap (N x D)
+    :param Z: inducing inputs
+    :type Z: np.ndarray (M x Q)
     :param kernel: the kernel/covariance function. See link kernels
     :type kernel: a GPy kernel
-    :param Z: inducing inputs (optional, see note)
-    :type Z: np.ndarray (M x Q) | None
-    :param X_uncertainty: The uncertainty in the measurements of X (Gaussian variance)
-    :type X_uncertainty: np.ndarray (N x Q) | None
-    :param Zslices: slices for the inducing inputs (see slicing TODO: link)
-    :param M: Number of inducing points (optional, default 10. Ignored if Z is not None)
-    :type M: int
-    :param beta: noise precision. TODO: ignore beta if doing EP
-    :type beta: float
-    :param normalize_(X|Y): whether to normalize the data before computing (predictions will be in original scales)
-    :type normalize_(X|Y): bool
+    :param likelihood: a Gaussian likelihood
+    :param q_u: canonical parameters of the distribution q(u), flattened into a 1D array
+    :type q_u: np.ndarray
+    :param batchsize: the number of data points in a batch
+    :type batchsize: int
+    :param X_variance: The uncertainty in the measurements of X (Gaussian variance)
+    :type X_variance: np.ndarray (N x Q) | None
+    :param bool prefetch: whether to load the next batch in the background
 
     """
 
 
-    def __init__(self, X, likelihood, kernel, Z, q_u=None, batchsize=10, X_variance=None):
-        GP.__init__(self, X, likelihood, kernel, normalize_X=False)
-        self.batchsize=batchsize
-        self.Y = self.likelihood.Y.copy()
-        self.Z = Z
+    def __init__(self, X, Y, Z, kernel, likelihood, q_u=None, batchsize=10, X_variance=None, prefetch=True, name='SVIGP'):
+        Model.__init__(self, name)
+
+        assert X.ndim == 2 and Y.ndim == 2
+        assert X.shape[0] == Y.shape[0]
+        self.X, self.Y, self.X_variance = X, Y, X_variance
+        self.num_data, self.input_dim = X.shape
+        self.output_dim = Y.shape[1]
+
+        assert isinstance(kernel, kern.Kern)
+        assert self.input_dim == kernel.input_dim
+        self.kern = kernel
+        assert isinstance(likelihood, likelihoods.Gaussian), "SVIGP needs a Gaussian likelihood"
+        self.likelihood = likelihood
+        # the model does its own inference, see parameters_changed
+        self.inference_method = None
+        self.Y_metadata = None
+
+        self.Z = Param('inducing inputs', Z)
         self.num_inducing = Z.shape[0]
 
-        self.batchcounter = 0
+        self.batchsize = batchsize
+        self._loader = MinibatchLoader([X, Y, X_variance], batchsize, prefetch=prefetch)
+
         self.epochs = 0
         self.iterations = 0
 
         self.vb_steplength = 0.05
         self.param_steplength = 1e-5
         self.momentum = 0.9
-
-        if X_variance is None:
-            self.has_uncertain_inputs = False
-        else:
-            self.has_uncertain_inputs = True
-            self.X_variance = X_variance
-
+        self.preferred_optimizer = 'natgrad'
 
         if q_u is None:
-             q_u = np.hstack((np.random.randn(self.num_inducing*self.output_dim),-.5*np.eye(self.num_inducing).flatten()))
+            q_u = np.hstack((np.random.randn(self.num_inducing*self.output_dim),-.5*np.eye(self.num_inducing).flatten()))
         self.set_vb_param(q_u)
 
-        self._permutation = np.random.permutation(self.num_data)
-        self.load_batch()
-
         self._param_trace = []
         self._ll_trace = []
         self._grad_trace = []
@@ -89,18 +105,25 @@ class SVIGP(GP):
         self._param_steplength_trace = []
         self._vb_steplength_trace = []
 
+        #the computations on the first batch happen in parameters_changed
+        self.next_batch()
+        self.add_parameters(self.Z, self.kern, self.likelihood)
+
+    def has_uncertain_inputs(self):
+        return self.X_variance is not None
+
     def _getstate(self):
         steplength_params = [self.hbar_t, self.tau_t, self.gbar_t, self.gbar_t1, self.gbar_t2, self.hbar_tp, self.tau_tp, self.gbar_tp, self.adapt_param_steplength, self.adapt_vb_steplength, self.vb_steplength, self.param_steplength]
         return GP._getstate(self) + \
             [self.get_vb_param(),
              self.Z,
              self.num_inducing,
-             self.has_uncertain_inputs,
              self.X_variance,
              self.X_batch,
+             self.Y_batch,
              self.X_variance_batch,
+             self._loader,
              steplength_params,
-             self.batchcounter,
              self.batchsize,
              self.epochs,
              self.momentum,
@@ -110,15 +133,11 @@ class SVIGP(GP):
              self._vb_steplength_trace,
              self._ll_trace,
              self._grad_trace,
-             self.Y,
-             self._permutation,
              self.iterations
             ]
 
     def _setstate(self, state):
         self.iterations = state.pop()
-        self._permutation = state.pop()
-        self.Y = state.pop()
         self._grad_trace = state.pop()
         self._ll_trace = state.pop()
         self._vb_steplength_trace = state.pop()
@@ -128,106 +147,73 @@ class SVIGP(GP):
         self.momentum = state.pop()
         self.epochs = state.pop()
         self.batchsize = state.pop()
-        self.batchcounter = state.pop()
         steplength_params = state.pop()
         (self.hbar_t, self.tau_t, self.gbar_t, self.gbar_t1, self.gbar_t2, self.hbar_tp, self.tau_tp, self.gbar_tp, self.adapt_param_steplength, self.adapt_vb_steplength, self.vb_steplength, self.param_steplength) = steplength_params
+        self._loader = state.pop()
         self.X_variance_batch = state.pop()
+        self.Y_batch = state.pop()
         self.X_batch = state.pop()
         self.X_variance = state.pop()
-        self.has_uncertain_inputs = state.pop()
         self.num_inducing = state.pop()
         self.Z = state.pop()
         vb_param = state.pop()
-        GP._setstate(self, state)
+        # q(u) is needed by parameters_changed in GP._setstate: take the
+        # output_dim from the GP state (which ends with output_dim, Y, Y_metadata, inference_method)
+        self.output_dim = state[-4]
         self.set_vb_param(vb_param)
+        GP._setstate(self, state)
+
+    def next_batch(self):
+        """
+        Take the next batch from the loader, without any computations: the
+        bound is computed on it at the next change of the parameters (see
+        Model.next_batch, the hook of the stochastic optimizers).
+        """
+        self.epochs, _, (self.X_batch, self.Y_batch, self.X_variance_batch) = self._loader.next()
+        self.data_prop = float(self.batchsize)/self.num_data
+        return True
+
+    def load_batch(self):
+        """
+        load the next batch of data (set self.X_batch, self.Y_batch) and
+        recompute the bound and its gradients on it
+        """
+        self.next_batch()
+        self.parameters_changed()
 
     def _compute_kernel_matrices(self):
         # kernel computations, using BGPLVM notation
         self.Kmm = self.kern.K(self.Z)
-        if self.has_uncertain_inputs:
-            self.psi0 = self.kern.psi0(self.Z, self.X_batch, self.X_variance_batch)
-            self.psi1 = self.kern.psi1(self.Z, self.X_batch, self.X_variance_batch)
-            self.psi2 = self.kern.psi2(self.Z, self.X_batch, self.X_variance_batch)
+        if self.has_uncertain_inputs():
+            self.X_q_batch = NormalPosterior(self.X_batch, self.X_variance_batch)
+            self.psi0 = self.kern.psi0(self.Z, self.X_q_batch)
+            self.psi1 = self.kern.psi1(self.Z, self.X_q_batch)
+            self.psi2 = self.kern.psi2_sum(self.Z, self.X_q_batch)
         else:
             self.psi0 = self.kern.Kdiag(self.X_batch)
             self.psi1 = self.kern.K(self.X_batch, self.Z)
             self.psi2 = None
 
-    def dL_dtheta(self):
-        dL_dtheta = self.kern._param_grad_helper(self.dL_dKmm, self.Z)
-        if self.has_uncertain_inputs:
-            dL_dtheta += self.kern.dpsi0_dtheta(self.dL_dpsi0, self.Z, self.X_batch, self.X_variance_batch)
-            dL_dtheta += self.kern.dpsi1_dtheta(self.dL_dpsi1, self.Z, self.X_batch, self.X_variance_batch)
-            dL_dtheta += self.kern.dpsi2_dtheta(self.dL_dpsi2, self.Z, self.X_batch, self.X_variance_batch)
-        else:
-            dL_dtheta += self.kern._param_grad_helper(self.dL_dpsi1, self.X_batch, self.Z)
-            dL_dtheta += self.kern.dKdiag_dtheta(self.dL_dpsi0, self.X_batch)
-        return dL_dtheta
-
-    def _set_params(self, p, computations=True):
-        self.kern._set_params_transformed(p[:self.kern.num_params])
-        self.likelihood._set_params(p[self.kern.num_params:])
-        if computations:
-            self._compute_kernel_matrices()
-            self._computations()
-
-    def _get_params(self):
-        return np.hstack((self.kern._get_params_transformed() , self.likelihood._get_params()))
-
-    def _get_param_names(self):
-        return self.kern._get_param_names_transformed() + self.likelihood._get_param_names()
-
-    def load_batch(self):
+    def parameters_changed(self):
         """
-        load a batch of data (set self.X_batch and self.likelihood.Y from self.X, self.Y)
+        All of the computations on the current batch: the bound and the
+        gradients of the parameters, for the current distribution q(u).
         """
-
-        #if we've seen all the data, start again with them in a new random order
-        if self.batchcounter+self.batchsize > self.num_data:
-            self.batchcounter = 0
-            self.epochs += 1
-            self._permutation = np.random.permutation(self.num_data)
-
-        this_perm = self._permutation[self.batchcounter:self.batchcounter+self.batchsize]
-
-        self.X_batch = self.X[this_perm]
-        self.likelihood.set_data(self.Y[this_perm])
-        if self.has_uncertain_inputs:
-            self.X_variance_batch = self.X_variance[this_perm]
-
-        self.batchcounter += self.batchsize
-
-        self.data_prop = float(self.batchsize)/self.num_data
-
         self._compute_kernel_matrices()
-        self._computations()
-
-    def _computations(self,do_Kmm=True, do_Kmm_grad=True):
-        """
-        All of the computations needed. Some are optional, see kwargs.
-        """
-
-        if do_Kmm:
-            self.Lm = jitchol(self.Kmm)
+        beta = 1./float(self.likelihood.variance)
+        self.Lm = jitchol(self.Kmm)
 
         # The rather complex computations of self.A
-        if self.has_uncertain_inputs:
-            if self.likelihood.is_heteroscedastic:
-                psi2_beta = (self.psi2 * (self.likelihood.precision.flatten().reshape(self.batchsize, 1, 1))).sum(0)
-            else:
-                psi2_beta = self.psi2.sum(0) * self.likelihood.precision
-            evals, evecs = np.linalg.eigh(psi2_beta)
+        if self.has_uncertain_inputs():
+            evals, evecs = np.linalg.eigh(self.psi2 * beta)
             clipped_evals = np.clip(evals, 0., 1e6) # TODO: make clipping configurable
             tmp = evecs * np.sqrt(clipped_evals)
         else:
-            if self.likelihood.is_heteroscedastic:
-                tmp = self.psi1.T * (np.sqrt(self.likelihood.precision.flatten().reshape(1, self.batchsize)))
-            else:
-                tmp = self.psi1.T * (np.sqrt(self.likelihood.precision))
+            tmp = self.psi1.T * np.sqrt(beta)
         tmp, _ = dtrtrs(self.Lm, np.asfortranarray(tmp), lower=1)
         self.A = tdot(tmp)
 
-        self.V = self.likelihood.precision*self.likelihood.Y
+        self.V = beta*self.Y_batch
         self.VmT = np.dot(self.V,self.q_u_expectation[0].T)
         self.psi1V = np.dot(self.psi1.T, self.V)
 
@@ -235,53 +221,77 @@ class SVIGP(GP):
         self.Lambda = backsub_both_sides(self.Lm, self.B.T)
         self.LQL = backsub_both_sides(self.Lm,self.q_u_expectation[1].T,transpose='right')
 
-        self.trace_K = self.psi0.sum() - np.trace(self.A)/self.likelihood.precision
+        self.trace_K = self.psi0.sum() - np.trace(self.A)/beta
         self.Kmmi_m, _ = dpotrs(self.Lm, self.q_u_expectation[0], lower=1)
         self.projected_mean = np.dot(self.psi1,self.Kmmi_m)
 
         # Compute dL_dpsi
-        self.dL_dpsi0 = - 0.5 * self.output_dim * self.likelihood.precision * np.ones(self.batchsize)
-        self.dL_dpsi1, _ = dpotrs(self.Lm,np.asfortranarray(self.VmT.T),lower=1)
-        self.dL_dpsi1 = self.dL_dpsi1.T
+        dL_dpsi0 = - 0.5 * self.output_dim * beta * np.ones(self.batchsize)
+        dL_dpsi1, _ = dpotrs(self.Lm,np.asfortranarray(self.VmT.T),lower=1)
+        dL_dpsi1 = dL_dpsi1.T
 
-        dL_dpsi2 = -0.5 * self.likelihood.precision * backsub_both_sides(self.Lm, self.LQL - self.output_dim * np.eye(self.num_inducing))
-        if self.has_uncertain_inputs:
-            self.dL_dpsi2 = np.repeat(dL_dpsi2[None,:,:],self.batchsize,axis=0)
-        else:
-            self.dL_dpsi1 += 2.*np.dot(dL_dpsi2,self.psi1.T).T
-            self.dL_dpsi2 = None
+        # psi2 is summed over the batch, so dL_dpsi2 stays M x M (see Kern.psi2_sum)
+        dL_dpsi2 = -0.5 * beta * backsub_both_sides(self.Lm, self.LQL - self.output_dim * np.eye(self.num_inducing))
+        if not self.has_uncertain_inputs():
+            dL_dpsi1 += 2.*np.dot(dL_dpsi2,self.psi1.T).T
 
         # Compute dL_dKmm
-        if do_Kmm_grad:
-            tmp = np.dot(self.LQL,self.A) - backsub_both_sides(self.Lm,np.dot(self.q_u_expectation[0],self.psi1V.T),transpose='right')
-            tmp += tmp.T
-            tmp += -self.output_dim*self.B
-            tmp += self.data_prop*self.LQL
-            self.dL_dKmm = 0.5*backsub_both_sides(self.Lm,tmp)
+        tmp = np.dot(self.LQL,self.A) - backsub_both_sides(self.Lm,np.dot(self.q_u_expectation[0],self.psi1V.T),transpose='right')
+        tmp += tmp.T
+        tmp += -self.output_dim*self.B
+        tmp += self.data_prop*self.LQL
+        dL_dKmm = 0.5*backsub_both_sides(self.Lm,tmp)
 
         #Compute the gradient of the log likelihood wrt noise variance
-        self.partial_for_likelihood =  -0.5*(self.batchsize*self.output_dim - np.sum(self.A*self.LQL))*self.likelihood.precision
-        self.partial_for_likelihood +=  (0.5*self.output_dim*self.trace_K + 0.5 * self.likelihood.trYYT - np.sum(self.likelihood.Y*self.projected_mean))*self.likelihood.precision**2
+        trYYT = np.sum(np.square(self.Y_batch))
+        partial_for_likelihood =  -0.5*(self.batchsize*self.output_dim - np.sum(self.A*self.LQL))*beta
+        partial_for_likelihood +=  (0.5*self.output_dim*self.trace_K + 0.5 * trYYT - np.sum(self.Y_batch*self.projected_mean))*beta**2
+
+        #the bound, as for the uncollapsed sparse GP, but accounting for the proportion of data we're looking at right now
+        A = -0.5*self.batchsize*self.output_dim*(np.log(2.*np.pi) - np.log(beta))
+        B = -0.5*beta*self.output_dim*self.trace_K
+        Kmm_logdet = 2.*np.sum(np.log(np.diag(self.Lm)))
+        C = -0.5*self.output_dim*self.data_prop*(Kmm_logdet-self.q_u_logdet - self.num_inducing)
+        C += -0.5*np.sum(self.LQL * self.B)
+        D = -0.5*beta*trYYT
+        E = np.sum(self.V*self.projected_mean)
+        self._log_marginal_likelihood = (A+B+C+D+E)/self.data_prop
+
+        #gradients wrt likelihood
+        self.likelihood.update_gradients(partial_for_likelihood)
+
+        if self.has_uncertain_inputs():
+            #gradients wrt kernel
+            self.kern.update_gradients_full(dL_dKmm, self.Z, None)
+            target = self.kern.gradient.copy()
+            self.kern.update_gradients_expectations(dL_dpsi0, dL_dpsi1, dL_dpsi2, self.Z, self.X_q_batch)
+            self.kern.gradient += target
+
+            #gradients wrt Z
+            self.Z.gradient = self.kern.gradients_X(dL_dKmm, self.Z)
+            self.Z.gradient += self.kern.gradients_Z_expectations(dL_dpsi1, dL_dpsi2, self.Z, self.X_q_batch)
+        else:
+            #gradients wrt kernel
+            self.kern.update_gradients_diag(dL_dpsi0, self.X_batch)
+            target = self.kern.gradient.copy()
+            self.kern.update_gradients_full(dL_dpsi1, self.X_batch, self.Z)
+            target += self.kern.gradient
+            self.kern.update_gradients_full(dL_dKmm, self.Z, None)
+            self.kern.gradient += target
 
+            #gradients wrt Z
+            self.Z.gradient = self.kern.gradients_X(dL_dKmm, self.Z)
+            self.Z.gradient += self.kern.gradients_X(dL_dpsi1.T, self.Z, self.X_batch)
+
+        self.gradient /= self.data_prop
 
     def log_likelihood(self):
         """
         As for uncollapsed sparse GP, but account for the proportion of data we're looking at right now.
 
-        NB. self.batchsize is the size of the batch, not the size of X_all
+        NB. self.batchsize is the size of the batch, not the size of X
         """
-        assert not self.likelihood.is_heteroscedastic
-        A = -0.5*self.batchsize*self.output_dim*(np.log(2.*np.pi) - np.log(self.likelihood.precision))
-        B = -0.5*self.likelihood.precision*self.output_dim*self.trace_K
-        Kmm_logdet = 2.*np.sum(np.log(np.diag(self.Lm)))
-        C = -0.5*self.output_dim*self.data_prop*(Kmm_logdet-self.q_u_logdet - self.num_inducing)
-        C += -0.5*np.sum(self.LQL * self.B)
-        D = -0.5*self.likelihood.precision*self.likelihood.trYYT
-        E = np.sum(self.V*self.projected_mean)
-        return (A+B+C+D+E)/self.data_prop
-
-    def _log_likelihood_gradients(self):
-        return np.hstack((self.dL_dtheta(), self.likelihood._gradients(partial=self.partial_for_likelihood)))/self.data_prop
+        return self._log_marginal_likelihood
 
     def vb_grad_natgrad(self):
         """
@@ -308,7 +318,30 @@ class SVIGP(GP):
         return np.hstack((dL_dm.flatten(),dL_dmmT_S.flatten())) , np.hstack((dL_dSim.flatten(), dL_dmhSi.flatten()))
 
 
-    def optimize(self, iterations, print_interval=10, callback=lambda:None, callback_interval=5):
+    def natural_gradient_blocks(self):
+        """
+        q(u), for the natural gradient optimizer (see Model.natural_gradient_blocks)
+        """
+        return [CanonicalBlock(self.get_vb_param, self.set_vb_param,
+                               lambda: self.vb_grad_natgrad()[0], self._vb_param_feasible)]
+
+    def _vb_param_feasible(self, vb_param):
+        prec = -2.*vb_param[self.num_inducing*self.output_dim:].reshape(self.num_inducing, self.num_inducing)
+        try:
+            np.linalg.cholesky(prec)
+        except LinAlgError:
+            return False
+        return True
+
+    def optimize_adaptive(self, iterations, print_interval=10, callback=lambda m:None, callback_interval=5):
+        """
+        Stochastic optimization with the adaptive steplength heuristics:
+        natural gradient steps in q(u) and gradient steps with momentum in
+        the parameters (after the first epoch), one batch per iteration.
+
+        See optimize('natgrad') for the natural gradient optimizer of the
+        inference package.
+        """
 
         param_step = 0.
 
@@ -316,12 +349,9 @@ class SVIGP(GP):
         for i in range(iterations):
 
             #store the current configuration for plotting later
-            self._param_trace.append(self._get_params())
+            self._param_trace.append(self._param_array_.copy())
             self._ll_trace.append(self.log_likelihood() + self.log_prior())
 
-            #load a batch
-            self.load_batch()
-
             #compute the (stochastic) gradient
             natgrads = self.vb_grad_natgrad()
             grads = self._transform_gradients(self._log_likelihood_gradients() + self._log_prior_gradients())
@@ -335,8 +365,10 @@ class SVIGP(GP):
                 param_step = 0.
 
             self.set_vb_param(self.get_vb_param() + vb_step)
-            #Note: don't recompute everything here, wait until the next iteration when we have a new batch
-            self._set_params(self._untransform_params(self._get_params_transformed() + param_step), computations=False)
+            #take the next batch (prefetched while we computed on this one), and
+            #recompute everything only once, on the new batch with the new parameters
+            self.next_batch()
+            self._set_params_transformed(self._get_params_transformed() + param_step)
 
             #print messages if desired
             if i and (not i%print_interval):
@@ -346,7 +378,7 @@ class SVIGP(GP):
 
             #callback
             if i and not i%callback_interval:
-                callback(self) # Change this to callback()
+                callback(self)
                 time.sleep(0.01)
 
             if self.epochs > 10:
@@ -414,52 +446,40 @@ class SVIGP(GP):
         self.vb_steplength *= decr_factor
         self.tau_t = self.tau_t*(1-self.vb_steplength) + 1
 
-    def _raw_predict(self, X_new, X_variance_new=None, which_parts='all',full_cov=False):
-        """Internal helper function for making predictions, does not account for normalization"""
-
-        #TODO: make this more efficient!
-        self.Kmmi, self.Lm, self.Lmi, self.Kmm_logdet = pdinv(self.Kmm)
-        tmp = self.Kmmi- mdot(self.Kmmi,self.q_u_cov,self.Kmmi)
+    def _raw_predict(self, Xnew, full_cov=False):
+        """
+        Make a prediction for the latent function values
+        """
+        Kmmi, _ = dpotri(self.Lm, lower=1)
+        tmp = Kmmi - mdot(Kmmi, self.q_u_cov, Kmmi)
 
-        if X_variance_new is None:
-            Kx = self.kern.K(X_new,self.Z)
-            mu = np.dot(Kx,self.Kmmi_m)
+        if not isinstance(Xnew, VariationalPosterior):
+            Kx = self.kern.K(Xnew, self.Z)
+            mu = np.dot(Kx, self.Kmmi_m)
             if full_cov:
-                Kxx = self.kern.K(X_new)
-                var = Kxx - mdot(Kx,tmp,Kx.T)
+                Kxx = self.kern.K(Xnew)
+                var = Kxx - mdot(Kx, tmp, Kx.T)
             else:
-                Kxx = self.kern.Kdiag(X_new)
-                var = (Kxx - np.sum(Kx*np.dot(Kx,tmp),1))[:,None]
+                Kxx = self.kern.Kdiag(Xnew)
+                var = (Kxx - np.sum(Kx*np.dot(Kx, tmp), 1))[:,None]
             return mu, var
         else:
-            assert X_variance_new.shape == X_new.shape
-            Kx = self.kern.psi1(self.Z,X_new, X_variance_new)
-            mu = np.dot(Kx,self.Kmmi_m)
-            Kxx = self.kern.psi0(self.Z,X_new,X_variance_new)
-            psi2 = self.kern.psi2(self.Z,X_new,X_variance_new)
-            diag_var = Kxx - np.sum(np.sum(psi2*tmp[None,:,:],1),1)
             if full_cov:
                 raise NotImplementedError
-            else:
-                return mu, diag_var[:,None]
-
-    def predict(self, Xnew, X_variance_new=None, which_parts='all', full_cov=False):
-        # normalize X values
-        Xnew = (Xnew.copy() - self._Xoffset) / self._Xscale
-        if X_variance_new is not None:
-            X_variance_new = X_variance_new / self._Xscale ** 2
-
-        # here's the actual prediction by the GP model
-        mu, var = self._raw_predict(Xnew, X_variance_new, full_cov=full_cov, which_parts=which_parts)
-
-        # now push through likelihood
-        mean, var, _025pm, _975pm = self.likelihood.predictive_values(mu, var, full_cov)
-
-        return mean, var, _025pm, _975pm
-
+            Kx = self.kern.psi1(self.Z, Xnew)
+            mu = np.dot(Kx, self.Kmmi_m)
+            Kxx = self.kern.psi0(self.Z, Xnew)
+            psi2 = self.kern.psi2(self.Z, Xnew)
+            diag_var = Kxx - np.sum(np.sum(psi2*tmp[None,:,:], 1), 1)
+            return mu, diag_var[:,None]
 
     def set_vb_param(self,vb_param):
-        """set the distribution q(u) from the canonical parameters"""
+        """
+        set the distribution q(u) from the canonical parameters
+
+        The bound and its gradients are recomputed at the next change of the
+        parameters or batch (see load_batch).
+        """
         self.q_u_canonical_flat = vb_param.copy()
         self.q_u_canonical = self.q_u_canonical_flat[:self.num_inducing*self.output_dim].reshape(self.num_inducing,self.output_dim),self.q_u_canonical_flat[self.num_inducing*self.output_dim:].reshape(self.num_inducing,self.num_inducing)
 
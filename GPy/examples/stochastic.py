@@ -15,11 +15,12 @@ def toy_1d(optimize=True, plot=True):
     Y = np.sin(X) + np.cos(0.3*X) + np.random.randn(*X.shape)/np.sqrt(50.)
 
     m = GPy.models.SVIGPRegression(X,Y, batchsize=10, Z=Z)
-    m.constrain_bounded('noise_variance',1e-3,1e-1)
-    m.constrain_bounded('white_variance',1e-3,1e-1)
+    m['.*noise'].constrain_bounded(1e-3,1e-1)
+    m['.*white'].constrain_bounded(1e-3,1e-1)
 
     m.param_steplength = 1e-4
 
+    cb = lambda m: None
     if plot:
         fig = pb.figure()
         ax = fig.add_subplot(111)
@@ -30,7 +31,7 @@ def toy_1d(optimize=True, plot=True):
             fig.canvas.draw()
 
     if optimize:
-        m.optimize(500, callback=cb, callback_interval=1)
+        m.optimize_adaptive(500, callback=cb, callback_interval=1)
 
     if plot:
         m.plot_traces()
@@ -28,7 +28,7 @@ etc.
 from exact_gaussian_inference import ExactGaussianInference
 from laplace import Laplace
 expectation_propagation = 'foo' # TODO
-from GPy.inference.latent_function_inference.var_dtc import VarDTC
+from GPy.inference.latent_function_inference.var_dtc import VarDTC, VarDTCStreaming
 from dtc import DTC
 from fitc import FITC
 
@@ -2,8 +2,10 @@
 # Licensed under the BSD 3-clause license (see LICENSE.txt)
 
 from posterior import Posterior
-from ...util.linalg import pdinv, dpotrs, tdot
+from ...util.linalg import jitchol, dpotrs, dpotri, dtrtrs, tdot, chol_append, chol_remove_leading
+from ...util.misc import param_to_array
 import numpy as np
+from scipy import linalg
 log_2_pi = np.log(2*np.pi)
 
 
@@ -14,44 +16,113 @@ class ExactGaussianInference(object):
     The function self.inference returns a Posterior object, which summarizes
     the posterior.
 
-    For efficiency, we sometimes work with the cholesky of Y*Y.T. To save repeatedly recomputing this, we cache it.
+    For efficiency, we sometimes work with a low rank factor of Y*Y.T. To save repeatedly recomputing this, we cache it.
 
     """
-    def __init__(self):
-        pass#self._YYTfactor_cache = caching.cache()
+    const_rank_tol = 1e-12
+    def __init__(self, limit=1):
+        from ...util.caching import Cacher
+        self.get_YYTfactor = Cacher(self._get_YYTfactor, limit)
 
-    def get_YYTfactor(self, Y):
+    def set_limit(self, limit):
+        self.get_YYTfactor.limit = limit
+
+    def _get_YYTfactor(self, Y):
         """
-        find a matrix L which satisfies LL^T = YY^T.
+        find a matrix L which satisfies LL^T = YY^T, and the matrix R which
+        maps L back onto Y = LR.
 
-        Note that L may have fewer columns than Y, else L=Y.
+        If Y has more columns than rows, L is computed from the
+        eigendecomposition of YY^T and has one column per non-zero eigenvalue.
+        Else L=Y and R is None.
         """
         N, D = Y.shape
-        if (N>D):
-            return Y
+        if (N>=D):
+            return param_to_array(Y), None
         else:
-            #if Y in self.cache, return self.Cache[Y], else store Y in cache and return L.
-            raise NotImplementedError, 'TODO' #TODO
+            Y = param_to_array(Y)
+            evals, evecs = linalg.eigh(tdot(Y))
+            keep = evals > evals.max() * self.const_rank_tol
+            sqrt_evals = np.sqrt(evals[keep])
+            evecs = evecs[:, keep]
+            return evecs * sqrt_evals, np.dot(evecs.T, Y) / sqrt_evals[:, None]
 
     def inference(self, kern, X, likelihood, Y, Y_metadata=None):
         """
         Returns a Posterior class containing essential quantities of the posterior
         """
-        YYT_factor = self.get_YYTfactor(Y)
+        YYT_factor, Y_map = self.get_YYTfactor(Y)
 
         K = kern.K(X)
 
-        Wi, LW, LWi, W_logdet = pdinv(K + likelihood.covariance_matrix(Y, Y_metadata))
+        LW = jitchol(K + likelihood.covariance_matrix(Y, Y_metadata))
+        W_logdet = 2.*np.sum(np.log(np.diag(LW)))
 
         alpha, _ = dpotrs(LW, YYT_factor, lower=1)
 
         log_marginal =  0.5*(-Y.size * log_2_pi - Y.shape[1] * W_logdet - np.sum(alpha * YYT_factor))
-        
-        dL_dK = 0.5 * (tdot(alpha) - Y.shape[1] * Wi)
+
+        #the inverse of W is only needed for the gradient: compute it in place
+        #and don't keep it in the posterior, which only needs the cholesky LW
+        dL_dK, _ = dpotri(LW, lower=1)
+        dL_dK *= -0.5 * Y.shape[1]
+        dL_dK += 0.5 * tdot(alpha)
 
         #TODO: does this really live here?
         likelihood.update_gradients(np.diag(dL_dK))
 
-        return Posterior(woodbury_chol=LW, woodbury_vector=alpha, K=K), log_marginal, {'dL_dK':dL_dK}
+        return Posterior(woodbury_chol=LW, woodbury_vector=alpha, K=K, woodbury_vector_map=Y_map), log_marginal, {'dL_dK':dL_dK}
+
+    def append(self, posterior, kern, X, Xnew, likelihood, Y, Ynew, Y_metadata=None):
+        """
+        Update the posterior of inference on X, Y for the new data Xnew, Ynew,
+        with the kernel and likelihood parameters held fixed.
+
+        The cholesky factor of the posterior is extended by a block cholesky
+        step, so the cost is O(N^2 k) for k new points, instead of O(N^3)
+        for a new inference. No gradients are computed.
 
+        :param Y_metadata: the metadata of the new data
+        :returns: the posterior and the log marginal likelihood of the joint data
+        """
+        N = X.shape[0]
+        LW = posterior.woodbury_chol
+        # L^{-1} Y of the old data, recovered from the woodbury vector L^{-T} L^{-1} Y
+        LiY = np.dot(LW.T, posterior.woodbury_vector)
+
+        K12 = kern.K(X, Xnew)
+        K22 = kern.K(Xnew)
+        LW = chol_append(LW, K12, K22 + likelihood.covariance_matrix(Ynew, Y_metadata))
+        LiYnew, _ = dtrtrs(np.asfortranarray(LW[N:, N:]), param_to_array(Ynew) - np.dot(LW[N:, :N], LiY), lower=1)
+        LiY = np.vstack((LiY, LiYnew))
+
+        K = None
+        if posterior._K is not None:
+            K = np.vstack((np.hstack((posterior._K, K12)), np.hstack((K12.T, K22))))
+        return self._posterior_from_chol(LW, LiY, K)
+
+    def remove_leading(self, posterior, Y, num):
+        """
+        Update the posterior of inference on X, Y for removing the first num
+        data points (e.g. for a sliding window), with the kernel and likelihood
+        parameters held fixed, in O(N^2 num). No gradients are computed.
 
+        :param Y: the observations the posterior was computed for, including the ones to remove
+        :returns: the posterior and the log marginal likelihood of the remaining data
+        """
+        LW = chol_remove_leading(posterior.woodbury_chol, num)
+        LiY, _ = dtrtrs(LW, param_to_array(Y)[num:], lower=1)
+        K = None
+        if posterior._K is not None:
+            K = posterior._K[num:, num:]
+        return self._posterior_from_chol(LW, LiY, K)
+
+    def _posterior_from_chol(self, LW, LiY, K):
+        """
+        The posterior and log marginal likelihood from the cholesky factor LW
+        of K + noise and L^{-1} Y.
+        """
+        alpha, _ = dtrtrs(LW, LiY, lower=1, trans=1)
+        W_logdet = 2.*np.sum(np.log(np.diag(LW)))
+        log_marginal = 0.5*(-LiY.size * log_2_pi - LiY.shape[1] * W_logdet - np.sum(np.square(LiY)))
+        return Posterior(woodbury_chol=LW, woodbury_vector=alpha, K=K), log_marginal
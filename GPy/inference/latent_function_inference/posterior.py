@@ -2,7 +2,7 @@
 # Licensed under the BSD 3-clause license (see LICENSE.txt)
 
 import numpy as np
-from ...util.linalg import pdinv, dpotrs, dpotri, symmetrify, jitchol
+from ...util.linalg import pdinv, dpotrs, dpotri, dtrtrs, symmetrify, jitchol, tdot
 
 class Posterior(object):
     """
@@ -15,10 +15,12 @@ class Posterior(object):
     the function at any new point x_* by integrating over this posterior.
 
     """
-    def __init__(self, woodbury_chol=None, woodbury_vector=None, K=None, mean=None, cov=None, K_chol=None, woodbury_inv=None):
+    def __init__(self, woodbury_chol=None, woodbury_vector=None, K=None, mean=None, cov=None, K_chol=None, woodbury_inv=None, woodbury_vector_map=None):
         """
         woodbury_chol : a lower triangular matrix L that satisfies posterior_covariance = K - K L^{-T} L^{-1} K
         woodbury_vector : a matrix (or vector, as Nx1 matrix) M which satisfies posterior_mean = K M
+        woodbury_vector_map : a matrix R, such that the woodbury vector is M R,
+            when inference was done for a low rank factor of YY^T (computed lazily)
         K : the proir covariance (required for lazy computation of various quantities)
         mean : the posterior mean
         cov : the posterior covariance
@@ -42,6 +44,10 @@ class Posterior(object):
         Of course, you can supply more than that, but this class will lazily
         compute all other quantites on demand.
 
+        If the woodbury_chol is supplied, predictive variances are computed by
+        triangular solves against it (see :py:meth:`predictive_variance`), and
+        woodbury_inv is only formed if it is asked for explicitly.
+
         """
         #obligatory
         self._K = K
@@ -58,7 +64,9 @@ class Posterior(object):
         self._K = K
         #option 1:
         self._woodbury_chol = woodbury_chol
+        self._solve_with_chol = woodbury_chol is not None
         self._woodbury_vector = woodbury_vector
+        self._woodbury_vector_map = woodbury_vector_map
 
         #option 2.
         self._woodbury_inv = woodbury_inv
@@ -131,8 +139,30 @@ class Posterior(object):
     def woodbury_vector(self):
         if self._woodbury_vector is None:
             self._woodbury_vector, _ = dpotrs(self.K_chol, self.mean)
+        elif self._woodbury_vector_map is not None:
+            self._woodbury_vector = np.dot(self._woodbury_vector, self._woodbury_vector_map)
+            self._woodbury_vector_map = None
         return self._woodbury_vector
 
+    def predictive_variance(self, Kx, Kxx):
+        """
+        The variance of the latent function at new points.
+
+        :param Kx: the covariance between the data and the new points, N x Nnew
+        :param Kxx: the prior covariance of the new points, either the full
+                    Nnew x Nnew matrix or its diagonal (Nnew,)
+        :returns: the posterior covariance, of the same shape as Kxx
+        """
+        if self._solve_with_chol:
+            LiKx, _ = dtrtrs(self._woodbury_chol, Kx, lower=1)
+            if Kxx.ndim == 2:
+                return Kxx - tdot(LiKx.T)
+            return Kxx - np.sum(LiKx*LiKx, 0)
+        WiKx = np.dot(self.woodbury_inv, Kx)
+        if Kxx.ndim == 2:
+            return Kxx - np.dot(Kx.T, WiKx)
+        return Kxx - np.sum(WiKx*Kx, 0)
+
     @property
     def K_chol(self):
         if self._K_chol is None:
@@ -5,7 +5,9 @@ from posterior import Posterior
 from ...util.linalg import jitchol, backsub_both_sides, tdot, dtrtrs, dtrtri, dpotri, dpotrs, symmetrify
 from ...core.parameterization.variational import VariationalPosterior
 import numpy as np
+import itertools
 from ...util.misc import param_to_array
+from ...util.parallel import PersistentThreadPool
 log_2_pi = np.log(2*np.pi)
 
 class VarDTC(object):
@@ -48,23 +50,25 @@ class VarDTC(object):
         return Y * prec # TODO chache this, and make it effective
 
     def inference(self, kern, X, Z, likelihood, Y):
+        #see whether we've got a different noise variance for each datum
+        beta = 1./np.fmax(likelihood.variance, 1e-6)
+        het_noise = beta.size < 1
+
+        #see whether we're using variational uncertain inputs
         if isinstance(X, VariationalPosterior):
             uncertain_inputs = True
             psi0 = kern.psi0(Z, X)
             psi1 = kern.psi1(Z, X)
-            psi2 = kern.psi2(Z, X)
+            #with homoscedastic noise only the sum of psi2 over the data is needed
+            psi2 = kern.psi2(Z, X) if het_noise else kern.psi2_sum(Z, X)
         else:
             uncertain_inputs = False
             psi0 = kern.Kdiag(X)
             psi1 = kern.K(X, Z)
             psi2 = None
 
-        #see whether we're using variational uncertain inputs
-
         _, output_dim = Y.shape
 
-        #see whether we've got a different noise variance for each datum
-        beta = 1./np.fmax(likelihood.variance, 1e-6)
         # VVT_factor is a matrix such that tdot(VVT_factor) = VVT...this is for efficiency!
         #self.YYTfactor = self.get_YYTfactor(Y)
         #VVT_factor = self.get_VVTfactor(self.YYTfactor, beta)
@@ -73,7 +77,6 @@ class VarDTC(object):
         trYYT = self.get_trYYT(Y)
 
         # do the inference:
-        het_noise = beta.size < 1
         num_inducing = Z.shape[0]
         num_data = Y.shape[0]
         # kernel computations, using BGPLVM notation
@@ -87,7 +90,7 @@ class VarDTC(object):
             if het_noise:
                 psi2_beta = psi2 * (beta.flatten().reshape(num_data, 1, 1)).sum(0)
             else:
-                psi2_beta = psi2.sum(0) * beta
+                psi2_beta = psi2 * beta
             #if 0:
             #    evals, evecs = linalg.eigh(psi2_beta)
             #    clipped_evals = np.clip(evals, 0., 1e6) # TODO: make clipping configurable
@@ -180,10 +183,32 @@ class VarDTC(object):
         return post, log_marginal, grad_dict
 
 class VarDTCMissingData(object):
-    def __init__(self, limit=1):
+    """
+    VarDTC for data with missing values (NaNs in Y). The outputs are grouped
+    by their pattern of missing values, and the inference is done for each
+    pattern on the rows observed in it.
+
+    The patterns are independent given Kmm, so they can be done concurrently:
+    with n_jobs other than 1, batches of patterns are run in a pool of n_jobs
+    threads (n_jobs=-1: one thread per cpu). The heavy lifting (choleskies,
+    triangular solves and products in the inducing space) is done by
+    LAPACK/BLAS, which release the GIL. The contributions of the patterns are
+    summed up in the order of the patterns, so the results do not depend on
+    n_jobs. The threads are kept for the following calls of inference.
+
+    Each batch holds consecutive patterns with at least batchsize observed
+    rows in total, grouping small patterns to save on the scheduling overhead.
+
+    :param int limit: number of Y's to cache the patterns for
+    :param int n_jobs: number of threads to run the patterns on
+    :param int batchsize: minimum number of observed rows per batch of patterns
+    """
+    def __init__(self, limit=1, n_jobs=1, batchsize=1):
         from ...util.caching import Cacher
         self._Y = Cacher(self._subarray_computations, limit)
-        pass
+        self.n_jobs = n_jobs
+        self.batchsize = batchsize
+        self._pool = PersistentThreadPool()
 
     def set_limit(self, limit):
         self._Y.limit = limit
@@ -192,12 +217,11 @@ class VarDTCMissingData(object):
         inan = np.isnan(Y)
         has_none = inan.any()
         if has_none:
-            from ...util.subarray_and_sorting import common_subarrays
+            from ...util.subarray_and_sorting import common_subarray_indices
             self._subarray_indices = []
-            for v,ind in common_subarrays(inan, 1).iteritems():
+            for v,ind in itertools.izip(*common_subarray_indices(inan, 1)):
                 if not np.all(v):
-                    v = ~np.array(v, dtype=bool)
-                    ind = np.array(ind, dtype=int)
+                    v = ~v
                     if ind.size == Y.shape[1]:
                         ind = slice(None)
                     self._subarray_indices.append([v,ind])
@@ -208,6 +232,22 @@ class VarDTCMissingData(object):
             self._subarray_indices = [[slice(None),slice(None)]]
             return [Y], [(Y**2).sum()]
 
+    def _batches(self, Ys):
+        """
+        Split the patterns (given by their data Ys) into consecutive batches
+        of at least self.batchsize observed rows (the last one may be smaller).
+        """
+        batches, batch, size = [], [], 0
+        for i, y in enumerate(Ys):
+            batch.append(i)
+            size += y.shape[0]
+            if size >= self.batchsize:
+                batches.append(batch)
+                batch, size = [], 0
+        if batch:
+            batches.append(batch)
+        return batches
+
     def inference(self, kern, X, Z, likelihood, Y):
         if isinstance(X, VariationalPosterior):
             uncertain_inputs = True
@@ -224,7 +264,6 @@ class VarDTCMissingData(object):
         beta_all = 1./np.fmax(likelihood.variance, 1e-6)
         het_noise = beta_all.size != 1
 
-        import itertools
         num_inducing = Z.shape[0]
 
         dL_dpsi0_all = np.zeros(Y.shape[0])
@@ -248,12 +287,16 @@ class VarDTCMissingData(object):
         if not full_VVT_factor:
             psi1V = np.dot(Y.T*beta_all, psi1_all).T
 
-        for y, trYYT, [v, ind] in itertools.izip(Ys, traces, self._subarray_indices):
+        def pattern_inference(y, trYYT, v, ind):
+            """
+            The contributions of one pattern of missing data. Only reads the
+            shared arrays, apart from writing its own columns ind of the
+            woodbury vector and inverse.
+            """
             if het_noise: beta = beta_all[ind]
             else: beta = beta_all[0]
 
             VVT_factor = (beta*y)
-            VVT_factor_all[v, ind].flat = VVT_factor.flat
             output_dim = y.shape[1]
 
             psi0 = psi0_all[v]
@@ -289,25 +332,19 @@ class VarDTCMissingData(object):
             delit = -0.5 * DBi_plus_BiPBi
             delit += -0.5 * B * output_dim
             delit += output_dim * np.eye(num_inducing)
-            dL_dKmm += backsub_both_sides(Lm, delit)
+            dL_dKmm = backsub_both_sides(Lm, delit)
 
             # derivatives of L w.r.t. psi
             dL_dpsi0, dL_dpsi1, dL_dpsi2 = _compute_dL_dpsi(num_inducing, num_data, output_dim, beta, Lm,
                 VVT_factor, Cpsi1Vf, DBi_plus_BiPBi,
                 psi1, het_noise, uncertain_inputs)
 
-            #import ipdb;ipdb.set_trace()
-            dL_dpsi0_all[v] += dL_dpsi0
-            dL_dpsi1_all[v, :] += dL_dpsi1
-            if uncertain_inputs:
-                dL_dpsi2_all[v, :] += dL_dpsi2
-
             # log marginal likelihood
-            log_marginal += _compute_log_marginal_likelihood(likelihood, num_data, output_dim, beta, het_noise,
+            log_marginal = _compute_log_marginal_likelihood(likelihood, num_data, output_dim, beta, het_noise,
                 psi0, A, LB, trYYT, data_fit)
 
             #put the gradients in the right places
-            partial_for_likelihood += _compute_partial_for_likelihood(likelihood,
+            partial_for_likelihood = _compute_partial_for_likelihood(likelihood,
                 het_noise, uncertain_inputs, LB,
                 _LBi_Lmi_psi1Vf, DBi_plus_BiPBi, Lm, A,
                 psi0, psi1, beta,
@@ -315,19 +352,33 @@ class VarDTCMissingData(object):
 
             if full_VVT_factor: woodbury_vector[:, ind] = Cpsi1Vf
             else:
-                print 'foobar'
                 tmp, _ = dtrtrs(Lm, psi1V, lower=1, trans=0)
                 tmp, _ = dpotrs(LB, tmp, lower=1)
                 woodbury_vector[:, ind] = dtrtrs(Lm, tmp, lower=1, trans=1)[0]
 
-            #import ipdb;ipdb.set_trace()
-            Bi, _ = dpotri(LB, lower=1)
-            symmetrify(Bi)
             Bi = -dpotri(LB, lower=1)[0]
             from ...util import diag
             diag.add(Bi, 1)
             woodbury_inv_all[:, :, ind] = backsub_both_sides(Lm, Bi)[:,:,None]
 
+            return dL_dKmm, dL_dpsi0, dL_dpsi1, dL_dpsi2, log_marginal, partial_for_likelihood
+
+        patterns = zip(Ys, traces, *zip(*self._subarray_indices))
+        batches = self._batches(Ys)
+        infer_batch = lambda batch: [pattern_inference(*patterns[i]) for i in batch]
+        results = self._pool.map(infer_batch, batches, self.n_jobs)
+
+        # sum up in the order of the patterns, independent of the scheduling
+        for (y, trYYT, v, ind), result in itertools.izip(patterns, itertools.chain(*results)):
+            dL_dKmm_p, dL_dpsi0, dL_dpsi1, dL_dpsi2, log_marginal_p, partial_for_likelihood_p = result
+            dL_dKmm += dL_dKmm_p
+            dL_dpsi0_all[v] += dL_dpsi0
+            dL_dpsi1_all[v, :] += dL_dpsi1
+            if uncertain_inputs:
+                dL_dpsi2_all[v, :] += dL_dpsi2
+            log_marginal += log_marginal_p
+            partial_for_likelihood += partial_for_likelihood_p
+
         # gradients:
         if uncertain_inputs:
             grad_dict = {'dL_dKmm': dL_dKmm,
@@ -341,27 +392,207 @@ class VarDTCMissingData(object):
                          'dL_dKnm':dL_dpsi1_all,
                          'partial_for_likelihood':partial_for_likelihood}
 
-        #get sufficient things for posterior prediction
-        #TODO: do we really want to do this in  the loop?
-        #if not full_VVT_factor:
-        #    print 'foobar'
-        #    psi1V = np.dot(Y.T*beta_all, psi1_all).T
-        #    tmp, _ = dtrtrs(Lm, psi1V, lower=1, trans=0)
-        #    tmp, _ = dpotrs(LB_all, tmp, lower=1)
-        #    woodbury_vector, _ = dtrtrs(Lm, tmp, lower=1, trans=1)
-        #import ipdb;ipdb.set_trace()
-        #Bi, _ = dpotri(LB_all, lower=1)
-        #symmetrify(Bi)
-        #Bi = -dpotri(LB_all, lower=1)[0]
-        #from ...util import diag
-        #diag.add(Bi, 1)
-
-        #woodbury_inv = backsub_both_sides(Lm, Bi)
-
         post = Posterior(woodbury_inv=woodbury_inv_all, woodbury_vector=woodbury_vector, K=Kmm, mean=None, cov=None, K_chol=Lm)
 
         return post, log_marginal, grad_dict
 
+class VarDTCStreaming(object):
+    """
+    VarDTC for large data sets, which streams over the data in chunks
+    (minibatches) of batchsize points.
+
+    The first pass accumulates the sufficient statistics psi0.sum(),
+    psi1^T V, psi1^T psi1 (or psi2.sum(0) for uncertain inputs) and tr(YY^T),
+    the algebra in the inducing space is then done once, and a second pass
+    computes dL_dpsi chunk by chunk and accumulates the gradients of the kernel
+    and the inducing inputs straight away. Memory is O(batchsize*M + M^2)
+    (O(batchsize*M^2) with uncertain inputs), instead of O(N*M) (O(N*M^2)).
+
+    The data can be given as (memory-mapped) arrays to :py:meth:`inference`,
+    or as a callable returning an iterator over (X, Y) chunks to
+    :py:meth:`inference_chunks`. Only homoscedastic Gaussian noise is supported.
+
+    Instead of dL_dpsi*, the returned grad_dict holds the accumulated
+    gradients 'kern_gradient' and 'Z_gradient' of the data terms (and
+    'dL_dmean', 'dL_dvariance' for uncertain inputs), see
+    :py:meth:`GPy.core.sparse_gp.SparseGP.parameters_changed`.
+
+    :param batchsize: the number of data points per chunk
+    """
+    const_jitter = 1e-6
+    def __init__(self, batchsize=10000):
+        self.batchsize = batchsize
+
+    def _iter_chunks(self, X, Y):
+        for start in xrange(0, Y.shape[0], self.batchsize):
+            s = slice(start, start + self.batchsize)
+            Xs = X[s] if isinstance(X, VariationalPosterior) else param_to_array(np.asarray(X[s]))
+            yield Xs, param_to_array(np.asarray(Y[s]))
+
+    def inference(self, kern, X, Z, likelihood, Y):
+        """
+        Stream over the rows of X and Y (arrays, memory maps, or a
+        variational posterior for X) in chunks of self.batchsize points.
+        """
+        return self.inference_chunks(kern, Z, likelihood, lambda: self._iter_chunks(X, Y))
+
+    def inference_chunks(self, kern, Z, likelihood, chunks):
+        """
+        :param chunks: a callable, returning an iterator over the (X, Y) chunks
+            of the data. It is called twice, once for each pass over the data.
+        """
+        beta = 1./np.fmax(likelihood.variance, 1e-6)
+        if beta.size != 1:
+            raise NotImplementedError, "streaming inference needs homoscedastic noise"
+        Z = param_to_array(Z)
+        num_inducing = Z.shape[0]
+
+        # first pass: sufficient statistics
+        stats = None
+        for X, Y in chunks():
+            stats = add_statistics(stats, sufficient_statistics(kern, Z, X, Y))
+        uncertain_inputs = stats['uncertain_inputs']
+        num_data, output_dim, psi0_sum, trYYT = stats['num_data'], stats['output_dim'], stats['psi0_sum'], stats['trYYT']
+
+        # the algebra in the inducing space, as in VarDTC
+        Kmm, Lm, A, LB, _LBi_Lmi_psi1Vf, Cpsi1Vf = _statistics_algebra(kern, Z, beta, stats, self.const_jitter)
+        B = np.eye(num_inducing) + A
+
+        delit = tdot(_LBi_Lmi_psi1Vf)
+        data_fit = np.trace(delit)
+        DBi_plus_BiPBi = backsub_both_sides(LB, output_dim * np.eye(num_inducing) + delit)
+        delit = -0.5 * DBi_plus_BiPBi
+        delit += -0.5 * B * output_dim
+        delit += output_dim * np.eye(num_inducing)
+        dL_dKmm = backsub_both_sides(Lm, delit)
+
+        log_marginal = _compute_log_marginal_likelihood(likelihood, num_data, output_dim, beta, False,
+            psi0_sum, A, LB, trYYT, data_fit)
+        partial_for_likelihood = _compute_partial_for_likelihood(likelihood,
+            False, uncertain_inputs, LB,
+            _LBi_Lmi_psi1Vf, DBi_plus_BiPBi, Lm, A,
+            psi0_sum, None, beta,
+            data_fit, num_data, output_dim, trYYT)
+
+        # second pass: gradients of the psi statistics, chunk by chunk
+        kern_gradient = np.zeros(kern.size)
+        Z_gradient = np.zeros(Z.shape)
+        dL_dmean, dL_dvariance = [], []
+        for X, Y in chunks():
+            psi1 = kern.psi1(Z, X) if uncertain_inputs else kern.K(X, Z)
+            dL_dpsi0, dL_dpsi1, dL_dpsi2 = _compute_dL_dpsi(num_inducing, Y.shape[0], output_dim, beta, Lm,
+                beta*Y, Cpsi1Vf, DBi_plus_BiPBi,
+                psi1, False, uncertain_inputs)
+            if uncertain_inputs:
+                kern.update_gradients_expectations(dL_dpsi0, dL_dpsi1, dL_dpsi2, Z, X)
+                kern_gradient += kern.gradient
+                Z_gradient += kern.gradients_Z_expectations(dL_dpsi1, dL_dpsi2, Z, X)
+                dL_dm, dL_dS = kern.gradients_qX_expectations(dL_dpsi0, dL_dpsi1, dL_dpsi2, Z, X)
+                dL_dmean.append(dL_dm)
+                dL_dvariance.append(dL_dS)
+            else:
+                kern.update_gradients_diag(dL_dpsi0, X)
+                kern_gradient += kern.gradient
+                kern.update_gradients_full(dL_dpsi1, X, Z)
+                kern_gradient += kern.gradient
+                Z_gradient += kern.gradients_X(dL_dpsi1.T, Z, X)
+
+        grad_dict = {'dL_dKmm': dL_dKmm,
+                     'kern_gradient': kern_gradient,
+                     'Z_gradient': Z_gradient,
+                     'partial_for_likelihood': partial_for_likelihood}
+        if uncertain_inputs:
+            grad_dict['dL_dmean'] = np.vstack(dL_dmean)
+            grad_dict['dL_dvariance'] = np.vstack(dL_dvariance)
+
+        post = _statistics_posterior(Kmm, Lm, LB, Cpsi1Vf)
+        return post, log_marginal, grad_dict
+
+def sufficient_statistics(kern, Z, X, Y):
+    """
+    The statistics of the data X, Y that the VarDTC posterior (with
+    homoscedastic noise) depends on, for fixed kernel parameters and Z:
+    the number of data points, psi0.sum(), psi1^T Y, psi1^T psi1 (psi2.sum(0)
+    for uncertain inputs X) and tr(YY^T).
+
+    The statistics of several chunks of data are summed up by
+    :py:func:`add_statistics`, the posterior follows from
+    :py:func:`posterior_from_statistics`.
+    """
+    Z = param_to_array(Z)
+    Y = param_to_array(np.asarray(Y))
+    uncertain_inputs = isinstance(X, VariationalPosterior)
+    if uncertain_inputs:
+        psi0 = kern.psi0(Z, X)
+        psi1 = kern.psi1(Z, X)
+        psi2_sum = kern.psi2_sum(Z, X)
+    else:
+        X = param_to_array(np.asarray(X))
+        psi0 = kern.Kdiag(X)
+        psi1 = kern.K(X, Z)
+        psi2_sum = tdot(psi1.T)
+    return {'num_data': Y.shape[0],
+            'output_dim': Y.shape[1],
+            'uncertain_inputs': uncertain_inputs,
+            'psi0_sum': np.sum(psi0),
+            'psi1Y': np.dot(psi1.T, Y),
+            'psi2_sum': psi2_sum,
+            'trYYT': np.sum(np.square(Y))}
+
+def add_statistics(stats, other):
+    """
+    The sufficient statistics (see :py:func:`sufficient_statistics`) of the
+    union of two data sets. stats can be None (no data).
+    """
+    if stats is None:
+        return other
+    assert stats['output_dim'] == other['output_dim'], "the data sets need the same output dimensions"
+    summed = dict(other)
+    for key in ['num_data', 'psi0_sum', 'psi1Y', 'psi2_sum', 'trYYT']:
+        summed[key] = stats[key] + other[key]
+    return summed
+
+def posterior_from_statistics(kern, Z, likelihood, stats, const_jitter=VarDTC.const_jitter):
+    """
+    The VarDTC posterior and log marginal likelihood for data given by its
+    sufficient statistics (see :py:func:`sufficient_statistics`), in O(M^3)
+    operations. Only for homoscedastic Gaussian noise, no gradients are computed.
+    """
+    beta = 1./np.fmax(likelihood.variance, 1e-6)
+    if beta.size != 1:
+        raise NotImplementedError, "inference from sufficient statistics needs homoscedastic noise"
+    Z = param_to_array(Z)
+    Kmm, Lm, A, LB, _LBi_Lmi_psi1Vf, Cpsi1Vf = _statistics_algebra(kern, Z, beta, stats, const_jitter)
+    data_fit = np.sum(np.square(_LBi_Lmi_psi1Vf))
+    log_marginal = _compute_log_marginal_likelihood(likelihood, stats['num_data'], stats['output_dim'], beta, False,
+        stats['psi0_sum'], A, LB, stats['trYYT'], data_fit)
+    return _statistics_posterior(Kmm, Lm, LB, Cpsi1Vf), log_marginal
+
+def _statistics_algebra(kern, Z, beta, stats, const_jitter):
+    """
+    The algebra in the inducing space of VarDTC, from the sufficient statistics.
+    """
+    num_inducing = Z.shape[0]
+    Kmm = kern.K(Z) + np.eye(num_inducing) * const_jitter
+    Lm = jitchol(Kmm + np.eye(num_inducing) * const_jitter)
+    LmInv = dtrtri(Lm)
+    A = LmInv.dot((stats['psi2_sum'] * beta).dot(LmInv.T))
+
+    B = np.eye(num_inducing) + A
+    LB = jitchol(B)
+    tmp, _ = dtrtrs(Lm, beta * stats['psi1Y'], lower=1, trans=0)
+    _LBi_Lmi_psi1Vf, _ = dtrtrs(LB, tmp, lower=1, trans=0)
+    tmp, _ = dtrtrs(LB, _LBi_Lmi_psi1Vf, lower=1, trans=1)
+    Cpsi1Vf, _ = dtrtrs(Lm, tmp, lower=1, trans=1)
+    return Kmm, Lm, A, LB, _LBi_Lmi_psi1Vf, Cpsi1Vf
+
+def _statistics_posterior(Kmm, Lm, LB, Cpsi1Vf):
+    Bi = -dpotri(LB, lower=1)[0]
+    from ...util import diag
+    diag.add(Bi, 1)
+    woodbury_inv = backsub_both_sides(Lm, Bi)
+    return Posterior(woodbury_inv=woodbury_inv, woodbury_vector=Cpsi1Vf, K=Kmm, mean=None, cov=None, K_chol=Lm)
+
 def _compute_dL_dpsi(num_inducing, num_data, output_dim, beta, Lm, VVT_factor, Cpsi1Vf, DBi_plus_BiPBi, psi1, het_noise, uncertain_inputs):
     dL_dpsi0 = -0.5 * output_dim * (beta * np.ones([num_data, 1])).flatten()
     dL_dpsi1 = np.dot(VVT_factor, Cpsi1Vf.T)
@@ -373,11 +604,10 @@ def _compute_dL_dpsi(num_inducing, num_data, output_dim, beta, Lm, VVT_factor, C
             dL_dpsi1 += 2.*np.dot(dL_dpsi2_beta, (psi1 * beta.reshape(num_data, 1)).T).T
             dL_dpsi2 = None
     else:
+        # the same for each of the N psi_2 matrices: with uncertain inputs it
+        # stays M x M (see Kern.psi2_sum)
         dL_dpsi2 = beta * dL_dpsi2_beta
-        if uncertain_inputs:
-            # repeat for each of the N psi_2 matrices
-            dL_dpsi2 = np.repeat(dL_dpsi2[None, :, :], num_data, axis=0)
-        else:
+        if not uncertain_inputs:
             # subsume back into psi1 (==Kmn)
             dL_dpsi1 += 2.*np.dot(psi1, dL_dpsi2)
             dL_dpsi2 = None
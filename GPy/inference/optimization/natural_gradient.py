@@ -0,0 +1,230 @@
+# Copyright (c) 2014, GPy authors (see AUTHORS.txt).
+# Licensed under the BSD 3-clause license (see LICENSE.txt)
+
+import numpy as np
+from scipy import optimize
+from numpy.linalg.linalg import LinAlgError
+from optimization import Optimizer
+from sgd import Adam, ConvergenceMonitor
+
+class VariationalBlock(object):
+    """
+    A block of Gaussian variational parameters, which :py:class:`opt_natgrad`
+    moves by natural gradient steps in its natural (canonical) parameters.
+
+    Models register their blocks by returning them from
+    :py:meth:`GPy.core.model.Model.natural_gradient_blocks`.
+
+    index holds the indices of the block in the (untransformed) parameter
+    array of the model, or None if the block is held outside the parameters
+    of the model (e.g. q(u) of SVIGP). The other parameters of the model are
+    the hyperparameters.
+    """
+    index = None
+
+    def get(self):
+        """Return the natural parameters of the block (1D array)"""
+        raise NotImplementedError
+    def set(self, theta):
+        """
+        Set the natural parameters of the block, without recomputing the
+        model. The optimizer recomputes the model after all blocks are set.
+        """
+        raise NotImplementedError
+    def natural_gradient(self):
+        """
+        Return the natural gradient of the objective (the bound of the model,
+        to be maximized) wrt the natural parameters, at the last computation
+        of the model. This is the gradient wrt the expectation parameters.
+        """
+        raise NotImplementedError
+    def feasible(self, theta):
+        """Whether theta are valid natural parameters (a positive precision)"""
+        return True
+
+class NormalPosteriorBlock(VariationalBlock):
+    """
+    Factorizing Gaussian q(X) = N(mean, variance) held in a
+    :py:class:`~GPy.core.parameterization.variational.NormalPosterior`
+    among the parameters of the model (e.g. BayesianGPLVM and MRD).
+
+    The natural parameters are mean/variance and -.5/variance, the
+    expectation parameters mean and mean**2 + variance.
+    """
+    def __init__(self, model, posterior):
+        self.model = model
+        self.mean_index = model._raveled_index_for(posterior.mean)
+        self.variance_index = model._raveled_index_for(posterior.variance)
+        self.index = np.hstack((self.mean_index, self.variance_index))
+
+    def get(self):
+        mu = self.model._param_array_[self.mean_index]
+        S = self.model._param_array_[self.variance_index]
+        return np.hstack((mu/S, -.5/S))
+
+    def set(self, theta):
+        theta1, theta2 = np.split(theta, 2)
+        S = -.5/theta2
+        self.model._param_array_[self.mean_index] = theta1*S
+        self.model._param_array_[self.variance_index] = S
+
+    def natural_gradient(self):
+        # model.gradient holds the gradients of the bound (not the objective)
+        mu = self.model._param_array_[self.mean_index]
+        dL_dmu = self.model.gradient[self.mean_index]
+        dL_dS = self.model.gradient[self.variance_index]
+        return np.hstack((dL_dmu - 2.*mu*dL_dS, dL_dS))
+
+    def feasible(self, theta):
+        return np.all(np.split(theta, 2)[1] < 0)
+
+class CanonicalBlock(VariationalBlock):
+    """
+    A block of variational parameters held outside the parameters of the
+    model, given by callables for its natural parameters and gradient.
+
+    :param get: returns the natural parameters
+    :param set: sets the natural parameters (without recomputing the model)
+    :param natural_gradient: returns the natural gradient of the bound
+    :param feasible: returns whether natural parameters are valid (optional)
+    """
+    def __init__(self, get, set, natural_gradient, feasible=None):
+        self.get = get
+        self.set = set
+        self.natural_gradient = natural_gradient
+        if feasible is not None:
+            self.feasible = feasible
+
+class opt_natgrad(Optimizer):
+    """
+    Hybrid optimizer for models with Gaussian variational parameters.
+
+    Every iteration takes a natural gradient step in each of the variational
+    blocks of the model (see :py:class:`VariationalBlock`) and a step in the
+    hyperparameters (all other parameters), with Adam or a few iterations of
+    L-BFGS-B, from the same computation of the model.
+    In conjugate blocks a natural gradient step of length one jumps to the
+    optimum of the block, so this needs far fewer iterations than following
+    the ordinary gradient in all parameters.
+
+    The natural gradient steplength is halved when the objective increases
+    (for models without minibatches), a step which makes a block infeasible
+    (or the objective fail) is undone. For models with minibatches, every
+    iteration moves the model to its next batch (see Model.next_batch).
+
+    :param vb_steplength: (initial) steplength of the natural gradient steps
+    :param hyper_optimizer: 'adam', 'lbfgsb' or None (keep the hyperparameters fixed)
+    :param learning_rate: learning rate of Adam
+    :param hyper_iters: number of L-BFGS-B iterations per iteration
+    :param blocks: the variational blocks, defaults to model.natural_gradient_blocks()
+    :param int window: for models with minibatches (see Model.next_batch), the
+        number of iterations per window of the convergence check (see
+        :py:class:`~GPy.inference.optimization.sgd.ConvergenceMonitor`)
+    """
+    def __init__(self, x_init, vb_steplength=1., hyper_optimizer='adam', learning_rate=1e-2,
+                 hyper_iters=5, blocks=None, window=20, *args, **kwargs):
+        Optimizer.__init__(self, x_init, *args, **kwargs)
+        assert hyper_optimizer in ['adam', 'lbfgsb', None], "hyperparameters are optimized by 'adam', 'lbfgsb' or not at all (None)"
+        self.vb_steplength = vb_steplength
+        self.hyper_optimizer = hyper_optimizer
+        self.learning_rate = learning_rate
+        self.hyper_iters = hyper_iters
+        self.blocks = blocks
+        self.window = window
+        self.opt_name = "Natural gradients and {}".format(hyper_optimizer or "fixed hyperparameters")
+
+    def _hyper_mask(self, blocks):
+        # which of the transformed parameters are hyperparameters
+        model = self.model
+        mask = np.ones(model.size, dtype=bool)
+        for b in blocks:
+            if b.index is not None:
+                mask[b.index] = False
+        if model._has_fixes():
+            return mask[model._fixes_]
+        return mask
+
+    def _natgrad_step(self, blocks, steplength):
+        for b in blocks:
+            theta, g = b.get(), b.natural_gradient()
+            step = steplength
+            for _ in xrange(50):
+                if b.feasible(theta + step*g):
+                    b.set(theta + step*g)
+                    break
+                step /= 2.
+
+    def opt(self, f_fp=None, f=None, fp=None):
+        assert f_fp is not None, "natural gradients require f_fp"
+        assert self.model is not None, "natural gradients need the model for its variational blocks"
+        model = self.model
+        blocks = self.blocks
+        if blocks is None:
+            blocks = model.natural_gradient_blocks()
+        hyper = self._hyper_mask(blocks)
+        ftol = 1e-6 if self.ftol is None else self.ftol
+        monitor = ConvergenceMonitor(self.window, ftol, self.gtol)
+        adam = Adam()
+
+        x = self.x_init.copy()
+        f_x, g_x = f_fp(x)
+        self.funct_eval = 1
+        steplength = self.vb_steplength
+        stochastic = False
+
+        self.status = 'maximum number of iterations'
+        for it in xrange(self.max_iters):
+            x_old, thetas_old = x.copy(), [b.get() for b in blocks]
+
+            try:
+                self._natgrad_step(blocks, steplength)
+                x = model._get_params_transformed()
+                if hyper.any() and self.hyper_optimizer == 'adam':
+                    x[hyper] -= self.learning_rate*adam(g_x[hyper], it+1)
+                elif hyper.any() and self.hyper_optimizer == 'lbfgsb':
+                    def f_fp_hyper(xh):
+                        x[hyper] = xh
+                        f_h, g_h = f_fp(x)
+                        return f_h, g_h[hyper]
+                    xh, _, d = optimize.fmin_l_bfgs_b(f_fp_hyper, x[hyper], maxiter=self.hyper_iters)
+                    self.funct_eval += d['funcalls']
+                    x[hyper] = xh
+                stochastic = model.next_batch()
+                f_new, g_new = f_fp(x)
+                self.funct_eval += 1
+            except (LinAlgError, ZeroDivisionError, ValueError):
+                f_new = np.inf
+
+            if not np.isfinite(f_new):
+                # undo the step and try again with a shorter one
+                [b.set(theta) for b, theta in zip(blocks, thetas_old)]
+                x = x_old
+                f_x, g_x = f_fp(x)
+                self.funct_eval += 1
+                steplength /= 2.
+                if steplength < 1e-10:
+                    self.status = 'natural gradient steplength underflow'
+                    break
+                continue
+
+            if stochastic:
+                # the objective is noisy, check the means over windows of iterations
+                converged = monitor.update(f_new, g_new)
+            else:
+                monitor.update(f_new, g_new)
+                if f_new > f_x:
+                    steplength /= 2.
+                converged = np.abs(f_x - f_new) < ftol*(1. + np.abs(f_new))
+                if self.gtol is not None:
+                    converged = converged and np.abs(g_new).max() < self.gtol
+            f_x, g_x = f_new, g_new
+            if self.messages:
+                print "{0:>5d} f = {1: .6e} natural gradient steplength = {2:.3e}".format(it, f_x, steplength)
+            if converged:
+                self.status = 'converged'
+                break
+
+        self.x_opt = x
+        self.f_opt = monitor.f_opt() if stochastic else f_x
+        self.trace = monitor.trace
+        self.grad_norm_trace = monitor.grad_norm_trace
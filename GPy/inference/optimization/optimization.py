@@ -225,13 +225,18 @@ class opt_SCG(Optimizer):
         self.status = opt_result[3]
 
 def get_optimizer(f_min):
-    from sgd import opt_SGD
+    from sgd import opt_SGD, opt_adam, opt_rmsprop, opt_adagrad
+    from natural_gradient import opt_natgrad
 
     optimizers = {'fmin_tnc': opt_tnc,
           'simplex': opt_simplex,
           'lbfgsb': opt_lbfgsb,
           'scg': opt_SCG,
-          'sgd': opt_SGD}
+          'sgd': opt_SGD,
+          'adam': opt_adam,
+          'rmsprop': opt_rmsprop,
+          'adagrad': opt_adagrad,
+          'natgrad': opt_natgrad}
 
     if rasm_available:
         optimizers['rasmussen'] = opt_rasm
@@ -1,346 +1,259 @@
+# Copyright (c) 2012-2014, GPy authors (see AUTHORS.txt).
+# Licensed under the BSD 3-clause license (see LICENSE.txt)
+
 import numpy as np
-import scipy as sp
-import scipy.sparse
+import sys
 from optimization import Optimizer
-from scipy import linalg, optimize
-import copy, sys, pickle
-
-class opt_SGD(Optimizer):
-    """
-    Optimize using stochastic gradient descent.
 
-    :param Model: reference to the Model object
-    :param iterations: number of iterations
-    :param learning_rate: learning rate
-    :param momentum: momentum
+#===============================================================================
+# Update rules: return the direction d of the step x -= learning_rate * d
+# for the (stochastic) gradient g at iteration t = 1, 2, ...
+#===============================================================================
 
+class Momentum(object):
     """
-
-    def __init__(self, start, iterations = 10, learning_rate = 1e-4, momentum = 0.9, model = None, messages = False, batch_size = 1, self_paced = False, center = True, iteration_file = None, learning_rate_adaptation=None, actual_iter=None, schedule=None, **kwargs):
-        self.opt_name = "Stochastic Gradient Descent"
-
-        self.Model = model
-        self.iterations = iterations
+    Gradient descent with (heavy ball) momentum.
+    """
+    def __init__(self, momentum=.9):
         self.momentum = momentum
-        self.learning_rate = learning_rate
-        self.x_opt = None
-        self.f_opt = None
-        self.messages = messages
-        self.batch_size = batch_size
-        self.self_paced = self_paced
-        self.center = center
-        self.param_traces = [('noise',[])]
-        self.iteration_file = iteration_file
-        self.learning_rate_adaptation = learning_rate_adaptation
-        self.actual_iter = actual_iter
-        if self.learning_rate_adaptation != None:
-            if self.learning_rate_adaptation == 'annealing':
-                self.learning_rate_0 = self.learning_rate
-            else:
-                self.learning_rate_0 = self.learning_rate.mean()
+        self.d = 0.
+    def __call__(self, g, t):
+        self.d = self.momentum*self.d + g
+        return self.d
 
-        self.schedule = schedule
-        # if len([p for p in self.model.kern.parts if p.name == 'bias']) == 1:
-        #     self.param_traces.append(('bias',[]))
-        # if len([p for p in self.model.kern.parts if p.name == 'linear']) == 1:
-        #     self.param_traces.append(('linear',[]))
-        # if len([p for p in self.model.kern.parts if p.name == 'rbf']) == 1:
-        #     self.param_traces.append(('rbf_var',[]))
+class AdaGrad(object):
+    """
+    AdaGrad: scale every coordinate by the root of its summed squared gradients.
+    """
+    def __init__(self, eps=1e-8):
+        self.eps = eps
+        self.G = 0.
+    def __call__(self, g, t):
+        self.G = self.G + g**2
+        return g/(np.sqrt(self.G) + self.eps)
+
+class RMSProp(object):
+    """
+    RMSProp: scale every coordinate by the root of a running average of its
+    squared gradients.
+    """
+    def __init__(self, decay=.9, eps=1e-8):
+        self.decay = decay
+        self.eps = eps
+        self.v = 0.
+    def __call__(self, g, t):
+        self.v = self.decay*self.v + (1.-self.decay)*g**2
+        return g/(np.sqrt(self.v) + self.eps)
+
+class Adam(object):
+    """
+    Adam: running averages of the gradient and its square, with bias correction.
+    """
+    def __init__(self, beta1=.9, beta2=.999, eps=1e-8):
+        self.beta1, self.beta2, self.eps = beta1, beta2, eps
+        self.m = 0.
+        self.v = 0.
+    def __call__(self, g, t):
+        self.m = self.beta1*self.m + (1.-self.beta1)*g
+        self.v = self.beta2*self.v + (1.-self.beta2)*g**2
+        mhat = self.m/(1.-self.beta1**t)
+        vhat = self.v/(1.-self.beta2**t)
+        return mhat/(np.sqrt(vhat) + self.eps)
+
+def learning_rate_schedule(learning_rate, schedule=None, decay=None):
+    """
+    Return the learning rate as a function of the iteration t = 1, 2, ...
+
+    :param float learning_rate: the initial learning rate
+    :param schedule: None or 'constant', 'exponential' (learning_rate * decay**t),
+        'inverse' (learning_rate / (1 + decay*t)), 'inverse_sqrt'
+        (learning_rate / sqrt(1 + decay*t)), or a function of t (which
+        ignores learning_rate and decay)
+    :param float decay: decay of the schedule (defaults: exponential .999, inverse 1e-2)
+    """
+    if callable(schedule):
+        return schedule
+    if schedule is None or schedule == 'constant':
+        return lambda t: learning_rate
+    if schedule == 'exponential':
+        decay = .999 if decay is None else decay
+        return lambda t: learning_rate * decay**t
+    if schedule == 'inverse':
+        decay = 1e-2 if decay is None else decay
+        return lambda t: learning_rate / (1. + decay*t)
+    if schedule == 'inverse_sqrt':
+        decay = 1e-2 if decay is None else decay
+        return lambda t: learning_rate / np.sqrt(1. + decay*t)
+    raise ValueError, "unknown learning rate schedule: {}".format(schedule)
+
+class ConvergenceMonitor(object):
+    """
+    Convergence diagnostics for noisy (minibatch) objectives.
 
-        self.param_traces = dict(self.param_traces)
-        self.fopt_trace = []
+    Collects the objective and gradient norm of every iteration and compares
+    the mean objective over consecutive windows of iterations: the
+    optimization has converged if the mean decreased by less than
+    ftol * (1 + |mean|) from one window to the next (and, if gtol is given,
+    the mean gradient norm over the window is below gtol).
 
-        num_params = len(self.Model._get_params())
-        if isinstance(self.learning_rate, float):
-            self.learning_rate = np.ones((num_params,)) * self.learning_rate
+    :param int window: number of iterations per window
+    :param float ftol: relative tolerance on the decrease of the window means
+    :param float gtol: tolerance on the mean gradient norm (optional)
+    """
+    def __init__(self, window=20, ftol=1e-6, gtol=None):
+        self.window = window
+        self.ftol = ftol
+        self.gtol = gtol
+        self.trace = []
+        self.grad_norm_trace = []
+        self.window_means = []
 
-        assert (len(self.learning_rate) == num_params), "there must be one learning rate per parameter"
+    def update(self, f, g):
+        """
+        Record the objective f and gradient g of an iteration, return whether
+        the optimization has converged.
+        """
+        self.trace.append(f)
+        self.grad_norm_trace.append(np.sqrt(np.dot(g, g)))
+        if len(self.trace) % self.window:
+            return False
+        mean = np.mean(self.trace[-self.window:])
+        self.window_means.append(mean)
+        if len(self.window_means) < 2:
+            return False
+        converged = self.window_means[-2] - mean < self.ftol*(1. + np.abs(mean))
+        if self.gtol is not None:
+            converged = converged and np.mean(self.grad_norm_trace[-self.window:]) < self.gtol
+        return converged
+
+    def f_opt(self):
+        """The mean objective over the last window (the last objective if there is none)"""
+        if len(self.trace) >= self.window:
+            return np.mean(self.trace[-self.window:])
+        return self.trace[-1]
+
+#===============================================================================
+# Optimizers
+#===============================================================================
+
+class StochasticOptimizer(Optimizer):
+    """
+    Superclass for the stochastic gradient optimizers.
+
+    Every iteration moves the model to its next minibatch (see
+    :py:meth:`GPy.core.model.Model.next_batch`), computes the objective and
+    its gradients on it (f_fp, i.e. Model.objective_and_gradients) and takes
+    a step with the update rule of the optimizer. For models without
+    minibatches this is plain (deterministic) gradient descent.
+
+    Convergence is checked on the means of the objective over windows of
+    iterations, see :py:class:`ConvergenceMonitor`; f_opt is the mean over
+    the last window, and x_opt is the last point the objective was
+    evaluated at. The traces of the objective, gradient norm and learning
+    rate are kept in trace, grad_norm_trace and learning_rate_trace.
+
+    :param float learning_rate: the (initial) learning rate
+    :param schedule: learning rate schedule, see :py:func:`learning_rate_schedule`
+    :param float decay: decay of the learning rate schedule
+    :param int window: number of iterations per window of the convergence check
+    """
+    def __init__(self, x_init, learning_rate=1e-2, schedule=None, decay=None, window=20, *args, **kwargs):
+        Optimizer.__init__(self, x_init, *args, **kwargs)
+        self.learning_rate = learning_rate
+        self.schedule = learning_rate_schedule(learning_rate, schedule, decay)
+        self.window = window
+        self.grad_norm_trace = None
+        self.learning_rate_trace = None
+
+    def _update_rule(self):
+        raise NotImplementedError, "stochastic optimizers need an update rule"
 
-    def __str__(self):
-        status = "\nOptimizer: \t\t\t %s\n" % self.opt_name
-        status += "f(x_opt): \t\t\t %.4f\n" % self.f_opt
-        status += "Number of iterations: \t\t %d\n" % self.iterations
-        status += "Learning rate: \t\t\t max %.3f, min %.3f\n" % (self.learning_rate.max(), self.learning_rate.min())
-        status += "Momentum: \t\t\t %.3f\n" % self.momentum
-        status += "Batch size: \t\t\t %d\n" % self.batch_size
-        status += "Time elapsed: \t\t\t %s\n" % self.time
-        return status
+    def opt(self, f_fp=None, f=None, fp=None):
+        assert f_fp is not None, "{} requires f_fp".format(self.opt_name)
+        rule = self._update_rule()
+        monitor = ConvergenceMonitor(self.window, 1e-6 if self.ftol is None else self.ftol, self.gtol)
+        self.learning_rate_trace = []
+        x = x_last = self.x_init.copy()
+        self.status = 'maximum number of iterations'
+        for t in xrange(1, self.max_iters + 1):
+            if t > 1 and self.model is not None:
+                self.model.next_batch()
+            f_x, g_x = f_fp(x)
+            if not np.isfinite(f_x):
+                # stop at the last point with a finite objective
+                self.status = 'objective not finite'
+                break
+            lr = self.schedule(t)
+            x_last, x = x, x - lr*rule(g_x, t)
+            self.learning_rate_trace.append(lr)
+            converged = monitor.update(f_x, g_x)
+            if self.messages and not t % self.window:
+                print "{0:>6d} f = {1: .6e} |g| = {2:.3e} learning rate = {3:.3e}".format(t, monitor.window_means[-1], np.mean(monitor.grad_norm_trace[-self.window:]), lr)
+                sys.stdout.flush()
+            if converged:
+                self.status = 'converged'
+                break
+        # the last point the objective was evaluated at, the last step was never evaluated
+        self.x_opt = x_last
+        self.f_opt = monitor.f_opt()
+        self.funct_eval = len(monitor.trace)
+        self.trace = monitor.trace
+        self.grad_norm_trace = monitor.grad_norm_trace
 
     def plot_traces(self):
         """
-        See GPy.plotting.matplot_dep.inference_plots
+        See GPy.plotting.matplot_dep.inference_plots.plot_sgd_traces
         """
         assert "matplotlib" in sys.modules, "matplotlib package has not been imported."
-        from ..plotting.matplot_dep import inference_plots
+        from ...plotting.matplot_dep import inference_plots
         inference_plots.plot_sgd_traces(self)
 
-    def non_null_samples(self, data):
-        return (np.isnan(data).sum(axis=1) == 0)
-
-    def check_for_missing(self, data):
-        if sp.sparse.issparse(self.Model.likelihood.Y):
-            return True
-        else:
-            return np.isnan(data).sum() > 0
-
-    def subset_parameter_vector(self, x, samples, param_shapes):
-        subset = np.array([], dtype = int)
-        x = np.arange(0, len(x))
-        i = 0
-
-        for s in param_shapes:
-            N, input_dim = s
-            X = x[i:i+N*input_dim].reshape(N, input_dim)
-            X = X[samples]
-            subset = np.append(subset, X.flatten())
-            i += N*input_dim
-
-        subset = np.append(subset, x[i:])
-
-        return subset
-
-    def shift_constraints(self, j):
-
-        constrained_indices = copy.deepcopy(self.Model.constrained_indices)
-
-        for c, constraint in enumerate(constrained_indices):
-            mask = (np.ones_like(constrained_indices[c]) == 1)
-            for i in range(len(constrained_indices[c])):
-                pos = np.where(j == constrained_indices[c][i])[0]
-                if len(pos) == 1:
-                    self.Model.constrained_indices[c][i] = pos
-                else:
-                    mask[i] = False
-
-            self.Model.constrained_indices[c] = self.Model.constrained_indices[c][mask]
-        return constrained_indices
-        # back them up
-        # bounded_i = copy.deepcopy(self.Model.constrained_bounded_indices)
-        # bounded_l = copy.deepcopy(self.Model.constrained_bounded_lowers)
-        # bounded_u = copy.deepcopy(self.Model.constrained_bounded_uppers)
-
-        # for b in range(len(bounded_i)): # for each group of constraints
-        #     for bc in range(len(bounded_i[b])):
-        #         pos = np.where(j == bounded_i[b][bc])[0]
-        #         if len(pos) == 1:
-        #             pos2 = np.where(self.Model.constrained_bounded_indices[b] == bounded_i[b][bc])[0][0]
-        #             self.Model.constrained_bounded_indices[b][pos2] = pos[0]
-        #         else:
-        #             if len(self.Model.constrained_bounded_indices[b]) == 1:
-        #                 # if it's the last index to be removed
-        #                 # the logic here is just a mess. If we remove the last one, then all the
-        #                 # b-indices change and we have to iterate through everything to find our
-        #                 # current index. Can't deal with this right now.
-        #                 raise NotImplementedError
-
-        #             else: # just remove it from the indices
-        #                 mask = self.Model.constrained_bounded_indices[b] != bc
-        #                 self.Model.constrained_bounded_indices[b] = self.Model.constrained_bounded_indices[b][mask]
-
-
-        # # here we shif the positive constraints. We cycle through each positive
-        # # constraint
-        # positive = self.Model.constrained_positive_indices.copy()
-        # mask = (np.ones_like(positive) == 1)
-        # for p in range(len(positive)):
-        #     # we now check whether the constrained index appears in the j vector
-        #     # (the vector of the "active" indices)
-        #     pos = np.where(j == self.Model.constrained_positive_indices[p])[0]
-        #     if len(pos) == 1:
-        #         self.Model.constrained_positive_indices[p] = pos
-        #     else:
-        #         mask[p] = False
-        # self.Model.constrained_positive_indices = self.Model.constrained_positive_indices[mask]
-
-        # return (bounded_i, bounded_l, bounded_u), positive
-
-    def restore_constraints(self, c):#b, p):
-        # self.Model.constrained_bounded_indices = b[0]
-        # self.Model.constrained_bounded_lowers = b[1]
-        # self.Model.constrained_bounded_uppers = b[2]
-        # self.Model.constrained_positive_indices = p
-        self.Model.constrained_indices = c
-
-    def get_param_shapes(self, N = None, input_dim = None):
-        model_name = self.Model.__class__.__name__
-        if model_name == 'GPLVM':
-            return [(N, input_dim)]
-        if model_name == 'Bayesian_GPLVM':
-            return [(N, input_dim), (N, input_dim)]
-        else:
-            raise NotImplementedError
-
-    def step_with_missing_data(self, f_fp, X, step, shapes):
-        N, input_dim = X.shape
-
-        if not sp.sparse.issparse(self.Model.likelihood.Y):
-            Y = self.Model.likelihood.Y
-            samples = self.non_null_samples(self.Model.likelihood.Y)
-            self.Model.N = samples.sum()
-            Y = Y[samples]
-        else:
-            samples = self.Model.likelihood.Y.nonzero()[0]
-            self.Model.N = len(samples)
-            Y = np.asarray(self.Model.likelihood.Y[samples].todense(), dtype = np.float64)
-
-        if self.Model.N == 0 or Y.std() == 0.0:
-            return 0, step, self.Model.N
-
-        self.Model.likelihood._offset = Y.mean()
-        self.Model.likelihood._scale = Y.std()
-        self.Model.likelihood.set_data(Y)
-        # self.Model.likelihood.V = self.Model.likelihood.Y*self.Model.likelihood.precision
-
-        sigma = self.Model.likelihood._variance
-        self.Model.likelihood._variance = None # invalidate cache
-        self.Model.likelihood._set_params(sigma)
-
-
-        j = self.subset_parameter_vector(self.x_opt, samples, shapes)
-        self.Model.X = X[samples]
-
-        model_name = self.Model.__class__.__name__
-
-        if model_name == 'Bayesian_GPLVM':
-            self.Model.likelihood.YYT = np.dot(self.Model.likelihood.Y, self.Model.likelihood.Y.T)
-            self.Model.likelihood.trYYT = np.trace(self.Model.likelihood.YYT)
-
-        ci = self.shift_constraints(j)
-        f, fp = f_fp(self.x_opt[j])
-
-        step[j] = self.momentum * step[j] + self.learning_rate[j] * fp
-        self.x_opt[j] -= step[j]
-        self.restore_constraints(ci)
-
-        self.Model.grads[j] = fp
-        # restore likelihood _offset and _scale, otherwise when we call set_data(y) on
-        # the next feature, it will get normalized with the mean and std of this one.
-        self.Model.likelihood._offset = 0
-        self.Model.likelihood._scale = 1
-
-        return f, step, self.Model.N
-
-    def adapt_learning_rate(self, t, D):
-        if self.learning_rate_adaptation == 'adagrad':
-            if t > 0:
-                g_k = self.Model.grads
-                self.s_k += np.square(g_k)
-                t0 = 100.0
-                self.learning_rate = 0.1/(t0 + np.sqrt(self.s_k))
-
-                import pdb; pdb.set_trace()
-            else:
-                self.learning_rate = np.zeros_like(self.learning_rate)
-                self.s_k = np.zeros_like(self.x_opt)
-
-        elif self.learning_rate_adaptation == 'annealing':
-            #self.learning_rate = self.learning_rate_0/(1+float(t+1)/10)
-            self.learning_rate = np.ones_like(self.learning_rate) * self.schedule[t]
-
-
-        elif self.learning_rate_adaptation == 'semi_pesky':
-            if self.Model.__class__.__name__ == 'Bayesian_GPLVM':
-                g_t = self.Model.grads
-                if t == 0:
-                    self.hbar_t = 0.0
-                    self.tau_t = 100.0
-                    self.gbar_t = 0.0
-
-                self.gbar_t = (1-1/self.tau_t)*self.gbar_t + 1/self.tau_t * g_t
-                self.hbar_t = (1-1/self.tau_t)*self.hbar_t + 1/self.tau_t * np.dot(g_t.T, g_t)
-                self.learning_rate = np.ones_like(self.learning_rate)*(np.dot(self.gbar_t.T, self.gbar_t) / self.hbar_t)
-                tau_t = self.tau_t*(1-self.learning_rate) + 1
-
-
-    def opt(self, f_fp=None, f=None, fp=None):
-        self.x_opt = self.Model._get_params_transformed()
-        self.grads = []
-
-        X, Y = self.Model.X.copy(), self.Model.likelihood.Y.copy()
-
-        self.Model.likelihood.YYT = 0
-        self.Model.likelihood.trYYT = 0
-        self.Model.likelihood._offset = 0.0
-        self.Model.likelihood._scale = 1.0
-
-        N, input_dim = self.Model.X.shape
-        D = self.Model.likelihood.Y.shape[1]
-        num_params = self.Model._get_params()
-        self.trace = []
-        missing_data = self.check_for_missing(self.Model.likelihood.Y)
-
-        step = np.zeros_like(num_params)
-        for it in range(self.iterations):
-            if self.actual_iter != None:
-                it = self.actual_iter
-
-            self.Model.grads = np.zeros_like(self.x_opt) # TODO this is ugly
-
-            if it == 0 or self.self_paced is False:
-                features = np.random.permutation(Y.shape[1])
-            else:
-                features = np.argsort(NLL)
-
-            b = len(features)/self.batch_size
-            features = [features[i::b] for i in range(b)]
-            NLL = []
-            for count, j in enumerate(features):
-                self.Model.input_dim = len(j)
-                self.Model.likelihood.input_dim = len(j)
-                self.Model.likelihood.set_data(Y[:, j])
-                # self.Model.likelihood.V = self.Model.likelihood.Y*self.Model.likelihood.precision
-
-                sigma = self.Model.likelihood._variance
-                self.Model.likelihood._variance = None # invalidate cache
-                self.Model.likelihood._set_params(sigma)
-
-                if missing_data:
-                    shapes = self.get_param_shapes(N, input_dim)
-                    f, step, Nj = self.step_with_missing_data(f_fp, X, step, shapes)
-                else:
-                    self.Model.likelihood.YYT = np.dot(self.Model.likelihood.Y, self.Model.likelihood.Y.T)
-                    self.Model.likelihood.trYYT = np.trace(self.Model.likelihood.YYT)
-                    Nj = N
-                    f, fp = f_fp(self.x_opt)
-                    self.Model.grads = fp.copy()
-                    step = self.momentum * step + self.learning_rate * fp
-                    self.x_opt -= step
+class opt_SGD(StochasticOptimizer):
+    """
+    Stochastic gradient descent with momentum, see :py:class:`StochasticOptimizer`.
 
-                if self.messages == 2:
-                    noise = self.Model.likelihood._variance
-                    status = "evaluating {feature: 5d}/{tot: 5d} \t f: {f: 2.3f} \t non-missing: {nm: 4d}\t noise: {noise: 2.4f}\r".format(feature = count, tot = len(features), f = f, nm = Nj, noise = noise)
-                    sys.stdout.write(status)
-                    sys.stdout.flush()
-                    self.param_traces['noise'].append(noise)
+    :param float momentum: momentum
+    """
+    def __init__(self, x_init, momentum=.9, *args, **kwargs):
+        StochasticOptimizer.__init__(self, x_init, *args, **kwargs)
+        self.momentum = momentum
+        self.opt_name = "Stochastic Gradient Descent"
+    def _update_rule(self):
+        return Momentum(self.momentum)
 
-                self.adapt_learning_rate(it+count, D)
-                NLL.append(f)
-                self.fopt_trace.append(NLL[-1])
+class opt_adagrad(StochasticOptimizer):
+    """
+    AdaGrad, see :py:class:`StochasticOptimizer`.
+    """
+    def __init__(self, *args, **kwargs):
+        StochasticOptimizer.__init__(self, *args, **kwargs)
+        self.opt_name = "AdaGrad"
+    def _update_rule(self):
+        return AdaGrad()
 
-                # for k in self.param_traces.keys():
-                #     self.param_traces[k].append(self.Model.get(k)[0])
-            self.grads.append(self.Model.grads.tolist())
-            # should really be a sum(), but earlier samples in the iteration will have a very crappy ll
-            self.f_opt = np.mean(NLL)
-            self.Model.N = N
-            self.Model.X = X
-            self.Model.input_dim = D
-            self.Model.likelihood.N = N
-            self.Model.likelihood.input_dim = D
-            self.Model.likelihood.Y = Y
-            sigma = self.Model.likelihood._variance
-            self.Model.likelihood._variance = None # invalidate cache
-            self.Model.likelihood._set_params(sigma)
+class opt_rmsprop(StochasticOptimizer):
+    """
+    RMSProp, see :py:class:`StochasticOptimizer`.
 
-            self.trace.append(self.f_opt)
-            if self.iteration_file is not None:
-                f = open(self.iteration_file + "iteration%d.pickle" % it, 'w')
-                data = [self.x_opt, self.fopt_trace, self.param_traces]
-                pickle.dump(data, f)
-                f.close()
+    :param float rms_decay: decay of the running average of the squared gradients
+    """
+    def __init__(self, x_init, rms_decay=.9, *args, **kwargs):
+        StochasticOptimizer.__init__(self, x_init, *args, **kwargs)
+        self.rms_decay = rms_decay
+        self.opt_name = "RMSProp"
+    def _update_rule(self):
+        return RMSProp(self.rms_decay)
+
+class opt_adam(StochasticOptimizer):
+    """
+    Adam, see :py:class:`StochasticOptimizer`.
 
-            if self.messages != 0:
-                sys.stdout.write('\r' + ' '*len(status)*2 + '  \r')
-                status = "SGD Iteration: {0: 3d}/{1: 3d}  f: {2: 2.3f}   max eta: {3: 1.5f}\n".format(it+1, self.iterations, self.f_opt, self.learning_rate.max())
-                sys.stdout.write(status)
-                sys.stdout.flush()
+    :param float beta1: decay of the running average of the gradients
+    :param float beta2: decay of the running average of the squared gradients
+    """
+    def __init__(self, x_init, beta1=.9, beta2=.999, *args, **kwargs):
+        StochasticOptimizer.__init__(self, x_init, *args, **kwargs)
+        self.beta1, self.beta2 = beta1, beta2
+        self.opt_name = "Adam"
+    def _update_rule(self):
+        return Adam(self.beta1, self.beta2)
@@ -103,6 +103,26 @@ class Add(Kern):
                 raise NotImplementedError, "psi2 cannot be computed for this kernel"
         return psi2
 
+    def psi2_sum(self, Z, variational_posterior):
+        psi2 = np.sum([p.psi2_sum(Z[:, i_s], variational_posterior[:, i_s]) for p, i_s in zip(self._parameters_, self.input_slices)], 0)
+
+        # the "cross" terms, summed over the data
+        from static import White, Bias
+        from rbf import RBF
+        from linear import Linear
+        for (p1, i1), (p2, i2) in itertools.combinations(itertools.izip(self._parameters_, self.input_slices), 2):
+            if isinstance(p1, White) or isinstance(p2, White):
+                pass
+            elif isinstance(p1, Bias) and isinstance(p2, (RBF, Linear)):
+                tmp = p2.psi1(Z[:,i2], variational_posterior[:, i2]).sum(0)
+                psi2 += p1.variance * (tmp[:, None] + tmp[None, :])
+            elif isinstance(p2, Bias) and isinstance(p1, (RBF, Linear)):
+                tmp = p1.psi1(Z[:,i1], variational_posterior[:, i1]).sum(0)
+                psi2 += p2.variance * (tmp[:, None] + tmp[None, :])
+            else:
+                raise NotImplementedError, "psi2 cannot be computed for this kernel"
+        return psi2
+
     def update_gradients_expectations(self, dL_dpsi0, dL_dpsi1, dL_dpsi2, Z, variational_posterior):
         from static import White, Bias
         mu, S = variational_posterior.mean, variational_posterior.variance
@@ -3,7 +3,6 @@
 
 from kern import Kern
 import numpy as np
-from scipy import weave
 from ...core.parameterization import Param
 from ...core.parameterization.transformations import Logexp
 
@@ -56,56 +55,27 @@ class Coregionalize(Kern):
         self.B = np.dot(self.W, self.W.T) + np.diag(self.kappa)
 
     def K(self, X, X2=None):
-        index = np.asarray(X, dtype=np.int)
-
+        index = np.asarray(X, dtype=np.int).flatten()
         if X2 is None:
-            target = np.empty((X.shape[0], X.shape[0]), dtype=np.float64)
-            code="""
-            for(int i=0;i<N; i++){
-              target[i+i*N] = B[index[i]+output_dim*index[i]];
-              for(int j=0; j<i; j++){
-                  target[j+i*N] = B[index[i]+output_dim*index[j]];
-                  target[i+j*N] = target[j+i*N];
-                }
-              }
-            """
-            N, B, output_dim = index.size, self.B, self.output_dim
-            weave.inline(code, ['target', 'index', 'N', 'B', 'output_dim'])
+            index2 = index
         else:
-            index2 = np.asarray(X2, dtype=np.int)
-            target = np.empty((X.shape[0], X2.shape[0]), dtype=np.float64)
-            code="""
-            for(int i=0;i<num_inducing; i++){
-              for(int j=0; j<N; j++){
-                  target[i+j*num_inducing] = B[output_dim*index[j]+index2[i]];
-                }
-              }
-            """
-            N, num_inducing, B, output_dim = index.size, index2.size, self.B, self.output_dim
-            weave.inline(code, ['target', 'index', 'index2', 'N', 'num_inducing', 'B', 'output_dim'])
-        return target
-
+            index2 = np.asarray(X2, dtype=np.int).flatten()
+        return self.B[index[:, None], index2[None, :]]
 
     def Kdiag(self, X):
         return np.diag(self.B)[np.asarray(X, dtype=np.int).flatten()]
 
     def update_gradients_full(self, dL_dK, X, X2=None):
-        index = np.asarray(X, dtype=np.int)
-        dL_dK_small = np.zeros_like(self.B)
+        index = np.asarray(X, dtype=np.int).flatten()
         if X2 is None:
             index2 = index
         else:
-            index2 = np.asarray(X2, dtype=np.int)
-
-        code="""
-        for(int i=0; i<num_inducing; i++){
-          for(int j=0; j<N; j++){
-            dL_dK_small[index[j] + output_dim*index2[i]] += dL_dK[i+j*num_inducing];
-          }
-        }
-        """
-        N, num_inducing, output_dim = index.size, index2.size, self.output_dim
-        weave.inline(code, ['N', 'num_inducing', 'output_dim', 'dL_dK', 'dL_dK_small', 'index', 'index2'])
+            index2 = np.asarray(X2, dtype=np.int).flatten()
+
+        #accumulate dL_dK onto the entries of B
+        flat_index = index2[None, :] * self.output_dim + index[:, None]
+        dL_dK_small = np.bincount(flat_index.flatten(), weights=np.asarray(dL_dK).flatten(),
+                                  minlength=self.output_dim**2).reshape(self.output_dim, self.output_dim)
 
         dkappa = np.diag(dL_dK_small)
         dL_dK_small += dL_dK_small.T
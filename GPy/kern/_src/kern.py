@@ -6,9 +6,17 @@ import numpy as np
 import itertools
 from ...core.parameterization import Parameterized
 from ...core.parameterization.param import Param
+from ...util.config import config
 
+def _config_dtype():
+    if config.has_option('precision', 'kernel'):
+        return np.dtype(config.get('precision', 'kernel').strip()).type
+    return np.float64
 
 class Kern(Parameterized):
+    #the floating point type kernel matrices are computed in, see set_precision
+    _compute_dtype = _config_dtype()
+
     def __init__(self, input_dim, name, *a, **kw):
         """
         The base class for a kernel: a positive definite function
@@ -22,6 +30,35 @@ class Kern(Parameterized):
         super(Kern, self).__init__(name=name, *a, **kw)
         self.input_dim = input_dim
 
+    def set_precision(self, dtype):
+        """
+        Set the floating point type (np.float64 or np.float32) in which this
+        kernel and its parts compute distances and kernel matrices. Parameters
+        and gradients stay in float64, and inference does its cholesky
+        decompositions, solves and accumulations in float64 (mixed precision).
+
+        float32 halves the memory of (cached) kernel matrices and speeds up
+        the matrix products in distance computations. Kernel matrices then
+        have a relative error of about 1e-7, but the squared distances
+        between nearby points suffer from cancellation, with an absolute
+        error of about 1e-7 times the squared norm of the (scaled) inputs.
+
+        The default is read from the [precision] section of the configuration.
+        """
+        self._compute_dtype = np.dtype(dtype).type
+        for p in self._parameters_:
+            if isinstance(p, Kern):
+                p.set_precision(dtype)
+        self._trigger_params_changed()
+
+    def _as_compute_dtype(self, A):
+        """
+        A in the floating point type of this kernel (see :py:meth:`set_precision`).
+        """
+        if A is None or A.dtype == self._compute_dtype:
+            return A
+        return A.astype(self._compute_dtype)
+
     def K(self, X, X2):
         raise NotImplementedError
     def Kdiag(self, Xa):
@@ -32,6 +69,12 @@ class Kern(Parameterized):
         raise NotImplementedError
     def psi2(self, Z, variational_posterior):
         raise NotImplementedError
+    def psi2_sum(self, Z, variational_posterior):
+        """
+        psi2 summed over the data (M x M). Kernels override this to avoid
+        building the N x M x M psi2.
+        """
+        return self.psi2(Z, variational_posterior).sum(0)
     def gradients_X(self, dL_dK, X, X2):
         raise NotImplementedError
     def gradients_X_diag(self, dL_dK, X):
@@ -55,6 +98,10 @@ class Kern(Parameterized):
         dL_d{theta_i} = dL_dpsi0 * dpsi0_d{theta_i} +
                         dL_dpsi1 * dpsi1_d{theta_i} +
                         dL_dpsi2 * dpsi2_d{theta_i}
+
+        dL_dpsi2 is either N x M x M, or M x M if it is the same for all data
+        points, in which case it is contracted against psi2_sum. Here and in
+        the other gradients of expectations, dL_dpsi2 must be symmetric.
         """
         raise NotImplementedError
 
@@ -72,6 +119,15 @@ class Kern(Parameterized):
         """
         raise NotImplementedError
 
+    def _expand_dL_dpsi2(self, dL_dpsi2, variational_posterior):
+        """
+        dL_dpsi2 for every data point (N x M x M), for the computations which
+        have no special case for an M x M dL_dpsi2 shared by all data points.
+        """
+        if dL_dpsi2.ndim == 2:
+            return np.repeat(dL_dpsi2[None, :, :], variational_posterior.shape[0], axis=0)
+        return dL_dpsi2
+
     def plot(self, *args, **kwargs):
         """
         See GPy.plotting.matplot_dep.plot
@@ -3,7 +3,6 @@
 
 
 import numpy as np
-from scipy import weave
 from kern import Kern
 from ...util.linalg import tdot
 from ...util.misc import param_to_array
@@ -12,6 +11,7 @@ from ...core.parameterization.transformations import Logexp
 from ...util.caching import Cache_this
 from ...core.parameterization import variational
 from psi_comp import linear_psi_comp
+from psi_comp.backend import get_backend
 
 class Linear(Kern):
     """
@@ -57,12 +57,12 @@ class Linear(Kern):
     def K(self, X, X2=None):
         if self.ARD:
             if X2 is None:
-                return tdot(X*np.sqrt(self.variances))
+                return tdot(self._as_compute_dtype(X*np.sqrt(self.variances)))
             else:
                 rv = np.sqrt(self.variances)
-                return np.dot(X*rv, (X2*rv).T)
+                return np.dot(self._as_compute_dtype(X*rv), self._as_compute_dtype(X2*rv).T)
         else:
-            return self._dot_product(X, X2) * self.variances
+            return self._as_compute_dtype(self._dot_product(self._as_compute_dtype(X), self._as_compute_dtype(X2)) * self.variances)
 
     @Cache_this(limit=1, ignore_args=(0,))
     def _dot_product(self, X, X2=None):
@@ -141,12 +141,19 @@ class Linear(Kern):
             ZAinner = self._ZAinner(variational_posterior, Z)
             return np.dot(ZAinner, ZA.T)
 
+    def psi2_sum(self, Z, variational_posterior):
+        if isinstance(variational_posterior, variational.SpikeAndSlabPosterior):
+            return self.psi2(Z, variational_posterior).sum(0)
+        ZA = Z * self.variances
+        return np.dot(np.dot(ZA, self._inner_sum(variational_posterior)), ZA.T)
+
     def update_gradients_expectations(self, dL_dpsi0, dL_dpsi1, dL_dpsi2, Z, variational_posterior):
         if isinstance(variational_posterior, variational.SpikeAndSlabPosterior):
             gamma = variational_posterior.binary_prob
             mu = variational_posterior.mean
             S = variational_posterior.variance
             mu2S = np.square(mu)+S
+            dL_dpsi2 = self._expand_dL_dpsi2(dL_dpsi2, variational_posterior)
             
             _dpsi2_dvariance, _, _, _, _ = linear_psi_comp._psi2computations(self.variances, Z, mu, S, gamma)
             grad = np.einsum('n,nq,nq->q',dL_dpsi0,gamma,mu2S) + np.einsum('nm,nq,mq,nq->q',dL_dpsi1,gamma,Z,mu) +\
@@ -163,7 +170,13 @@ class Linear(Kern):
             if self.ARD: self.variances.gradient += tmp.sum(0)
             else: self.variances.gradient += tmp.sum()
             #psi2
-            if self.ARD:
+            if dL_dpsi2.ndim == 2:
+                if self.ARD:
+                    ZdLZ = np.dot(Z.T, np.dot(dL_dpsi2, Z))
+                    self.variances.gradient += 2.*np.dot(ZdLZ * self._inner_sum(variational_posterior), self.variances)
+                else:
+                    self.variances.gradient += 2.*np.sum(dL_dpsi2 * self.psi2_sum(Z, variational_posterior))/self.variances
+            elif self.ARD:
                 tmp = dL_dpsi2[:, :, :, None] * (self._ZAinner(variational_posterior, Z)[:, :, None, :] * Z[None, None, :, :])
                 self.variances.gradient += 2.*tmp.sum(0).sum(0).sum(0)
             else:
@@ -174,6 +187,7 @@ class Linear(Kern):
             gamma = variational_posterior.binary_prob
             mu = variational_posterior.mean
             S = variational_posterior.variance
+            dL_dpsi2 = self._expand_dL_dpsi2(dL_dpsi2, variational_posterior)
             _, _, _, _, _dpsi2_dZ = linear_psi_comp._psi2computations(self.variances, Z, mu, S, gamma)
             
             grad =  np.einsum('nm,nq,q,nq->mq',dL_dpsi1,gamma, self.variances,mu) +\
@@ -184,7 +198,10 @@ class Linear(Kern):
             #psi1
             grad = self.gradients_X(dL_dpsi1.T, Z, variational_posterior.mean)
             #psi2
-            self._weave_dpsi2_dZ(dL_dpsi2, Z, variational_posterior, grad)
+            if dL_dpsi2.ndim == 2:
+                grad += 2.*np.dot(dL_dpsi2, np.dot(Z * self.variances, self._inner_sum(variational_posterior))) * self.variances
+            else:
+                self._dpsi2_dZ(dL_dpsi2, Z, variational_posterior, grad)
             return grad
 
     def gradients_qX_expectations(self, dL_dpsi0, dL_dpsi1, dL_dpsi2, Z, variational_posterior):
@@ -193,6 +210,7 @@ class Linear(Kern):
             mu = variational_posterior.mean
             S = variational_posterior.variance
             mu2S = np.square(mu)+S            
+            dL_dpsi2 = self._expand_dL_dpsi2(dL_dpsi2, variational_posterior)
             _, _dpsi2_dgamma, _dpsi2_dmu, _dpsi2_dS, _ = linear_psi_comp._psi2computations(self.variances, Z, mu, S, gamma)
             
             grad_gamma = np.einsum('n,q,nq->nq',dL_dpsi0,self.variances,mu2S) + np.einsum('nm,q,mq,nq->nq',dL_dpsi1,self.variances,Z,mu) +\
@@ -210,7 +228,13 @@ class Linear(Kern):
             # psi1
             grad_mu += (dL_dpsi1[:, :, None] * (Z * self.variances)).sum(1)
             # psi2
-            self._weave_dpsi2_dmuS(dL_dpsi2, Z, variational_posterior, grad_mu, grad_S)
+            if dL_dpsi2.ndim == 2:
+                ZA = Z * self.variances
+                AZdLZA = np.dot(ZA.T, np.dot(dL_dpsi2, ZA))
+                grad_mu += 2.*np.dot(variational_posterior.mean, AZdLZA)
+                grad_S += np.diag(AZdLZA)
+            else:
+                self._dpsi2_dmuS(dL_dpsi2, Z, variational_posterior, grad_mu, grad_S)
     
             return grad_mu, grad_S
 
@@ -219,90 +243,26 @@ class Linear(Kern):
     #--------------------------------------------------#
 
 
-    def _weave_dpsi2_dmuS(self, dL_dpsi2, Z, vp, target_mu, target_S):
-        # Think N,num_inducing,num_inducing,input_dim
-        ZA = Z * self.variances
-        AZZA = ZA.T[:, None, :, None] * ZA[None, :, None, :]
-        AZZA = AZZA + AZZA.swapaxes(1, 2)
-        AZZA_2 = AZZA/2.
-
-        #Using weave, we can exploit the symmetry of this problem:
-        code = """
-        int n, m, mm,q,qq;
-        double factor,tmp;
-        #pragma omp parallel for private(m,mm,q,qq,factor,tmp)
-        for(n=0;n<N;n++){
-          for(m=0;m<num_inducing;m++){
-            for(mm=0;mm<=m;mm++){
-              //add in a factor of 2 for the off-diagonal terms (and then count them only once)
-              if(m==mm)
-                factor = dL_dpsi2(n,m,mm);
-              else
-                factor = 2.0*dL_dpsi2(n,m,mm);
-
-              for(q=0;q<input_dim;q++){
-
-                //take the dot product of mu[n,:] and AZZA[:,m,mm,q] TODO: blas!
-                tmp = 0.0;
-                for(qq=0;qq<input_dim;qq++){
-                  tmp += mu(n,qq)*AZZA(qq,m,mm,q);
-                }
-
-                target_mu(n,q) += factor*tmp;
-                target_S(n,q) += factor*AZZA_2(q,m,mm,q);
-              }
-            }
-          }
-        }
-        """
-        support_code = """
-        #include <omp.h>
-        #include <math.h>
-        """
-        weave_options = {'headers'           : ['<omp.h>'],
-                         'extra_compile_args': ['-fopenmp -O3'],  #-march=native'],
-                         'extra_link_args'   : ['-lgomp']}
-        mu = vp.mean
-        N,num_inducing,input_dim,mu = mu.shape[0],Z.shape[0],mu.shape[1],param_to_array(mu)
-        weave.inline(code, support_code=support_code, libraries=['gomp'],
-                     arg_names=['N','num_inducing','input_dim','mu','AZZA','AZZA_2','target_mu','target_S','dL_dpsi2'],
-                     type_converters=weave.converters.blitz,**weave_options)
-
-
-    def _weave_dpsi2_dZ(self, dL_dpsi2, Z, vp, target):
-        AZA = self.variances*self._ZAinner(vp, Z)
-        code="""
-        int n,m,mm,q;
-        #pragma omp parallel for private(n,mm,q)
-        for(m=0;m<num_inducing;m++){
-          for(q=0;q<input_dim;q++){
-            for(mm=0;mm<num_inducing;mm++){
-              for(n=0;n<N;n++){
-                target(m,q) += 2*dL_dpsi2(n,m,mm)*AZA(n,mm,q);
-              }
-            }
-          }
-        }
-        """
-        support_code = """
-        #include <omp.h>
-        #include <math.h>
-        """
-        weave_options = {'headers'           : ['<omp.h>'],
-                         'extra_compile_args': ['-fopenmp -O3'],  #-march=native'],
-                         'extra_link_args'   : ['-lgomp']}
-
-        N,num_inducing,input_dim = vp.mean.shape[0],Z.shape[0],vp.mean.shape[1]
-        mu = param_to_array(vp.mean)
-        weave.inline(code, support_code=support_code, libraries=['gomp'],
-                     arg_names=['N','num_inducing','input_dim','AZA','target','dL_dpsi2'],
-                     type_converters=weave.converters.blitz,**weave_options)
+    def _dpsi2_dmuS(self, dL_dpsi2, Z, vp, target_mu, target_S):
+        ZA = param_to_array(Z * self.variances)
+        get_backend().linear_dpsi2_dmuS(dL_dpsi2, ZA, param_to_array(vp.mean), target_mu, target_S)
 
+    def _dpsi2_dZ(self, dL_dpsi2, Z, vp, target):
+        AZA = param_to_array(self.variances*self._ZAinner(vp, Z))
+        get_backend().linear_dpsi2_dZ(dL_dpsi2, AZA, target)
 
     @Cache_this(limit=1, ignore_args=(0,))
     def _mu2S(self, vp):
         return np.square(vp.mean) + vp.variance
 
+    @Cache_this(limit=1, ignore_args=(0,))
+    def _inner_sum(self, vp):
+        """
+        The sum over the data of the second moments <x x^T> (Q x Q).
+        """
+        mu, S = param_to_array(vp.mean, vp.variance)
+        return np.dot(mu.T, mu) + np.diag(S.sum(0))
+
     @Cache_this(limit=1)
     def _ZAinner(self, vp, Z):
         ZA = Z*self.variances
@@ -0,0 +1,115 @@
+/*
+ * Copyright (c) 2014, GPy authors (see AUTHORS.txt).
+ * Licensed under the BSD 3-clause license (see LICENSE.txt)
+ *
+ * OpenMP loops for the psi statistics of the RBF and linear kernels, see
+ * backend.py. All arrays are C contiguous doubles. Built at install time by
+ * setup.py and loaded through ctypes.
+ */
+
+#include <math.h>
+#include <stdlib.h>
+
+void rbf_psi2(int N, int M, int Q, const double *mu, const double *Zhat,
+              const double *Zdist_sq, const double *denom_l2,
+              const double *half_log_denom, double variance_sq,
+              double *mudist, double *mudist_sq, double *psi2)
+{
+    int n;
+    #pragma omp parallel for
+    for (n = 0; n < N; n++) {
+        int m, mm, q;
+        double tmp, exponent;
+        for (m = 0; m < M; m++) {
+            for (mm = 0; mm <= m; mm++) {
+                exponent = 0.0;
+                for (q = 0; q < Q; q++) {
+                    tmp = mu[n*Q + q] - Zhat[(m*M + mm)*Q + q];
+                    mudist[((n*M + m)*M + mm)*Q + q] = tmp;
+                    mudist[((n*M + mm)*M + m)*Q + q] = tmp;
+                    tmp = tmp*tmp/denom_l2[n*Q + q];
+                    mudist_sq[((n*M + m)*M + mm)*Q + q] = tmp;
+                    mudist_sq[((n*M + mm)*M + m)*Q + q] = tmp;
+                    exponent += -Zdist_sq[(m*M + mm)*Q + q] - tmp - half_log_denom[n*Q + q];
+                }
+                psi2[(n*M + m)*M + mm] = variance_sq*exp(exponent);
+                psi2[(n*M + mm)*M + m] = psi2[(n*M + m)*M + mm];
+            }
+        }
+    }
+}
+
+void rbf_psi2_lengthscale_grads(int N, int M, int Q, const double *dL_dpsi2,
+                                const double *psi2, const double *Zdist_sq,
+                                const double *S, const double *mudist_sq,
+                                const double *l2, double *result)
+{
+    int n, m, mm, q;
+    double tmp, factor;
+    for (q = 0; q < Q; q++) {
+        tmp = 0.0;
+        #pragma omp parallel for private(m, mm, factor) reduction(+:tmp)
+        for (n = 0; n < N; n++) {
+            for (m = 0; m < M; m++) {
+                for (mm = 0; mm <= m; mm++) {
+                    /* count the off-diagonal terms twice */
+                    factor = (m == mm) ? 1.0 : 2.0;
+                    tmp += factor*dL_dpsi2[(n*M + m)*M + mm]*psi2[(n*M + m)*M + mm]
+                           *(Zdist_sq[(m*M + mm)*Q + q]*(2.0*S[n*Q + q]/l2[q] + 1.0)
+                             + mudist_sq[((n*M + m)*M + mm)*Q + q] + S[n*Q + q]/l2[q])
+                           /(2.0*S[n*Q + q] + l2[q]);
+                }
+            }
+        }
+        result[q] = tmp;
+    }
+}
+
+void linear_dpsi2_dmuS(int N, int M, int Q, const double *dL_dpsi2,
+                       const double *ZA, const double *mu,
+                       double *target_mu, double *target_S)
+{
+    int n;
+    #pragma omp parallel for
+    for (n = 0; n < N; n++) {
+        int m, mm, q, qq;
+        double factor;
+        /* the inner products of mu[n] with the scaled inducing inputs */
+        double *muZA = (double *) malloc(M*sizeof(double));
+        for (m = 0; m < M; m++) {
+            muZA[m] = 0.0;
+            for (qq = 0; qq < Q; qq++)
+                muZA[m] += mu[n*Q + qq]*ZA[m*Q + qq];
+        }
+        for (m = 0; m < M; m++) {
+            for (mm = 0; mm <= m; mm++) {
+                /* count the off-diagonal terms twice */
+                factor = dL_dpsi2[(n*M + m)*M + mm];
+                if (m != mm)
+                    factor *= 2.0;
+                for (q = 0; q < Q; q++) {
+                    target_mu[n*Q + q] += factor*(muZA[m]*ZA[mm*Q + q] + muZA[mm]*ZA[m*Q + q]);
+                    target_S[n*Q + q] += factor*ZA[m*Q + q]*ZA[mm*Q + q];
+                }
+            }
+        }
+        free(muZA);
+    }
+}
+
+void linear_dpsi2_dZ(int N, int M, int Q, const double *dL_dpsi2,
+                     const double *AZA, double *target)
+{
+    int m;
+    #pragma omp parallel for
+    for (m = 0; m < M; m++) {
+        int mm, n, q;
+        for (q = 0; q < Q; q++) {
+            for (mm = 0; mm < M; mm++) {
+                for (n = 0; n < N; n++) {
+                    target[m*Q + q] += 2.0*dL_dpsi2[(n*M + m)*M + mm]*AZA[(n*M + mm)*Q + q];
+                }
+            }
+        }
+    }
+}
@@ -0,0 +1,186 @@
+# Copyright (c) 2014, GPy authors (see AUTHORS.txt).
+# Licensed under the BSD 3-clause license (see LICENSE.txt)
+
+"""
+Backends for the loops in the psi statistics of the RBF and linear kernels.
+
+Every backend implements the same functions, with identical results:
+
+ * NumpyBackend: pure NumPy. The temporaries are computed for blocks of the
+   data, such that they stay below _block_bytes bytes.
+ * OpenMPBackend: the ahead-of-time compiled C extension _psi_omp, built
+   with OpenMP at install time (see setup.py), called through ctypes.
+
+The outputs (e.g. the N x M x M x Q mudist of rbf_psi2) are returned for all
+the rows of the data passed in, so their memory is bounded by the callers:
+the RBF kernel passes tiles of the data (see RBF._psi2_tiles) wherever the
+gradients only need the sum of psi2 over the data.
+
+The OpenMP backend is used if the [parallel] openmp option of the
+configuration is set and the extension has been built, otherwise the NumPy
+backend is used. Nothing is compiled at runtime. Use :py:func:`set_backend`
+to switch at runtime.
+"""
+
+import os
+import ctypes
+import warnings
+import numpy as np
+from ....util.config import config
+
+_block_bytes = 1 << 26
+
+def _blocks(N, row_size):
+    """
+    Slices over N rows, each block of rows holding at most _block_bytes bytes
+    for row_size doubles per row.
+    """
+    block = max(1, _block_bytes // (8 * row_size))
+    for start in xrange(0, N, block):
+        yield slice(start, start + block)
+
+class NumpyBackend(object):
+    name = 'numpy'
+
+    def rbf_psi2(self, mu, Zhat, Zdist_sq, denom_l2, half_log_denom, variance_sq):
+        """
+        psi2 of the RBF kernel (N x M x M) and its intermediates mudist and mudist_sq (N x M x M x Q).
+
+        :param mu: the variational means (N x Q)
+        :param Zhat: the midpoints of the inducing inputs (M x M x Q)
+        :param Zdist_sq: the scaled squared half distances of the inducing inputs (M x M x Q)
+        :param denom_l2: 2S + l^2 (N x Q)
+        :param half_log_denom: 0.5 log(2S/l^2 + 1) (N x Q)
+        """
+        N, Q = mu.shape
+        M = Zhat.shape[0]
+        mudist = np.empty((N, M, M, Q))
+        mudist_sq = np.empty((N, M, M, Q))
+        psi2 = np.empty((N, M, M))
+        for s in _blocks(N, M * M * Q):
+            np.subtract(mu[s, None, None, :], Zhat[None, :, :, :], mudist[s])
+            np.divide(np.square(mudist[s]), denom_l2[s, None, None, :], mudist_sq[s])
+            exponent = -np.sum(Zdist_sq[None, :, :, :] + mudist_sq[s], -1) - half_log_denom[s].sum(-1)[:, None, None]
+            psi2[s] = variance_sq * np.exp(exponent)
+        return mudist, mudist_sq, psi2
+
+    def rbf_psi2_lengthscale_grads(self, dL_dpsi2, psi2, Zdist_sq, S, mudist_sq, l2):
+        """
+        sum_{n,m,m'} dL_dpsi2 * psi2 * (Zdist_sq (2S/l^2 + 1) + mudist_sq + S/l^2) / (2S + l^2),
+        one value per input dimension (l2 has one entry per input dimension).
+        """
+        N, M = psi2.shape[:2]
+        result = np.zeros(S.shape[1])
+        for s in _blocks(N, M * M):
+            tmp = dL_dpsi2[s] * psi2[s]
+            S_l2 = S[s] / l2
+            result += ((np.einsum('ijk,jkl->il', tmp, Zdist_sq) * (2.*S_l2 + 1.)
+                        + np.einsum('ijk,ijkl->il', tmp, mudist_sq[s])
+                        + tmp.sum(2).sum(1)[:, None] * S_l2) / (2.*S[s] + l2)).sum(0)
+        return result
+
+    def linear_dpsi2_dmuS(self, dL_dpsi2, ZA, mu, target_mu, target_S):
+        """
+        Add the gradients of sum(dL_dpsi2 * psi2) of the linear kernel wrt the
+        variational means and variances to target_mu and target_S (in place).
+        ZA are the inducing inputs times the variances.
+        """
+        N, M = dL_dpsi2.shape[:2]
+        for s in _blocks(N, M * M):
+            dL_dpsi2_ZA = np.dot(dL_dpsi2[s], ZA) # n,M,Q
+            target_mu[s] += 2.*np.einsum('ij,ijk->ik', np.dot(mu[s], ZA.T), dL_dpsi2_ZA)
+            target_S[s] += np.einsum('ijk,jk->ik', dL_dpsi2_ZA, ZA)
+
+    def linear_dpsi2_dZ(self, dL_dpsi2, AZA, target):
+        """
+        Add the gradient of sum(dL_dpsi2 * psi2) of the linear kernel wrt the
+        inducing inputs to target (in place), AZA being variances * ZAinner (N x M x Q).
+        """
+        target += 2.*np.tensordot(dL_dpsi2, AZA, ([0, 2], [0, 1]))
+
+class OpenMPBackend(NumpyBackend):
+    name = 'openmp'
+
+    def __init__(self, lib):
+        self.lib = lib
+        array = np.ctypeslib.ndpointer(dtype=np.float64, flags='C_CONTIGUOUS')
+        i, d = ctypes.c_int, ctypes.c_double
+        lib.rbf_psi2.argtypes = [i, i, i, array, array, array, array, array, d, array, array, array]
+        lib.rbf_psi2_lengthscale_grads.argtypes = [i, i, i, array, array, array, array, array, array, array]
+        lib.linear_dpsi2_dmuS.argtypes = [i, i, i, array, array, array, array, array]
+        lib.linear_dpsi2_dZ.argtypes = [i, i, i, array, array, array]
+        for f in [lib.rbf_psi2, lib.rbf_psi2_lengthscale_grads, lib.linear_dpsi2_dmuS, lib.linear_dpsi2_dZ]:
+            f.restype = None
+
+    def rbf_psi2(self, mu, Zhat, Zdist_sq, denom_l2, half_log_denom, variance_sq):
+        N, Q = mu.shape
+        M = Zhat.shape[0]
+        mudist = np.empty((N, M, M, Q))
+        mudist_sq = np.empty((N, M, M, Q))
+        psi2 = np.empty((N, M, M))
+        c = np.ascontiguousarray
+        self.lib.rbf_psi2(N, M, Q, c(mu, dtype=np.float64), c(Zhat, dtype=np.float64), c(Zdist_sq, dtype=np.float64),
+                          c(denom_l2, dtype=np.float64), c(half_log_denom, dtype=np.float64), float(variance_sq),
+                          mudist, mudist_sq, psi2)
+        return mudist, mudist_sq, psi2
+
+    def rbf_psi2_lengthscale_grads(self, dL_dpsi2, psi2, Zdist_sq, S, mudist_sq, l2):
+        N, Q = S.shape
+        M = psi2.shape[1]
+        result = np.zeros(Q)
+        c = np.ascontiguousarray
+        self.lib.rbf_psi2_lengthscale_grads(N, M, Q, c(dL_dpsi2, dtype=np.float64), c(psi2, dtype=np.float64),
+                                            c(Zdist_sq, dtype=np.float64), c(S, dtype=np.float64),
+                                            c(mudist_sq, dtype=np.float64), c(l2, dtype=np.float64), result)
+        return result
+
+    def linear_dpsi2_dmuS(self, dL_dpsi2, ZA, mu, target_mu, target_S):
+        N, Q = mu.shape
+        M = ZA.shape[0]
+        c = np.ascontiguousarray
+        grad_mu, grad_S = np.zeros((N, Q)), np.zeros((N, Q))
+        self.lib.linear_dpsi2_dmuS(N, M, Q, c(dL_dpsi2, dtype=np.float64), c(ZA, dtype=np.float64),
+                                   c(mu, dtype=np.float64), grad_mu, grad_S)
+        target_mu += grad_mu
+        target_S += grad_S
+
+    def linear_dpsi2_dZ(self, dL_dpsi2, AZA, target):
+        N, M, Q = AZA.shape
+        grad = np.zeros((M, Q))
+        c = np.ascontiguousarray
+        self.lib.linear_dpsi2_dZ(N, M, Q, c(dL_dpsi2, dtype=np.float64), c(AZA, dtype=np.float64), grad)
+        target += grad
+
+def _load_openmp():
+    try:
+        lib = np.ctypeslib.load_library('_psi_omp', os.path.dirname(__file__))
+    except OSError:
+        return None
+    return OpenMPBackend(lib)
+
+_backends = {'numpy': NumpyBackend()}
+
+def set_backend(name):
+    """
+    Select the backend ('numpy' or 'openmp') for the psi statistics.
+    """
+    global _backend
+    if name == 'openmp' and 'openmp' not in _backends:
+        backend = _load_openmp()
+        if backend is None:
+            raise ValueError, "the OpenMP extension _psi_omp has not been built, reinstall GPy with an OpenMP capable compiler"
+        _backends['openmp'] = backend
+    _backend = _backends[name]
+
+def get_backend():
+    """
+    The backend currently used for the psi statistics.
+    """
+    return _backend
+
+_backend = _backends['numpy']
+if config.getboolean('parallel', 'openmp'):
+    try:
+        set_backend('openmp')
+    except ValueError, e:
+        warnings.warn(str(e) + ", using the numpy backend")
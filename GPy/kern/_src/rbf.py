@@ -3,12 +3,37 @@
 
 
 import numpy as np
-from scipy import weave
 from ...util.misc import param_to_array
 from stationary import Stationary
 from GPy.util.caching import Cache_this
 from ...core.parameterization import variational
 from psi_comp import ssrbf_psi_comp
+from psi_comp.backend import get_backend
+
+# The distances between the inducing inputs and the variational means do not
+# depend on the kernel parameters. They are cached on Z and the means only (not
+# on the kernel), so all RBF kernels on the same Z and q(X), such as the
+# kernels of the views of MRD, share them and only recompute the parts
+# depending on their own lengthscales and variance.
+
+@Cache_this(limit=2)
+def _psi1_distances(Z, mu):
+    """
+    The differences Z - mu of the inducing inputs and the variational means
+    (N x M x Q) and their squares.
+    """
+    dist = param_to_array(Z)[None, :, :] - param_to_array(mu)[:, None, :] # N,M,Q
+    return dist, np.square(dist)
+
+@Cache_this(limit=2)
+def _Z_distances(Z):
+    """
+    The midpoints Zhat and half differences Zdist of all pairs of inducing inputs (M x M x Q).
+    """
+    Z = param_to_array(Z)
+    Zhat = 0.5 * (Z[:, None, :] + Z[None, :, :]) # M,M,Q
+    Zdist = 0.5 * (Z[:, None, :] - Z[None, :, :]) # M,M,Q
+    return Zhat, Zdist
 
 class RBF(Stationary):
     """
@@ -22,7 +47,6 @@ class RBF(Stationary):
 
     def __init__(self, input_dim, variance=1., lengthscale=None, ARD=False, name='rbf'):
         super(RBF, self).__init__(input_dim, variance, lengthscale, ARD, name)
-        self.weave_options = {}
 
     def K_of_r(self, r):
         return self.variance * np.exp(-0.5 * r**2)
@@ -30,6 +54,10 @@ class RBF(Stationary):
     def dK_dr(self, r):
         return -r*self.K_of_r(r)
 
+    def K_and_dK_dr(self, r):
+        K = self.K_of_r(r)
+        return K, -r*K
+
     #---------------------------------------#
     #             PSI statistics            #
     #---------------------------------------#
@@ -51,9 +79,19 @@ class RBF(Stationary):
             _, _, _, _, psi2 = self._psi2computations(Z, variational_posterior)
         return psi2
 
+    @Cache_this(limit=1)
+    def psi2_sum(self, Z, variational_posterior):
+        if isinstance(variational_posterior, variational.SpikeAndSlabPosterior):
+            return self.psi2(Z, variational_posterior).sum(0)
+        psi2_sum = np.zeros((Z.shape[0], Z.shape[0]))
+        for _, _, _, _, psi2 in self._psi2_tiles(Z, variational_posterior):
+            psi2_sum += psi2.sum(0)
+        return psi2_sum
+
     def update_gradients_expectations(self, dL_dpsi0, dL_dpsi1, dL_dpsi2, Z, variational_posterior):
         # Spike-and-Slab GPLVM
         if isinstance(variational_posterior, variational.SpikeAndSlabPosterior):
+            dL_dpsi2 = self._expand_dL_dpsi2(dL_dpsi2, variational_posterior)
             _, _dpsi1_dvariance, _, _, _, _, _dpsi1_dlengthscale = ssrbf_psi_comp._psi1computations(self.variance, self.lengthscale, Z, variational_posterior.mean, variational_posterior.variance, variational_posterior.binary_prob)
             _, _dpsi2_dvariance, _, _, _, _, _dpsi2_dlengthscale = ssrbf_psi_comp._psi2computations(self.variance, self.lengthscale, Z, variational_posterior.mean, variational_posterior.variance, variational_posterior.binary_prob)
     
@@ -94,13 +132,18 @@ class RBF(Stationary):
             self.variance.gradient += np.sum(dL_dpsi1 * psi1) / self.variance
 
             #from psi2
-            S = variational_posterior.variance
-            _, Zdist_sq, _, mudist_sq, psi2 = self._psi2computations(Z, variational_posterior)
+            if dL_dpsi2.ndim == 2:
+                dpsi2_dlength = self._psi2_sum_lengthscale_grads(dL_dpsi2, Z, variational_posterior)
+                psi2 = self.psi2_sum(Z, variational_posterior)
+            else:
+                S = variational_posterior.variance
+                _, Zdist_sq, _, mudist_sq, psi2 = self._psi2computations(Z, variational_posterior)
+                dpsi2_dlength = self._psi2_lengthscale_grads(dL_dpsi2, psi2, Zdist_sq, S, mudist_sq, l2)
 
             if not self.ARD:
-                self.lengthscale.gradient += self._weave_psi2_lengthscale_grads(dL_dpsi2, psi2, Zdist_sq, S, mudist_sq, l2).sum()
+                self.lengthscale.gradient += dpsi2_dlength.sum()
             else:
-                self.lengthscale.gradient += self._weave_psi2_lengthscale_grads(dL_dpsi2, psi2, Zdist_sq, S, mudist_sq, l2)
+                self.lengthscale.gradient += dpsi2_dlength
 
             self.variance.gradient += 2.*np.sum(dL_dpsi2 * psi2)/self.variance
 
@@ -110,6 +153,7 @@ class RBF(Stationary):
     def gradients_Z_expectations(self, dL_dpsi1, dL_dpsi2, Z, variational_posterior):
         # Spike-and-Slab GPLVM
         if isinstance(variational_posterior, variational.SpikeAndSlabPosterior):
+            dL_dpsi2 = self._expand_dL_dpsi2(dL_dpsi2, variational_posterior)
             _, _, _, _, _, _dpsi1_dZ, _ = ssrbf_psi_comp._psi1computations(self.variance, self.lengthscale, Z, variational_posterior.mean, variational_posterior.variance, variational_posterior.binary_prob)
             _, _, _, _, _, _dpsi2_dZ, _ = ssrbf_psi_comp._psi2computations(self.variance, self.lengthscale, Z, variational_posterior.mean, variational_posterior.variance, variational_posterior.binary_prob)
     
@@ -130,6 +174,14 @@ class RBF(Stationary):
             grad = np.einsum('ij,ij,ijk,ijk->jk', dL_dpsi1, psi1, dist, -1./(denom*l2))
 
             #psi2
+            if dL_dpsi2.ndim == 2:
+                _, Zdist = _Z_distances(Z)
+                for s, mudist, _, denom_l2, psi2 in self._psi2_tiles(Z, variational_posterior):
+                    tmp = dL_dpsi2 * psi2 # n, M, M
+                    grad += 2.*np.einsum('jk,jkl->kl', tmp.sum(0), Zdist / l2)
+                    grad += 2.*np.einsum('ijk,ijkl,il->kl', tmp, mudist, 1./denom_l2)
+                return grad
+
             Zdist, Zdist_sq, mudist, mudist_sq, psi2 = self._psi2computations(Z, variational_posterior)
             term1 = Zdist / l2 # M, M, Q
             S = variational_posterior.variance
@@ -144,6 +196,7 @@ class RBF(Stationary):
     def gradients_qX_expectations(self, dL_dpsi0, dL_dpsi1, dL_dpsi2, Z, variational_posterior):
         # Spike-and-Slab GPLVM
         if isinstance(variational_posterior, variational.SpikeAndSlabPosterior):
+            dL_dpsi2 = self._expand_dL_dpsi2(dL_dpsi2, variational_posterior)
             ndata = variational_posterior.mean.shape[0]
             
             _, _, _dpsi1_dgamma, _dpsi1_dmu, _dpsi1_dS, _, _ = ssrbf_psi_comp._psi1computations(self.variance, self.lengthscale, Z, variational_posterior.mean, variational_posterior.variance, variational_posterior.binary_prob)
@@ -169,6 +222,13 @@ class RBF(Stationary):
             grad_mu = np.sum(dL_dpsi1[:, :, None] * tmp * dist, 1)
             grad_S = np.sum(dL_dpsi1[:, :, None] * 0.5 * tmp * (dist_sq - 1), 1)
             #psi2
+            if dL_dpsi2.ndim == 2:
+                for s, mudist, mudist_sq, denom_l2, psi2 in self._psi2_tiles(Z, variational_posterior):
+                    tmp = dL_dpsi2 * psi2 # n, M, M
+                    grad_mu[s] += -2.*np.einsum('ijk,ijkl->il', tmp, mudist) / denom_l2
+                    grad_S[s] += (2.*np.einsum('ijk,ijkl->il', tmp, mudist_sq) - tmp.sum(2).sum(1)[:, None]) / denom_l2
+                return grad_mu, grad_S
+
             _, _, mudist, mudist_sq, psi2 = self._psi2computations(Z, variational_posterior)
             S = variational_posterior.variance
             tmp = psi2[:, :, :, None] / (2.*S[:,None,None,:] + l2)
@@ -186,21 +246,54 @@ class RBF(Stationary):
 
     @Cache_this(limit=1)
     def _psi1computations(self, Z, vp):
-        mu, S = vp.mean, vp.variance
+        S = vp.variance
         l2 = self.lengthscale **2
         denom = S[:, None, :] / l2 + 1. # N,1,Q
-        dist = Z[None, :, :] - mu[:, None, :] # N,M,Q
-        dist_sq = np.square(dist) / l2 / denom # N,M,Q
+        dist, dist_sq = _psi1_distances(Z, vp.mean) # N,M,Q
+        dist_sq = dist_sq / l2 / denom # N,M,Q
         exponent = -0.5 * np.sum(dist_sq + np.log(denom), -1)#N,M
         psi1 = self.variance * np.exp(exponent) # N,M
         return denom, dist, dist_sq, psi1
 
-
-    @Cache_this(limit=1, ignore_args=(0,))
-    def _Z_distances(self, Z):
-        Zhat = 0.5 * (Z[:, None, :] + Z[None, :, :]) # M,M,Q
-        Zdist = 0.5 * (Z[:, None, :] - Z[None, :, :]) # M,M,Q
-        return Zhat, Zdist
+    def _psi2_tiles(self, Z, vp):
+        """
+        Compute psi2 (and its intermediates mudist, mudist_sq and 2S + l^2)
+        for tiles of the data, each tile taking about _tile_bytes bytes,
+        instead of for all N data points at once. Each tile is computed by
+        the psi statistics backend (see :py:mod:`psi_comp.backend`).
+        """
+        mu, S = param_to_array(vp.mean, vp.variance)
+        N, Q = mu.shape
+        M = Z.shape[0]
+        Zhat, Zdist = _Z_distances(Z)
+        Zdist_sq = np.square(Zdist / self.lengthscale) # M,M,Q
+        l2 = param_to_array(self.lengthscale **2)
+        denom_l2 = 2.*S + l2 # N,Q
+        half_log_denom = 0.5 * np.log(denom_l2 / l2) # N,Q
+        variance_sq = float(np.square(self.variance))
+        backend = get_backend()
+        block = max(1, self._tile_bytes // (8 * M * M * Q))
+        for start in xrange(0, N, block):
+            s = slice(start, start + block)
+            mudist, mudist_sq, psi2 = backend.rbf_psi2(mu[s], Zhat, Zdist_sq, denom_l2[s], half_log_denom[s], variance_sq)
+            yield s, mudist, mudist_sq, denom_l2[s], psi2
+
+    def _psi2_sum_lengthscale_grads(self, dL_dpsi2, Z, vp):
+        """
+        The gradient of sum(dL_dpsi2 * psi2_sum) wrt the (ARD) lengthscales,
+        for an M x M dL_dpsi2, computed in tiles of the data.
+        """
+        S = param_to_array(vp.variance)
+        _, Zdist = _Z_distances(Z)
+        Zdist_sq = np.square(Zdist / self.lengthscale) # M,M,Q
+        l2 = self.lengthscale **2
+        result = np.zeros(self.input_dim)
+        for s, _, mudist_sq, denom_l2, psi2 in self._psi2_tiles(Z, vp):
+            tmp = dL_dpsi2 * psi2 # n,M,M
+            result += np.einsum('jk,jkl->l', tmp.sum(0), Zdist_sq) / l2
+            result += np.einsum('ijk,ijkl,il->l', tmp, mudist_sq, 1./denom_l2)
+            result += np.dot(tmp.sum(2).sum(1), S[s] / l2 / denom_l2)
+        return 2.*result*self.lengthscale
 
     @Cache_this(limit=1)
     def _psi2computations(self, Z, vp):
@@ -210,106 +303,22 @@ class RBF(Stationary):
         M = Z.shape[0]
 
         #compute required distances
-        Zhat, Zdist = self._Z_distances(Z)
+        Zhat, Zdist = _Z_distances(Z)
         Zdist_sq = np.square(Zdist / self.lengthscale) # M,M,Q
 
-        #allocate memory for the things we want to compute
-        mudist = np.empty((N, M, M, Q))
-        mudist_sq = np.empty((N, M, M, Q))
-        psi2 = np.empty((N, M, M))
-
         l2 = self.lengthscale **2
-        denom = (2.*S[:,None,None,:] / l2) + 1. # N,Q
-        half_log_denom = 0.5 * np.log(denom[:,0,0,:])
-        denom_l2 = denom[:,0,0,:]*l2
+        denom = (2.*S / l2) + 1. # N,Q
+        half_log_denom = 0.5 * np.log(denom)
+        denom_l2 = denom*l2
 
         variance_sq = float(np.square(self.variance))
-        code = """
-        double tmp, exponent_tmp;
-
-        #pragma omp parallel for private(tmp, exponent_tmp)
-        for (int n=0; n<N; n++)
-        {
-            for (int m=0; m<M; m++)
-            {
-                for (int mm=0; mm<(m+1); mm++)
-                {
-                    exponent_tmp = 0.0;
-                    for (int q=0; q<Q; q++)
-                    {
-                        //compute mudist
-                        tmp = mu(n,q) - Zhat(m,mm,q);
-                        mudist(n,m,mm,q) = tmp;
-                        mudist(n,mm,m,q) = tmp;
-
-                        //now mudist_sq
-                        tmp = tmp*tmp/denom_l2(n,q);
-                        mudist_sq(n,m,mm,q) = tmp;
-                        mudist_sq(n,mm,m,q) = tmp;
-
-                        //now exponent
-                        tmp = -Zdist_sq(m,mm,q) - tmp - half_log_denom(n,q);
-                        exponent_tmp += tmp;
-                    }
-                    //compute psi2 by exponontiating
-                    psi2(n,m,mm) = variance_sq * exp(exponent_tmp);
-                    psi2(n,mm,m) = psi2(n,m,mm);
-                }
-            }
-        }
-        """
-
-        support_code = """
-        #include <omp.h>
-        #include <math.h>
-        """
-        mu = param_to_array(mu)
-        weave.inline(code, support_code=support_code, libraries=['gomp'],
-                     arg_names=['N', 'M', 'Q', 'mu', 'Zhat', 'mudist_sq', 'mudist', 'denom_l2', 'Zdist_sq', 'half_log_denom', 'psi2', 'variance_sq'],
-                     type_converters=weave.converters.blitz, **self.weave_options)
+        mudist, mudist_sq, psi2 = get_backend().rbf_psi2(param_to_array(mu), Zhat, Zdist_sq, param_to_array(denom_l2), param_to_array(half_log_denom), variance_sq)
 
         return Zdist, Zdist_sq, mudist, mudist_sq, psi2
 
-    def _weave_psi2_lengthscale_grads(self, dL_dpsi2, psi2, Zdist_sq, S, mudist_sq, l2):
-
-        #here's the einsum equivalent, it's ~3 times slower
+    def _psi2_lengthscale_grads(self, dL_dpsi2, psi2, Zdist_sq, S, mudist_sq, l2):
+        #here's the einsum equivalent of the backend computation
         #return 2.*np.einsum( 'ijk,ijk,ijkl,il->l', dL_dpsi2, psi2, Zdist_sq * (2.*S[:,None,None,:]/l2 + 1.) + mudist_sq + S[:, None, None, :] / l2, 1./(2.*S + l2))*self.lengthscale
-
-        result = np.zeros(self.input_dim)
-        code = """
-        double tmp;
-        for(int q=0; q<Q; q++)
-        {
-            tmp = 0.0;
-            #pragma omp parallel for reduction(+:tmp)
-            for(int n=0; n<N; n++)
-            {
-                for(int m=0; m<M; m++)
-                {
-                    //diag terms
-                    tmp += dL_dpsi2(n,m,m) * psi2(n,m,m) * (Zdist_sq(m,m,q) * (2.0*S(n,q)/l2(q) + 1.0) + mudist_sq(n,m,m,q) + S(n,q)/l2(q)) / (2.0*S(n,q) + l2(q)) ;
-
-                    //off-diag terms
-                    for(int mm=0; mm<m; mm++)
-                    {
-                        tmp += 2.0 * dL_dpsi2(n,m,mm) * psi2(n,m,mm) * (Zdist_sq(m,mm,q) * (2.0*S(n,q)/l2(q) + 1.0) + mudist_sq(n,m,mm,q) + S(n,q)/l2(q)) / (2.0*S(n,q) + l2(q)) ;
-                    }
-                }
-            }
-            result(q) = tmp;
-        }
-
-        """
-        support_code = """
-        #include <omp.h>
-        #include <math.h>
-        """
-        N,Q = S.shape
-        M = psi2.shape[-1]
-
-        S = param_to_array(S)
-        weave.inline(code, support_code=support_code, libraries=['gomp'],
-                     arg_names=['psi2', 'dL_dpsi2', 'N', 'M', 'Q', 'mudist_sq', 'l2', 'Zdist_sq', 'S', 'result'],
-                     type_converters=weave.converters.blitz, **self.weave_options)
-
+        l2 = param_to_array(l2) * np.ones(self.input_dim)
+        result = get_backend().rbf_psi2_lengthscale_grads(dL_dpsi2, psi2, Zdist_sq, param_to_array(S), mudist_sq, l2)
         return 2.*result*self.lengthscale
@@ -55,6 +55,9 @@ class White(Static):
     def psi2(self, Z, variational_posterior):
         return np.zeros((variational_posterior.shape[0], Z.shape[0], Z.shape[0]), dtype=np.float64)
 
+    def psi2_sum(self, Z, variational_posterior):
+        return np.zeros((Z.shape[0], Z.shape[0]))
+
     def update_gradients_full(self, dL_dK, X, X2=None):
         self.variance.gradient = np.trace(dL_dK)
 
@@ -86,6 +89,14 @@ class Bias(Static):
         ret[:] = self.variance**2
         return ret
 
+    def psi2_sum(self, Z, variational_posterior):
+        ret = np.empty((Z.shape[0], Z.shape[0]), dtype=np.float64)
+        ret[:] = variational_posterior.shape[0] * self.variance**2
+        return ret
+
     def update_gradients_expectations(self, dL_dpsi0, dL_dpsi1, dL_dpsi2, Z, variational_posterior):
-        self.variance.gradient = dL_dpsi0.sum() + dL_dpsi1.sum() + 2.*self.variance*dL_dpsi2.sum()
+        dL_dpsi2_sum = dL_dpsi2.sum()
+        if dL_dpsi2.ndim == 2:
+            dL_dpsi2_sum *= variational_posterior.shape[0]
+        self.variance.gradient = dL_dpsi0.sum() + dL_dpsi1.sum() + 2.*self.variance*dL_dpsi2_sum
 
@@ -72,7 +72,7 @@ class Stationary(Kern):
     @Cache_this(limit=5, ignore_args=())
     def K(self, X, X2=None):
         r = self._scaled_dist(X, X2)
-        return self.K_of_r(r)
+        return self._as_compute_dtype(self.K_of_r(r))
 
     @Cache_this(limit=3, ignore_args=())
     def dK_dr_via_X(self, X, X2):
@@ -93,7 +93,9 @@ class Stationary(Kern):
         else:
             X1sq = np.sum(np.square(X),1)
             X2sq = np.sum(np.square(X2),1)
-            return np.sqrt(-2.*np.dot(X, X2.T) + (X1sq[:,None] + X2sq[None,:]))
+            r2 = -2.*np.dot(X, X2.T) + (X1sq[:,None] + X2sq[None,:])
+            np.clip(r2, 0, np.inf, out=r2) # coinciding points can come out a little negative
+            return np.sqrt(r2)
 
     @Cache_this(limit=5, ignore_args=())
     def _scaled_dist(self, X, X2=None):
@@ -109,10 +111,11 @@ class Stationary(Kern):
         """
         if self.ARD:
             if X2 is not None:
-                X2 = X2 / self.lengthscale
-            return self._unscaled_dist(X/self.lengthscale, X2)
+                X2 = self._as_compute_dtype(X2 / self.lengthscale)
+            return self._unscaled_dist(self._as_compute_dtype(X/self.lengthscale), X2)
         else:
-            return self._unscaled_dist(X, X2)/self.lengthscale
+            r = self._unscaled_dist(self._as_compute_dtype(X), self._as_compute_dtype(X2))
+            return self._as_compute_dtype(r/self.lengthscale)
 
     def Kdiag(self, X):
         ret = np.empty(X.shape[0])
@@ -123,24 +126,92 @@ class Stationary(Kern):
         self.variance.gradient = np.sum(dL_dKdiag)
         self.lengthscale.gradient = 0.
 
+    def K_and_dK_dr(self, r):
+        """
+        The covariance function and its derivative wrt r, computed together.
+        Subclasses can override this to share intermediate results.
+        """
+        return self.K_of_r(r), self.dK_dr(r)
+
     def update_gradients_full(self, dL_dK, X, X2=None):
+        """
+        Fused gradient computation: a single pass over tiles of the scaled
+        distance matrix r computes K and dK_dr (see :py:meth:`K_and_dK_dr`)
+        and accumulates the variance and lengthscale gradients from them.
+        """
+        dL_dvar = 0.
+        dL_dl = np.zeros(self.lengthscale.size)
+        X2_ = X if X2 is None else X2
+        for rows, r, K, dL_drinv in self._grad_tiles(dL_dK, X, X2):
+            dL_dvar += np.einsum('ij,ij', K, dL_dK[rows])
+            if self.ARD:
+                #accumulate sum_ij dL_dr*invdist*(x_iq - x2_jq)^2
+                d = K # reuse the memory of K for the differences
+                for q in xrange(self.input_dim):
+                    np.subtract(X[rows, q][:, None], X2_[:, q][None, :], out=d)
+                    np.square(d, out=d)
+                    dL_dl[q] += np.einsum('ij,ij', dL_drinv, d)
+            else:
+                #sum_ij dL_dr*r = sum_ij dL_dr*invdist*r^2
+                dL_dl += np.einsum('ij,ij,ij', dL_drinv, r, r)
+        self.variance.gradient = dL_dvar/self.variance
+        if self.ARD:
+            self.lengthscale.gradient = -dL_dl/self.lengthscale**3
+        else:
+            self.lengthscale.gradient = -dL_dl/self.lengthscale
 
-        self.variance.gradient = np.einsum('ij,ij,i', self.K(X, X2), dL_dK, 1./self.variance)
+    #number of bytes of scratch memory for each tile of the gradient computations
+    _tile_bytes = 1 << 26
 
-        #now the lengthscale gradient(s)
-        dL_dr = self.dK_dr_via_X(X, X2) * dL_dK
+    def _dist_tiles(self, X, X2=None):
+        """
+        Generator over row blocks (tiles) of the scaled distance matrix r, which
+        hold at most _tile_bytes bytes. Each tile is computed from its rows of
+        X and all of X2, such that the full distance matrix is never formed.
+
+        :returns: (rows, tile) for each tile, where rows is the slice into X
+        """
         if self.ARD:
-            #rinv = self._inv_dis# this is rather high memory? Should we loop instead?t(X, X2)
-            #d =  X[:, None, :] - X2[None, :, :]
-            #x_xl3 = np.square(d) 
-            #self.lengthscale.gradient = -((dL_dr*rinv)[:,:,None]*x_xl3).sum(0).sum(0)/self.lengthscale**3
-            tmp = dL_dr*self._inv_dist(X, X2)
-            if X2 is None: X2 = X
-            self.lengthscale.gradient = np.array([np.einsum('ij,ij,...', tmp, np.square(X[:,q:q+1] - X2[:,q:q+1].T), -1./self.lengthscale[q]**3) for q in xrange(self.input_dim)])
+            X = self._as_compute_dtype(X/self.lengthscale)
+            X2 = X if X2 is None else self._as_compute_dtype(X2/self.lengthscale)
         else:
-            r = self._scaled_dist(X, X2)
-            self.lengthscale.gradient = -np.sum(dL_dr*r)/self.lengthscale
+            # plain arrays: the tiles are updated inplace, which must not notify observers of X
+            X = self._as_compute_dtype(np.asarray(X))
+            X2 = X if X2 is None else self._as_compute_dtype(np.asarray(X2))
+        symmetric = X2 is X
+        X1sq = np.sum(np.square(X),1)
+        X2sq = X1sq if symmetric else np.sum(np.square(X2),1)
+        block = max(1, self._tile_bytes // (X.itemsize * X2.shape[0]))
+        for start in xrange(0, X.shape[0], block):
+            rows = slice(start, min(start + block, X.shape[0]))
+            r = np.dot(X[rows], X2.T)
+            r *= -2.
+            r += X1sq[rows, None]
+            r += X2sq[None, :]
+            np.clip(r, 0, np.inf, out=r) # coinciding points can come out a little negative
+            if symmetric:
+                i = np.arange(r.shape[0])
+                r[i, start + i] = 0. # force the diagonal to be zero
+            np.sqrt(r, out=r)
+            if not self.ARD:
+                r /= self.lengthscale
+            yield rows, r
+
+    def _grad_tiles(self, dL_dK, X, X2=None):
+        """
+        Generator over row blocks (tiles) of the scaled distance matrix r, the
+        covariance K and dL_dr * invdist, the product which appears in the
+        gradients wrt the lengthscales and X, where invdist is the elementwise
+        inverse of the distance matrix (zero where the distance is zero).
+        K and dK_dr are computed together (see :py:meth:`K_and_dK_dr`).
 
+        :returns: (rows, r, K, dL_dr*invdist) for each tile, where rows is the slice into X
+        """
+        for rows, r in self._dist_tiles(X, X2):
+            K, tmp = self.K_and_dK_dr(r)
+            tmp *= dL_dK[rows]
+            tmp /= np.where(r != 0., r, np.inf)
+            yield rows, r, K, tmp
 
     def _inv_dist(self, X, X2=None):
         """
@@ -160,21 +231,22 @@ class Stationary(Kern):
         """
         Given the derivative of the objective wrt K (dL_dK), compute the derivative wrt X
         """
-        invdist = self._inv_dist(X, X2)
-        dL_dr = self.dK_dr_via_X(X, X2) * dL_dK
         #The high-memory numpy way:
         #d =  X[:, None, :] - X2[None, :, :]
         #ret = np.sum((invdist*dL_dr)[:,:,None]*d,1)/self.lengthscale**2
         #if X2 is None:
             #ret *= 2.
 
-        #the lower memory way with a loop
-        tmp = invdist*dL_dr
-        if X2 is None:
-            tmp *= 2.
-            X2 = X
+        #the lower memory way with a loop over tiles of rows and dimensions
         ret = np.empty(X.shape, dtype=np.float64)
-        [np.einsum('ij,ij->i', tmp, X[:,q][:,None]-X2[:,q][None,:], out=ret[:,q]) for q in xrange(self.input_dim)]
+        X2_ = X if X2 is None else X2
+        for rows, _, d, tmp in self._grad_tiles(dL_dK, X, X2):
+            # the tile of K is not needed here, reuse its memory for the differences
+            for q in xrange(self.input_dim):
+                np.subtract(X[rows, q][:, None], X2_[:, q][None, :], out=d)
+                np.einsum('ij,ij->i', tmp, d, out=ret[rows, q])
+        if X2 is None:
+            ret *= 2.
         ret /= self.lengthscale**2
 
         return ret
@@ -195,6 +267,10 @@ class Exponential(Stationary):
     def dK_dr(self, r):
         return -0.5*self.K_of_r(r)
 
+    def K_and_dK_dr(self, r):
+        K = self.K_of_r(r)
+        return K, -0.5*K
+
 class Matern32(Stationary):
     """
     Matern 3/2 kernel:
@@ -214,6 +290,10 @@ class Matern32(Stationary):
     def dK_dr(self,r):
         return -3.*self.variance*r*np.exp(-np.sqrt(3.)*r)
 
+    def K_and_dK_dr(self, r):
+        e = self.variance * np.exp(-np.sqrt(3.) * r)
+        return (1. + np.sqrt(3.) * r) * e, -3.*r*e
+
     def Gram_matrix(self, F, F1, F2, lower, upper):
         """
         Return the Gram matrix of the vector of functions F with respect to the
@@ -258,6 +338,10 @@ class Matern52(Stationary):
     def dK_dr(self, r):
         return self.variance*(10./3*r -5.*r -5.*np.sqrt(5.)/3*r**2)*np.exp(-np.sqrt(5.)*r)
 
+    def K_and_dK_dr(self, r):
+        e = self.variance*np.exp(-np.sqrt(5.)*r)
+        return (1+np.sqrt(5.)*r+5./3*r**2)*e, (10./3*r -5.*r -5.*np.sqrt(5.)/3*r**2)*e
+
     def Gram_matrix(self, F, F1, F2, F3, lower, upper):
         """
         Return the Gram matrix of the vector of functions F with respect to the RKHS norm. The use of this function is limited to input_dim=1.
@@ -300,6 +384,10 @@ class ExpQuad(Stationary):
     def dK_dr(self, r):
         return -r*self.K_of_r(r)
 
+    def K_and_dK_dr(self, r):
+        K = self.K_of_r(r)
+        return K, -r*K
+
 class Cosine(Stationary):
     def __init__(self, input_dim, variance=1., lengthscale=None, ARD=False, name='Cosine'):
         super(Cosine, self).__init__(input_dim, variance, lengthscale, ARD, name)
@@ -335,12 +423,18 @@ class RatQuad(Stationary):
         r2 = np.power(r, 2.)
         return -self.variance*self.power*r*np.power(1. + r2/2., - self.power - 1.)
 
+    def K_and_dK_dr(self, r):
+        base = 1. + np.square(r)/2.
+        tmp = self.variance*np.power(base, -self.power - 1.)
+        return tmp*base, -self.power*r*tmp
+
     def update_gradients_full(self, dL_dK, X, X2=None):
         super(RatQuad, self).update_gradients_full(dL_dK, X, X2)
-        r = self._scaled_dist(X, X2)
-        r2 = np.power(r, 2.)
-        dK_dpow = -self.variance * np.power(2., self.power) * np.power(r2 + 2., -self.power) * np.log(0.5*(r2+2.))
-        grad = np.sum(dL_dK*dK_dpow)
+        grad = 0.
+        for rows, r in self._dist_tiles(X, X2):
+            r2 = np.power(r, 2.)
+            dK_dpow = -self.variance * np.power(2., self.power) * np.power(r2 + 2., -self.power) * np.log(0.5*(r2+2.))
+            grad += np.sum(dL_dK[rows]*dK_dpow)
         self.power.gradient = grad
 
     def update_gradients_diag(self, dL_dKdiag, X):
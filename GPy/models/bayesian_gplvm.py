@@ -2,12 +2,14 @@
 # Licensed under the BSD 3-clause license (see LICENSE.txt)
 
 import numpy as np
+import multiprocessing as mp
 from gplvm import GPLVM
 from .. import kern
 from ..core import SparseGP
 from ..likelihoods import Gaussian
 from ..inference.optimization import SCG
-from ..util import linalg
+from ..util import linalg, caching
+from ..util.misc import param_to_array
 from ..core.parameterization.variational import NormalPosterior, NormalPrior
 
 class BayesianGPLVM(SparseGP):
@@ -66,7 +68,10 @@ class BayesianGPLVM(SparseGP):
         super(BayesianGPLVM, self).parameters_changed()
         self._log_marginal_likelihood -= self.variational_prior.KL_divergence(self.X)
 
-        self.X.mean.gradient, self.X.variance.gradient = self.kern.gradients_qX_expectations(variational_posterior=self.X, Z=self.Z, **self.grad_dict)
+        if 'dL_dmean' in self.grad_dict:
+            self.X.mean.gradient, self.X.variance.gradient = self.grad_dict['dL_dmean'], self.grad_dict['dL_dvariance']
+        else:
+            self.X.mean.gradient, self.X.variance.gradient = self.kern.gradients_qX_expectations(variational_posterior=self.X, Z=self.Z, **self.grad_dict)
 
         # update for the KL divergence
         self.variational_prior.update_gradients_KL(self.X)
@@ -82,43 +87,35 @@ class BayesianGPLVM(SparseGP):
 
         return dim_reduction_plots.plot_latent(self, plot_inducing=plot_inducing, *args, **kwargs)
 
-    def do_test_latents(self, Y):
+    def do_test_latents(self, Y, init='nn', batchsize=None, n_jobs=1, **kwargs):
         """
-        Compute the latent representation for a set of new points Y
+        Compute the latent representation q(X*) = N(means, covars) for a set of new points Y.
 
-        Notes:
-        This will only work with a univariate Gaussian likelihood (for now)
-        """
-        assert not self.likelihood.is_heteroscedastic
-        N_test = Y.shape[0]
-        input_dim = self.Z.shape[1]
-        means = np.zeros((N_test, input_dim))
-        covars = np.zeros((N_test, input_dim))
-
-        dpsi0 = -0.5 * self.input_dim * self.likelihood.precision
-        dpsi2 = self.dL_dpsi2[0][None, :, :] # TODO: this may change if we ignore het. likelihoods
-        V = self.likelihood.precision * Y
-
-        #compute CPsi1V
-        if self.Cpsi1V is None:
-            psi1V = np.dot(self.psi1.T, self.likelihood.V)
-            tmp, _ = linalg.dtrtrs(self._Lm, np.asfortranarray(psi1V), lower=1, trans=0)
-            tmp, _ = linalg.dpotrs(self.LB, tmp, lower=1)
-            self.Cpsi1V, _ = linalg.dtrtrs(self._Lm, tmp, lower=1, trans=1)
+        The posterior of the inducing outputs is held fixed, so the test
+        points are independent of each other: their means and variances are
+        optimized jointly (with SCG) on the sum of their lower bounds, which
+        has a block diagonal Hessian, in batches of batchsize points.
 
-        dpsi1 = np.dot(self.Cpsi1V, V.T)
+        :param Y: the new observations (N* x output_dim)
+        :param init: 'nn': start each point at the latent mean and variance of its nearest neighbour in the training data,
+                     'prior': start all points at the prior N(0, 1)
+        :param int batchsize: number of test points per optimization (default: all)
+        :param int n_jobs: number of processes to optimize the batches in parallel (-1: one per cpu)
 
-        start = np.zeros(self.input_dim * 2)
+        kwargs are passed to the optimizer (SCG), e.g. maxiters.
 
-        for n, dpsi1_n in enumerate(dpsi1.T[:, :, None]):
-            args = (self.kern, self.Z, dpsi0, dpsi1_n.T, dpsi2)
-            xopt, fopt, neval, status = SCG(f=latent_cost, gradf=latent_grad, x=start, optargs=args, display=False)
-
-            mu, log_S = xopt.reshape(2, 1, -1)
-            means[n] = mu[0].copy()
-            covars[n] = np.exp(log_S[0]).copy()
-
-        return means, covars
+        Notes:
+        This will only work with a univariate Gaussian likelihood (for now)
+        """
+        dL_dpsi0, dL_dpsi1, dL_dpsi2 = latent_psi_gradients(self, Y)
+        if init == 'nn':
+            nn = nearest_neighbours(self.Y, Y)
+            start = np.array([param_to_array(self.X.mean)[nn], np.log(param_to_array(self.X.variance)[nn])])
+        else:
+            start = np.zeros((2, Y.shape[0], self.input_dim))
+        mu, log_S = optimize_latents(latent_cost, latent_grad, start, self.kern, param_to_array(self.Z),
+                                     dL_dpsi0, dL_dpsi1, dL_dpsi2, batchsize=batchsize, n_jobs=n_jobs, **kwargs)
+        return mu, np.exp(log_S)
 
     def dmu_dX(self, Xnew):
         """
@@ -150,57 +147,138 @@ class BayesianGPLVM(SparseGP):
         return dim_reduction_plots.plot_steepest_gradient_map(self,*args,**kwargs)
 
 
+def latent_psi_gradients(model, Y):
+    """
+    The gradients of the lower bound of a sparse GP model wrt the psi
+    statistics of new observations Y, with the posterior of the inducing
+    outputs held fixed: dL_dpsi0 (a scalar), dL_dpsi1 (N* x M) and dL_dpsi2
+    (M x M, the same for each of the N* points, see Kern.psi2_sum).
+    Only needs the posterior, so it holds for any of the VarDTC inference methods.
+    """
+    assert isinstance(model.likelihood, Gaussian) and model.likelihood.variance.size == 1, "only for a univariate Gaussian likelihood"
+    beta = 1. / float(model.likelihood.variance)
+    woodbury_vector = param_to_array(model.posterior.woodbury_vector)
+    woodbury_inv = param_to_array(model.posterior.woodbury_inv)
+    output_dim = Y.shape[1]
+    if woodbury_inv.ndim == 3:
+        # one per output dimension (missing data)
+        woodbury_inv = woodbury_inv.sum(-1)
+    else:
+        woodbury_inv = output_dim * woodbury_inv
+    dL_dpsi0 = -0.5 * output_dim * beta
+    dL_dpsi1 = beta * np.dot(Y, woodbury_vector.T)
+    dL_dpsi2 = 0.5 * beta * (woodbury_inv - linalg.tdot(woodbury_vector))
+    return dL_dpsi0, dL_dpsi1, dL_dpsi2
+
+def nearest_neighbours(Ytrain, Y, batchsize=1000):
+    """
+    The indices of the nearest neighbours (in Euclidean distance) in Ytrain
+    of the rows of Y, computed for batchsize rows at a time. Missing values
+    (NaNs) in Ytrain count as zeros.
+    """
+    Ytrain = np.nan_to_num(param_to_array(Ytrain))
+    Ytrain_sq = np.square(Ytrain).sum(1)
+    nn = np.empty(Y.shape[0], dtype=int)
+    for start in xrange(0, Y.shape[0], batchsize):
+        # the squared norms of Y do not change the nearest neighbours
+        nn[start:start + batchsize] = (Ytrain_sq[None, :] - 2. * np.dot(Y[start:start + batchsize], Ytrain.T)).argmin(1)
+    return nn
+
+# the latent optimization problem of optimize_latents, inherited by the forked workers
+_latent_problem = None
+
+def optimize_latents(f, gradf, start, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2, extra_args=(), batchsize=None, n_jobs=1, **kwargs):
+    """
+    Minimize f (with gradient gradf) over the (K x N* x Q) variational
+    parameters of N* test points, starting at start. The test points are
+    split into batches of batchsize points, each optimized jointly with SCG.
+
+    With n_jobs other than 1, the batches are optimized in a pool of n_jobs
+    processes (-1: one per cpu). The workers inherit the problem when they are
+    forked, so the kernel does not need to be pickled.
+
+    f and gradf are called as f(x, kern, Z, dL_dpsi0, dL_dpsi1[batch], dL_dpsi2, *extra_args).
+    """
+    global _latent_problem
+    N = start.shape[1]
+    if batchsize is None:
+        batchsize = N
+    if n_jobs == -1:
+        n_jobs = mp.cpu_count()
+    batches = [slice(i, min(i + batchsize, N)) for i in xrange(0, N, batchsize)]
+    kwargs.setdefault('display', False)
+    _latent_problem = (f, gradf, start, (kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2) + tuple(extra_args), kwargs)
+    try:
+        if n_jobs == 1 or len(batches) < 2:
+            results = map(_optimize_latents_batch, batches)
+        else:
+            pool = mp.Pool(min(n_jobs, len(batches)), initializer=caching.registry.after_fork)
+            try:
+                results = pool.map(_optimize_latents_batch, batches)
+            finally:
+                pool.terminate()
+    finally:
+        _latent_problem = None
+    return np.concatenate(results, 1)
+
+def _optimize_latents_batch(batch):
+    f, gradf, start, args, kwargs = _latent_problem
+    args = args[:3] + (args[3][batch],) + args[4:]
+    xopt, fopt, neval, status = SCG(f=f, gradf=gradf, x=start[:, batch].flatten(), optargs=args, **kwargs)
+    return xopt.reshape(start.shape[0], -1, start.shape[2])
+
 def latent_cost_and_grad(mu_S, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2):
     """
-    objective function for fitting the latent variables for test points
-    (negative log-likelihood: should be minimised!)
+    objective function for fitting the latent variables of N test points jointly
+    (negative lower bound: should be minimised!)
+
+    mu_S holds the means and log variances of the N test points, dL_dpsi1 is
+    N x M and dL_dpsi2 the M x M gradient shared by all test points (see
+    latent_psi_gradients). The objective is a sum over the test points.
     """
-    mu, log_S = mu_S.reshape(2, 1, -1)
+    mu, log_S = mu_S.reshape(2, dL_dpsi1.shape[0], -1)
     S = np.exp(log_S)
+    X = NormalPosterior(mu, S)
 
-    psi0 = kern.psi0(Z, mu, S)
-    psi1 = kern.psi1(Z, mu, S)
-    psi2 = kern.psi2(Z, mu, S)
+    psi0 = kern.psi0(Z, X)
+    psi1 = kern.psi1(Z, X)
+    psi2 = kern.psi2_sum(Z, X)
 
-    lik = dL_dpsi0 * psi0 + np.dot(dL_dpsi1.flatten(), psi1.flatten()) + np.dot(dL_dpsi2.flatten(), psi2.flatten()) - 0.5 * np.sum(np.square(mu) + S) + 0.5 * np.sum(log_S)
+    lik = dL_dpsi0 * psi0.sum() + np.sum(dL_dpsi1 * psi1) + np.sum(dL_dpsi2 * psi2) - 0.5 * np.sum(np.square(mu) + S) + 0.5 * np.sum(log_S)
 
-    mu0, S0 = kern.dpsi0_dmuS(dL_dpsi0, Z, mu, S)
-    mu1, S1 = kern.dpsi1_dmuS(dL_dpsi1, Z, mu, S)
-    mu2, S2 = kern.dpsi2_dmuS(dL_dpsi2, Z, mu, S)
+    dmu, dS = kern.gradients_qX_expectations(dL_dpsi0 * np.ones(mu.shape[0]), dL_dpsi1, dL_dpsi2, Z, X)
 
-    dmu = mu0 + mu1 + mu2 - mu
-    # dS = S0 + S1 + S2 -0.5 + .5/S
-    dlnS = S * (S0 + S1 + S2 - 0.5) + .5
-    return -lik, -np.hstack((dmu.flatten(), dlnS.flatten()))
+    dmu = dmu - mu
+    dlnS = S * (dS - 0.5) + .5
+    return -float(lik), -np.hstack((dmu.flatten(), dlnS.flatten()))
 
 def latent_cost(mu_S, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2):
     """
     objective function for fitting the latent variables (negative log-likelihood: should be minimised!)
     This is the same as latent_cost_and_grad but only for the objective
     """
-    mu, log_S = mu_S.reshape(2, 1, -1)
+    mu, log_S = mu_S.reshape(2, dL_dpsi1.shape[0], -1)
     S = np.exp(log_S)
+    X = NormalPosterior(mu, S)
 
-    psi0 = kern.psi0(Z, mu, S)
-    psi1 = kern.psi1(Z, mu, S)
-    psi2 = kern.psi2(Z, mu, S)
+    psi0 = kern.psi0(Z, X)
+    psi1 = kern.psi1(Z, X)
+    psi2 = kern.psi2_sum(Z, X)
 
-    lik = dL_dpsi0 * psi0 + np.dot(dL_dpsi1.flatten(), psi1.flatten()) + np.dot(dL_dpsi2.flatten(), psi2.flatten()) - 0.5 * np.sum(np.square(mu) + S) + 0.5 * np.sum(log_S)
+    lik = dL_dpsi0 * psi0.sum() + np.sum(dL_dpsi1 * psi1) + np.sum(dL_dpsi2 * psi2) - 0.5 * np.sum(np.square(mu) + S) + 0.5 * np.sum(log_S)
     return -float(lik)
 
 def latent_grad(mu_S, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2):
     """
     This is the same as latent_cost_and_grad but only for the grad
     """
-    mu, log_S = mu_S.reshape(2, 1, -1)
+    mu, log_S = mu_S.reshape(2, dL_dpsi1.shape[0], -1)
     S = np.exp(log_S)
+    X = NormalPosterior(mu, S)
 
-    mu0, S0 = kern.dpsi0_dmuS(dL_dpsi0, Z, mu, S)
-    mu1, S1 = kern.dpsi1_dmuS(dL_dpsi1, Z, mu, S)
-    mu2, S2 = kern.dpsi2_dmuS(dL_dpsi2, Z, mu, S)
+    dmu, dS = kern.gradients_qX_expectations(dL_dpsi0 * np.ones(mu.shape[0]), dL_dpsi1, dL_dpsi2, Z, X)
 
-    dmu = mu0 + mu1 + mu2 - mu
-    # dS = S0 + S1 + S2 -0.5 + .5/S
-    dlnS = S * (S0 + S1 + S2 - 0.5) + .5
+    dmu = dmu - mu
+    dlnS = S * (dS - 0.5) + .5
 
     return -np.hstack((dmu.flatten(), dlnS.flatten()))
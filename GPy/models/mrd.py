@@ -12,6 +12,7 @@ from ..core.parameterization.variational import NormalPosterior, NormalPrior
 from ..core.parameterization import Param, Parameterized
 from ..inference.latent_function_inference.var_dtc import VarDTCMissingData, VarDTC
 from ..likelihoods import Gaussian
+from ..util.parallel import PersistentThreadPool
 
 class MRD(Model):
     """
@@ -44,13 +45,23 @@ class MRD(Model):
     :param :class:`~GPy.likelihoods.likelihood.Likelihood` likelihood: the likelihood to use
     :param str name: the name of this model
     :param [str] Ynames: the names for the datasets given, must be of equal length as Ylist or None
+    :param int n_jobs: number of threads to run the inference of the datasets on (-1: one per cpu)
+
+    The datasets only share the latent space X and the inducing inputs Z, so
+    their inference and gradients are independent. With n_jobs other than 1,
+    the datasets are run in a pool of n_jobs threads; most of the work is done
+    by NumPy and LAPACK/BLAS, which release the GIL. The gradients wrt Z and X
+    are summed up in the order of the datasets, so the results do not depend
+    on n_jobs. The threads are kept for the following evaluations.
     """
     
     def __init__(self, Ylist, input_dim, X=None, X_variance=None, 
                  initx = 'PCA', initz = 'permute',
                  num_inducing=10, Z=None, kernel=None, 
-                 inference_method=None, likelihood=None, name='mrd', Ynames=None):
+                 inference_method=None, likelihood=None, name='mrd', Ynames=None, n_jobs=1):
         super(MRD, self).__init__(name)
+        self.n_jobs = n_jobs
+        self._pool = PersistentThreadPool()
         
         # sort out the kernels
         if kernel is None:
@@ -106,34 +117,19 @@ class MRD(Model):
         self._in_init_ = False
             
     def parameters_changed(self):
+        views = zip(self.Ylist, self.kern, self.likelihood, self.inference_method)
+        results = self._pool.map(self._view_inference, views, self.n_jobs)
+
         self._log_marginal_likelihood = 0
         self.posteriors = []
         self.Z.gradient = 0.
         self.X.mean.gradient = 0.
         self.X.variance.gradient = 0.
-        
-        for y, k, l, i in itertools.izip(self.Ylist, self.kern, self.likelihood, self.inference_method):
-            posterior, lml, grad_dict = i.inference(k, self.X, self.Z, l, y)
-            
+
+        for posterior, lml, dL_dZ, dL_dmean, dL_dS in results:
             self.posteriors.append(posterior)
             self._log_marginal_likelihood += lml
-            
-            # likelihood gradients
-            l.update_gradients(grad_dict.pop('partial_for_likelihood'))
-            
-            #gradients wrt kernel
-            dL_dKmm = grad_dict.pop('dL_dKmm')
-            k.update_gradients_full(dL_dKmm, self.Z, None)
-            target = k.gradient.copy()
-            k.update_gradients_expectations(variational_posterior=self.X, Z=self.Z, **grad_dict)
-            k.gradient += target
-
-            #gradients wrt Z
-            self.Z.gradient += k.gradients_X(dL_dKmm, self.Z)
-            self.Z.gradient += k.gradients_Z_expectations(
-                               grad_dict['dL_dpsi1'], grad_dict['dL_dpsi2'], Z=self.Z, variational_posterior=self.X)
-            
-            dL_dmean, dL_dS = k.gradients_qX_expectations(variational_posterior=self.X, Z=self.Z, **grad_dict)
+            self.Z.gradient += dL_dZ
             self.X.mean.gradient += dL_dmean
             self.X.variance.gradient += dL_dS
 
@@ -141,6 +137,33 @@ class MRD(Model):
         self.variational_prior.update_gradients_KL(self.X)
         self._log_marginal_likelihood -= self.variational_prior.KL_divergence(self.X)
 
+    def _view_inference(self, view):
+        """
+        Inference for one dataset. Updates the gradients of its kernel and
+        likelihood and returns its posterior, log marginal likelihood and
+        gradients wrt Z, the latent means and the latent variances.
+        """
+        y, k, l, i = view
+        posterior, lml, grad_dict = i.inference(k, self.X, self.Z, l, y)
+
+        # likelihood gradients
+        l.update_gradients(grad_dict.pop('partial_for_likelihood'))
+
+        #gradients wrt kernel
+        dL_dKmm = grad_dict.pop('dL_dKmm')
+        k.update_gradients_full(dL_dKmm, self.Z, None)
+        target = k.gradient.copy()
+        k.update_gradients_expectations(variational_posterior=self.X, Z=self.Z, **grad_dict)
+        k.gradient += target
+
+        #gradients wrt Z
+        dL_dZ = k.gradients_X(dL_dKmm, self.Z)
+        dL_dZ += k.gradients_Z_expectations(
+                 grad_dict['dL_dpsi1'], grad_dict['dL_dpsi2'], Z=self.Z, variational_posterior=self.X)
+
+        dL_dmean, dL_dS = k.gradients_qX_expectations(variational_posterior=self.X, Z=self.Z, **grad_dict)
+        return posterior, lml, dL_dZ, dL_dmean, dL_dS
+
     def log_likelihood(self):
         return self._log_marginal_likelihood
 
@@ -8,9 +8,9 @@ from matplotlib import pyplot
 from ..core.sparse_gp import SparseGP
 from .. import kern
 from ..likelihoods import Gaussian
-from ..inference.optimization import SCG
-from ..util import linalg
+from ..util.misc import param_to_array
 from ..core.parameterization.variational import SpikeAndSlabPrior, SpikeAndSlabPosterior
+from bayesian_gplvm import latent_psi_gradients, nearest_neighbours, optimize_latents
 
 class SSGPLVM(SparseGP):
     """
@@ -79,43 +79,38 @@ class SSGPLVM(SparseGP):
 
         return dim_reduction_plots.plot_latent(self, plot_inducing=plot_inducing, *args, **kwargs)
 
-    def do_test_latents(self, Y):
+    def do_test_latents(self, Y, init='nn', batchsize=None, n_jobs=1, **kwargs):
         """
-        Compute the latent representation for a set of new points Y
+        Compute the latent representation q(X*) for a set of new points Y,
+        returned as its means, variances and binary probabilities.
 
-        Notes:
-        This will only work with a univariate Gaussian likelihood (for now)
-        """
-        assert not self.likelihood.is_heteroscedastic
-        N_test = Y.shape[0]
-        input_dim = self.Z.shape[1]
-        means = np.zeros((N_test, input_dim))
-        covars = np.zeros((N_test, input_dim))
-
-        dpsi0 = -0.5 * self.output_dim * self.likelihood.precision
-        dpsi2 = self.dL_dpsi2[0][None, :, :] # TODO: this may change if we ignore het. likelihoods
-        V = self.likelihood.precision * Y
+        As in BayesianGPLVM.do_test_latents, the test points are optimized
+        jointly on the sum of their lower bounds, in batches of batchsize points.
 
-        #compute CPsi1V
-        if self.Cpsi1V is None:
-            psi1V = np.dot(self.psi1.T, self.likelihood.V)
-            tmp, _ = linalg.dtrtrs(self._Lm, np.asfortranarray(psi1V), lower=1, trans=0)
-            tmp, _ = linalg.dpotrs(self.LB, tmp, lower=1)
-            self.Cpsi1V, _ = linalg.dtrtrs(self._Lm, tmp, lower=1, trans=1)
+        :param Y: the new observations (N* x output_dim)
+        :param init: 'nn': start each point at the latent posterior of its nearest neighbour in the training data,
+                     'prior': start all points at the prior
+        :param int batchsize: number of test points per optimization (default: all)
+        :param int n_jobs: number of processes to optimize the batches in parallel (-1: one per cpu)
 
-        dpsi1 = np.dot(self.Cpsi1V, V.T)
+        kwargs are passed to the optimizer (SCG), e.g. maxiters.
 
-        start = np.zeros(self.input_dim * 2)
-
-        for n, dpsi1_n in enumerate(dpsi1.T[:, :, None]):
-            args = (self.kern, self.Z, dpsi0, dpsi1_n.T, dpsi2)
-            xopt, fopt, neval, status = SCG(f=latent_cost, gradf=latent_grad, x=start, optargs=args, display=False)
-
-            mu, log_S = xopt.reshape(2, 1, -1)
-            means[n] = mu[0].copy()
-            covars[n] = np.exp(log_S[0]).copy()
-
-        return means, covars
+        Notes:
+        This will only work with a univariate Gaussian likelihood (for now)
+        """
+        dL_dpsi0, dL_dpsi1, dL_dpsi2 = latent_psi_gradients(self, Y)
+        pi = param_to_array(self.variational_prior.pi)
+        if init == 'nn':
+            nn = nearest_neighbours(self.Y, Y)
+            gamma = param_to_array(self.X.binary_prob)[nn]
+            start = np.array([param_to_array(self.X.mean)[nn], np.log(param_to_array(self.X.variance)[nn]), np.log(gamma / (1. - gamma))])
+        else:
+            start = np.zeros((3, Y.shape[0], self.input_dim))
+            start[2] = np.log(pi / (1. - pi))
+        mu, log_S, logit_gamma = optimize_latents(latent_cost, latent_grad, start, self.kern, param_to_array(self.Z),
+                                                  dL_dpsi0, dL_dpsi1, dL_dpsi2, extra_args=(pi,),
+                                                  batchsize=batchsize, n_jobs=n_jobs, **kwargs)
+        return mu, np.exp(log_S), 1. / (1. + np.exp(-logit_gamma))
 
     def dmu_dX(self, Xnew):
         """
@@ -255,59 +250,67 @@ class SSGPLVM(SparseGP):
         SparseGP._setstate(self, state)
 
 
-def latent_cost_and_grad(mu_S, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2):
+def latent_cost_and_grad(mu_S_gamma, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2, pi):
     """
-    objective function for fitting the latent variables for test points
-    (negative log-likelihood: should be minimised!)
+    objective function for fitting the latent variables of N test points jointly
+    (negative lower bound: should be minimised!)
+
+    mu_S_gamma holds the means, log variances and logit binary probabilities
+    of the N test points, pi the prior probabilities of the slab.
+    See bayesian_gplvm.latent_cost_and_grad for the other arguments.
     """
-    mu, log_S = mu_S.reshape(2, 1, -1)
+    mu, log_S, logit_gamma = mu_S_gamma.reshape(3, dL_dpsi1.shape[0], -1)
     S = np.exp(log_S)
+    gamma = 1. / (1. + np.exp(-logit_gamma))
+    X = SpikeAndSlabPosterior(mu, S, gamma)
 
-    psi0 = kern.psi0(Z, mu, S)
-    psi1 = kern.psi1(Z, mu, S)
-    psi2 = kern.psi2(Z, mu, S)
+    psi0 = kern.psi0(Z, X)
+    psi1 = kern.psi1(Z, X)
+    psi2 = kern.psi2_sum(Z, X)
 
-    lik = dL_dpsi0 * psi0 + np.dot(dL_dpsi1.flatten(), psi1.flatten()) + np.dot(dL_dpsi2.flatten(), psi2.flatten()) - 0.5 * np.sum(np.square(mu) + S) + 0.5 * np.sum(log_S)
+    lik = dL_dpsi0 * psi0.sum() + np.sum(dL_dpsi1 * psi1) + np.sum(dL_dpsi2 * psi2) - _latent_KL(mu, S, log_S, gamma, pi)
 
-    mu0, S0 = kern.dpsi0_dmuS(dL_dpsi0, Z, mu, S)
-    mu1, S1 = kern.dpsi1_dmuS(dL_dpsi1, Z, mu, S)
-    mu2, S2 = kern.dpsi2_dmuS(dL_dpsi2, Z, mu, S)
+    return -float(lik), latent_grad(mu_S_gamma, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2, pi)
 
-    dmu = mu0 + mu1 + mu2 - mu
-    # dS = S0 + S1 + S2 -0.5 + .5/S
-    dlnS = S * (S0 + S1 + S2 - 0.5) + .5
-    return -lik, -np.hstack((dmu.flatten(), dlnS.flatten()))
-
-def latent_cost(mu_S, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2):
+def latent_cost(mu_S_gamma, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2, pi):
     """
     objective function for fitting the latent variables (negative log-likelihood: should be minimised!)
     This is the same as latent_cost_and_grad but only for the objective
     """
-    mu, log_S = mu_S.reshape(2, 1, -1)
+    mu, log_S, logit_gamma = mu_S_gamma.reshape(3, dL_dpsi1.shape[0], -1)
     S = np.exp(log_S)
+    gamma = 1. / (1. + np.exp(-logit_gamma))
+    X = SpikeAndSlabPosterior(mu, S, gamma)
 
-    psi0 = kern.psi0(Z, mu, S)
-    psi1 = kern.psi1(Z, mu, S)
-    psi2 = kern.psi2(Z, mu, S)
+    psi0 = kern.psi0(Z, X)
+    psi1 = kern.psi1(Z, X)
+    psi2 = kern.psi2_sum(Z, X)
 
-    lik = dL_dpsi0 * psi0 + np.dot(dL_dpsi1.flatten(), psi1.flatten()) + np.dot(dL_dpsi2.flatten(), psi2.flatten()) - 0.5 * np.sum(np.square(mu) + S) + 0.5 * np.sum(log_S)
+    lik = dL_dpsi0 * psi0.sum() + np.sum(dL_dpsi1 * psi1) + np.sum(dL_dpsi2 * psi2) - _latent_KL(mu, S, log_S, gamma, pi)
     return -float(lik)
 
-def latent_grad(mu_S, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2):
+def latent_grad(mu_S_gamma, kern, Z, dL_dpsi0, dL_dpsi1, dL_dpsi2, pi):
     """
     This is the same as latent_cost_and_grad but only for the grad
     """
-    mu, log_S = mu_S.reshape(2, 1, -1)
+    mu, log_S, logit_gamma = mu_S_gamma.reshape(3, dL_dpsi1.shape[0], -1)
     S = np.exp(log_S)
+    gamma = 1. / (1. + np.exp(-logit_gamma))
+    X = SpikeAndSlabPosterior(mu, S, gamma)
 
-    mu0, S0 = kern.dpsi0_dmuS(dL_dpsi0, Z, mu, S)
-    mu1, S1 = kern.dpsi1_dmuS(dL_dpsi1, Z, mu, S)
-    mu2, S2 = kern.dpsi2_dmuS(dL_dpsi2, Z, mu, S)
-
-    dmu = mu0 + mu1 + mu2 - mu
-    # dS = S0 + S1 + S2 -0.5 + .5/S
-    dlnS = S * (S0 + S1 + S2 - 0.5) + .5
+    dmu, dS, dgamma = kern.gradients_qX_expectations(dL_dpsi0 * np.ones(mu.shape[0]), dL_dpsi1, dL_dpsi2, Z, X)
 
-    return -np.hstack((dmu.flatten(), dlnS.flatten()))
+    # the gradients of the KL divergence, as in SpikeAndSlabPrior.update_gradients_KL
+    dmu = dmu - gamma * mu
+    dlnS = S * dS - 0.5 * gamma * (S - 1.)
+    dgamma = dgamma - np.log((1. - pi) / pi * gamma / (1. - gamma)) - (np.square(mu) + S - log_S - 1.) / 2.
+    dlogit_gamma = gamma * (1. - gamma) * dgamma
 
+    return -np.hstack((dmu.flatten(), dlnS.flatten(), dlogit_gamma.flatten()))
 
+def _latent_KL(mu, S, log_S, gamma, pi):
+    """
+    KL divergence of the spike and slab posterior of the test points from the prior (see SpikeAndSlabPrior.KL_divergence)
+    """
+    var_gamma = (gamma * np.log(gamma / pi)).sum() + ((1. - gamma) * np.log((1. - gamma) / (1. - pi))).sum()
+    return var_gamma + 0.5 * (gamma * (np.square(mu) + S - log_S - 1.)).sum()
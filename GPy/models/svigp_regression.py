@@ -12,41 +12,33 @@ class SVIGPRegression(SVIGP):
 
     This is a thin wrapper around the SVIGP class, with a set of sensible defalts
 
-    :param X: input observations
-    :param Y: observed values
+    :param X: input observations (np.ndarray or np.memmap)
+    :param Y: observed values (np.ndarray or np.memmap)
     :param kernel: a GPy kernel, defaults to rbf+white
-    :param normalize_X:  whether to normalize the input data before computing (predictions will be in original scales)
-    :type normalize_X: False|True
-    :param normalize_Y:  whether to normalize the input data before computing (predictions will be in original scales)
-    :type normalize_Y: False|True
+    :param Z: inducing inputs, defaults to a random subset of X
+    :param num_inducing: number of inducing inputs, if Z is not given
+    :param q_u: canonical parameters of the distribution q(u), see SVIGP
+    :param batchsize: the number of data points in a batch
+    :param bool prefetch: whether to load the next batch in the background
     :rtype: model object
 
     .. Note:: Multiple independent outputs are allowed using columns of Y
 
     """
 
-    def __init__(self, X, Y, kernel=None, Z=None, num_inducing=10, q_u=None, batchsize=10, normalize_Y=False):
+    def __init__(self, X, Y, kernel=None, Z=None, num_inducing=10, q_u=None, batchsize=10, prefetch=True, name='SVIGP regression'):
         # kern defaults to rbf (plus white for stability)
         if kernel is None:
-            kernel = kern.rbf(X.shape[1], variance=1., lengthscale=4.) + kern.white(X.shape[1], 1e-3)
+            kernel = kern.RBF(X.shape[1], variance=1., lengthscale=4.) + kern.White(X.shape[1], 1e-3)
 
         # Z defaults to a subset of the data
         if Z is None:
-            i = np.random.permutation(X.shape[0])[:num_inducing]
-            Z = X[i].copy()
+            i = np.sort(np.random.permutation(X.shape[0])[:num_inducing])
+            Z = np.array(X[i])
         else:
             assert Z.shape[1] == X.shape[1]
 
         # likelihood defaults to Gaussian
-        likelihood = likelihoods.Gaussian(Y, normalize=normalize_Y)
-
-        SVIGP.__init__(self, X, likelihood, kernel, Z, q_u=q_u, batchsize=batchsize)
-        self.load_batch()
-
-    def _getstate(self):
-        return GPBase._getstate(self)
-
-
-    def _setstate(self, state):
-        return GPBase._setstate(self, state)
+        likelihood = likelihoods.Gaussian()
 
+        SVIGP.__init__(self, X, Y, Z, kernel, likelihood, q_u=q_u, batchsize=batchsize, prefetch=prefetch, name=name)
@@ -19,11 +19,13 @@ def plot_optimizer(optimizer):
 
 def plot_sgd_traces(optimizer):
     pb.figure()
-    pb.subplot(211)
-    pb.title('Parameters')
-    for k in optimizer.param_traces.keys():
-        pb.plot(optimizer.param_traces[k], label=k)
-    pb.legend(loc=0)
-    pb.subplot(212)
+    pb.subplot(311)
     pb.title('Objective function')
-    pb.plot(optimizer.fopt_trace)
+    pb.plot(optimizer.trace)
+    pb.subplot(312)
+    pb.title('Gradient norm')
+    pb.semilogy(optimizer.grad_norm_trace)
+    pb.subplot(313)
+    pb.title('Learning rate')
+    pb.plot(optimizer.learning_rate_trace)
+    pb.xlabel('Iteration')
@@ -3,6 +3,8 @@
 
 import numpy as np
 import pylab as pb
+from models_plots import plot_fit
+from ...util.misc import param_to_array
 
 
 def plot(model, ax=None, fignum=None, Z_height=None, **kwargs):
@@ -11,15 +13,11 @@ def plot(model, ax=None, fignum=None, Z_height=None, **kwargs):
         fig = pb.figure(num=fignum)
         ax = fig.add_subplot(111)
 
-    #horrible hack here:
-    data = model.likelihood.data.copy()
-    model.likelihood.data = model.Y
-    GP.plot(model, ax=ax, **kwargs)
-    model.likelihood.data = data
+    plot_fit(model, ax=ax, **kwargs)
 
-    Zu = model.Z * model._Xscale + model._Xoffset
+    Zu = param_to_array(model.Z)
     if model.input_dim==1:
-        ax.plot(model.X_batch, model.likelihood.data, 'gx',mew=2)
+        ax.plot(model.X_batch, model.Y_batch, 'gx',mew=2)
         if Z_height is None:
             Z_height = ax.get_ylim()[0]
         ax.plot(Zu, np.zeros_like(Zu) + Z_height, 'r|', mew=1.5, markersize=12)
@@ -34,7 +32,7 @@ def plot_traces(model):
     t = np.array(model._param_trace)
     pb.subplot(2,1,1)
     for l,ti in zip(model._get_param_names(),t.T):
-        if not l[:3]=='iip':
+        if not 'inducing inputs' in l:
             pb.plot(ti,label=l)
     pb.legend(loc=0)
 
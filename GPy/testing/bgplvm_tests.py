@@ -79,6 +79,41 @@ class BGPLVMTests(unittest.TestCase):
         m.randomize()
         self.assertTrue(m.checkgrad())
 
+    def test_latent_grad(self):
+        from ..models.bayesian_gplvm import latent_psi_gradients, latent_cost, latent_grad
+        from scipy.optimize import check_grad
+        N, num_inducing, input_dim, D = 10, 3, 2, 4
+        Y = np.random.randn(N, D)
+        k = GPy.kern.RBF(input_dim) + GPy.kern.Bias(input_dim) + GPy.kern.White(input_dim, 0.00001)
+        m = BayesianGPLVM(Y, input_dim, kernel=k, num_inducing=num_inducing)
+        m.randomize()
+        Ytest = np.random.randn(5, D)
+        args = (m.kern, GPy.util.misc.param_to_array(m.Z),) + latent_psi_gradients(m, Ytest)
+        x = np.random.randn(2 * 5 * input_dim)
+        self.assertLess(check_grad(latent_cost, latent_grad, x, *args), 1e-4)
+
+    def test_do_test_latents(self):
+        N, num_inducing, input_dim, D = 20, 5, 2, 4
+        Y = np.random.randn(N, D)
+        m = BayesianGPLVM(Y, input_dim, num_inducing=num_inducing)
+        means, covars = m.do_test_latents(Y[:6], batchsize=4, maxiters=5)
+        self.assertEqual(means.shape, (6, input_dim))
+        self.assertTrue(np.all(covars > 0))
+        means, covars = m.do_test_latents(Y[:6], init='prior', maxiters=5)
+        self.assertEqual(covars.shape, (6, input_dim))
+
+    def test_natgrad(self):
+        N, num_inducing, input_dim, D = 20, 5, 2, 4
+        Y = np.random.randn(N, D)
+        m = BayesianGPLVM(Y, input_dim, num_inducing=num_inducing)
+        self.assertEqual(len(m.natural_gradient_blocks()), 1)
+        ll = m.log_likelihood()
+        m.optimize('natgrad', max_iters=10, vb_steplength=.1)
+        self.assertTrue(m.log_likelihood() >= ll)
+        self.assertTrue(np.all(m.X.variance > 0))
+        m.optimize('natgrad', max_iters=3, hyper_optimizer='lbfgsb')
+        self.assertTrue(m.checkgrad())
+
 
 if __name__ == "__main__":
     print "Running unit tests, please be (very) patient..."
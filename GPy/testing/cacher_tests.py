@@ -0,0 +1,145 @@
+'''
+Tests for GPy.util.caching
+'''
+import unittest
+import numpy as np
+from GPy.core.parameterization.array_core import ObservableArray
+from GPy.util.caching import Cacher, registry
+
+class CacherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        def operation(*args):
+            self.calls += 1
+            return np.sum([a.sum() for a in args if a is not None]) * np.ones((10, 10))
+        self.cacher = Cacher(operation, limit=2)
+        self.X = ObservableArray(np.random.randn(10, 2))
+        self.X2 = ObservableArray(np.random.randn(10, 2))
+
+    def test_hit(self):
+        a = self.cacher(self.X)
+        b = self.cacher(self.X)
+        self.assertIs(a, b)
+        self.assertEqual(self.calls, 1)
+        self.cacher(self.X, None)
+        self.assertEqual(self.calls, 2)
+
+    def test_invalidate(self):
+        a = self.cacher(self.X)
+        self.X[0, 0] = 10.
+        b = self.cacher(self.X)
+        self.assertEqual(self.calls, 2)
+        self.assertFalse(np.allclose(a, b))
+        self.X += 1.
+        self.cacher(self.X)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(len(self.cacher.cached), 1)
+
+    def test_lru(self):
+        self.cacher(self.X)
+        self.cacher(self.X2)
+        self.cacher(self.X) # X is the most recently used now
+        self.cacher(self.X, self.X2) # evicts X2
+        self.assertEqual(self.calls, 3)
+        self.cacher(self.X)
+        self.assertEqual(self.calls, 3)
+        self.cacher(self.X2)
+        self.assertEqual(self.calls, 4)
+        self.assertEqual(len(self.cacher.cached), 2)
+
+    def test_max_bytes(self):
+        self.cacher.limit = 10
+        self.cacher.max_bytes = 2 * 10 * 10 * 8
+        self.cacher(self.X)
+        self.cacher(self.X2)
+        self.cacher(self.X, self.X2)
+        self.assertEqual(len(self.cacher.cached), 2)
+        self.assertEqual(self.cacher.cached_bytes, 2 * 10 * 10 * 8)
+        self.cacher(self.X)
+        self.assertEqual(self.calls, 4)
+
+    def test_not_observable(self):
+        X = np.random.randn(10, 2)
+        self.cacher(X)
+        self.cacher(X)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(len(self.cacher.cached), 0)
+
+    def test_reset(self):
+        self.cacher(self.X)
+        self.cacher.reset()
+        self.cacher(self.X)
+        self.assertEqual(self.calls, 2)
+
+class CacheRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.max_bytes = registry.max_bytes
+        self.cachers = [Cacher(lambda X: X * np.ones((10, 10, 1)), limit=5) for _ in range(2)]
+        self.X = [ObservableArray(np.random.randn(10)) for _ in range(3)]
+
+    def tearDown(self):
+        registry.max_bytes = self.max_bytes
+
+    def test_stats(self):
+        c = self.cachers[0]
+        c(self.X[0]); c(self.X[0]); c(self.X[1])
+        self.assertEqual((c.hits, c.misses, c.evictions), (1, 2, 0))
+        stats = registry.stats()[c.name]
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertGreaterEqual(stats['bytes'], 2 * 10 * 10 * 10 * 8)
+
+    def test_stats_threads(self):
+        import threading
+        errors = []
+        def work():
+            try:
+                for _ in range(50):
+                    c = Cacher(lambda X: X * np.ones((10, 10)), limit=2)
+                    [c(X) for X in self.X]
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        [t.start() for t in threads]
+        while any(t.is_alive() for t in threads):
+            registry.stats()
+            registry.cached_bytes
+        [t.join() for t in threads]
+        self.assertEqual(errors, [])
+
+    def test_bookkeeping(self):
+        import gc
+        registry.max_bytes = None
+        c = self.cachers[0]
+        c(self.X[0])
+        self.assertNotIn(id(c), [k[0] for k in registry._order])
+        self.assertEqual(registry.cached_bytes, sum(cacher.cached_bytes for cacher in registry.cachers))
+        registry.max_bytes = 1 << 30
+        c(self.X[1])
+        self.assertEqual([k for k in registry._order if k[0] == id(c)], [(id(c), (id(self.X[0]),)), (id(c), (id(self.X[1]),))])
+        # garbage collected cachers are dropped from the order and the total
+        del c, self.cachers[0]
+        gc.collect()
+        self.assertEqual(registry.cached_bytes, sum(cacher.cached_bytes for cacher in registry.cachers))
+        self.assertEqual([r for r in registry._order.itervalues() if r() is None], [])
+
+    def test_global_ceiling(self):
+        nbytes = 10 * 10 * 10 * 8
+        registry.clear()
+        registry.max_bytes = 3 * nbytes
+        c1, c2 = self.cachers
+        c1(self.X[0])
+        c2(self.X[1])
+        c1(self.X[2])
+        c2(self.X[1]) # hit
+        c2(self.X[0]) # evicts c1(X[0]), the least recently used output
+        self.assertEqual(registry.cached_bytes, 3 * nbytes)
+        self.assertEqual(len(c1.cached), 1)
+        self.assertEqual(len(c2.cached), 2)
+        self.assertEqual(c1.evictions, 1)
+        c2(self.X[1])
+        self.assertEqual(c2.hits, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -226,6 +226,119 @@ class KernelTestsContinuous(unittest.TestCase):
         k = GPy.kern.Matern52(2)
         self.assertTrue(kern_test(k, X=self.X, X2=self.X2, verbose=verbose))
 
+    def test_stationary_tiled_gradients(self):
+        def closed_form(k, dL_dK, X, X2):
+            # the gradients from the full matrices, as computed before tiling
+            r = k._scaled_dist(X, X2)
+            dL_dr = k.dK_dr(r) * dL_dK
+            tmp = dL_dr / np.where(r != 0., r, np.inf)
+            X2 = X if X2 is None else X2
+            d = X[:, None, :] - X2[None, :, :]
+            dL_dvar = np.sum(k.K_of_r(r) * dL_dK) / k.variance
+            if k.ARD:
+                dL_dl = -np.einsum('ij,ijq->q', tmp, np.square(d)) / k.lengthscale**3
+            else:
+                dL_dl = -np.sum(dL_dr * r) / k.lengthscale
+            dL_dX = np.einsum('ij,ijq->iq', tmp, d) / k.lengthscale**2
+            if X2 is X:
+                dL_dX *= 2.
+            return dL_dvar, dL_dl, dL_dX
+        kerns = [lambda: GPy.kern.Matern52(2, ARD=True), lambda: GPy.kern.RatQuad(2),
+                 lambda: GPy.kern.RatQuad(2, ARD=True), lambda: GPy.kern.Exponential(2, ARD=True),
+                 lambda: GPy.kern.Matern32(2, ARD=True), lambda: GPy.kern.ExpQuad(2)]
+        for kern in kerns:
+            k = kern()
+            k.lengthscale[:] = np.random.rand(k.lengthscale.size) + .5
+            for X2 in [None, self.X2]:
+                dL_dK = np.random.randn(100, 100 if X2 is None else 110)
+                if X2 is None:
+                    dL_dK += dL_dK.T
+                dL_dvar, dL_dl, dL_dX = closed_form(k, dL_dK, self.X, X2)
+                for tile_bytes in [k._tile_bytes, 8 * 110 * 7]: # one tile, and tiles of 7 rows
+                    k._tile_bytes = tile_bytes
+                    k.update_gradients_full(dL_dK, self.X, X2)
+                    np.testing.assert_allclose(k.variance.gradient, dL_dvar)
+                    np.testing.assert_allclose(k.lengthscale.gradient, dL_dl)
+                    np.testing.assert_allclose(k.gradients_X(dL_dK, self.X, X2), dL_dX)
+                    del k._tile_bytes
+            for X2 in [None, self.X2[:15]]:
+                k = kern()
+                k._tile_bytes = 8 * 15 * 4 # tiles of 4 rows
+                self.assertTrue(Kern_check_dK_dtheta(k, X=self.X[:20], X2=X2).checkgrad(verbose=verbose))
+                self.assertTrue(Kern_check_dK_dX(kern(), X=self.X[:20], X2=X2).checkgrad(verbose=verbose))
+
+    def test_psi2_sum(self):
+        from GPy.core.parameterization.variational import NormalPosterior
+        vp = NormalPosterior(self.X, np.random.rand(*self.X.shape))
+        Z = self.X2[:6]
+        dL_dpsi0, dL_dpsi1 = np.random.randn(100), np.random.randn(100, 6)
+        dL_dpsi2 = np.random.randn(6, 6)
+        dL_dpsi2 += dL_dpsi2.T
+        k = GPy.kern.RBF(2, ARD=True) + GPy.kern.Bias(2)
+        k._parameters_[0]._tile_bytes = 8 * 6 * 6 * 2 * 7 # tiles of 7 data points
+        np.testing.assert_allclose(k.psi2_sum(Z, vp), k.psi2(Z, vp).sum(0))
+        dL_dpsi2_all = np.repeat(dL_dpsi2[None], 100, 0)
+        k.update_gradients_expectations(dL_dpsi0, dL_dpsi1, dL_dpsi2_all, Z, vp)
+        grad = k.gradient.copy()
+        k.update_gradients_expectations(dL_dpsi0, dL_dpsi1, dL_dpsi2, Z, vp)
+        np.testing.assert_allclose(k.gradient, grad)
+        np.testing.assert_allclose(k.gradients_Z_expectations(dL_dpsi1, dL_dpsi2, Z, vp),
+                                   k.gradients_Z_expectations(dL_dpsi1, dL_dpsi2_all, Z, vp))
+        np.testing.assert_allclose(k.gradients_qX_expectations(dL_dpsi0, dL_dpsi1, dL_dpsi2, Z, vp),
+                                   k.gradients_qX_expectations(dL_dpsi0, dL_dpsi1, dL_dpsi2_all, Z, vp))
+
+    def test_psi_backends(self):
+        from GPy.core.parameterization.variational import NormalPosterior
+        from GPy.kern._src.psi_comp import backend
+        vp = NormalPosterior(self.X[:20], np.random.rand(20, 2))
+        Z = self.X2[:6]
+        dL_dpsi0, dL_dpsi1 = np.random.randn(20), np.random.randn(20, 6)
+        dL_dpsi2 = np.random.randn(20, 6, 6)
+        dL_dpsi2 += dL_dpsi2.swapaxes(1, 2)
+        previous = backend.get_backend().name
+        try:
+            backend.set_backend('openmp')
+        except ValueError:
+            raise unittest.SkipTest("the OpenMP extension has not been built")
+        for k in [GPy.kern.RBF(2, ARD=True), GPy.kern.Linear(2, ARD=True)]:
+            results = []
+            for name in ['openmp', 'numpy']:
+                backend.set_backend(name)
+                results.append([k.psi2(Z, vp), k.psi2_sum(Z, vp)])
+                for dL_dpsi2_ in [dL_dpsi2, dL_dpsi2.sum(0)]: # per data point, and summed (in tiles)
+                    k.update_gradients_expectations(dL_dpsi0, dL_dpsi1, dL_dpsi2_, Z, vp)
+                    results[-1] += [k.gradient.copy(), k.gradients_Z_expectations(dL_dpsi1, dL_dpsi2_, Z, vp)]
+                    results[-1] += list(k.gradients_qX_expectations(dL_dpsi0, dL_dpsi1, dL_dpsi2_, Z, vp))
+            for a, b in zip(*results):
+                np.testing.assert_allclose(a, b)
+        backend.set_backend(previous)
+
+    def test_shared_psi_distances(self):
+        from GPy.core.parameterization.variational import NormalPosterior
+        from GPy.core.parameterization import Param
+        from GPy.kern._src import rbf
+        vp = NormalPosterior(self.X[:20], np.random.rand(20, 2))
+        Z = Param('Z', self.X2[:6])
+        k1, k2 = GPy.kern.RBF(2, ARD=True), GPy.kern.RBF(2, lengthscale=2.)
+        psi1 = k1.psi1(Z, vp)
+        cacher = rbf._psi1_distances._cacher.c
+        hits = cacher.hits
+        # the second kernel reuses the distances of the first
+        np.testing.assert_allclose(k2.psi1(Z, vp), k2.psi1(self.X2[:6], vp))
+        self.assertEqual(cacher.hits, hits + 1)
+        Z[0, 0] += 1.
+        self.assertFalse(np.allclose(k1.psi1(Z, vp), psi1))
+
+    def test_float32_precision(self):
+        for k in [GPy.kern.RBF(2, ARD=True), GPy.kern.Matern32(2), GPy.kern.Linear(2)]:
+            K64 = k.K(self.X, self.X2)
+            k.set_precision(np.float32)
+            K32 = k.K(self.X, self.X2)
+            self.assertEqual(K32.dtype, np.float32)
+            np.testing.assert_allclose(K32, K64, rtol=1e-5, atol=1e-5)
+            k.set_precision(np.float64)
+            self.assertEqual(k.K(self.X, self.X2).dtype, np.float64)
+
     #TODO: turn off grad checkingwrt X for indexed kernels liek coregionalize
 
 
@@ -27,6 +27,26 @@ class MRDTests(unittest.TestCase):
 
         self.assertTrue(m.checkgrad())
 
+    def test_n_jobs(self):
+        N, num_inducing, input_dim = 20, 5, 3
+        Ylist = [np.random.randn(N, D) for D in (4, 6, 5)]
+        m = GPy.models.MRD(Ylist, input_dim=input_dim, num_inducing=num_inducing)
+        m.randomize()
+        L, g = m.log_likelihood(), m.gradient.copy()
+        m.n_jobs = 3
+        m.parameters_changed()
+        self.assertEqual(m.log_likelihood(), L)
+        np.testing.assert_array_equal(m.gradient, g)
+        # the threads are kept for the following evaluations, and not pickled
+        pool = m._pool._pool
+        self.assertIsNotNone(pool)
+        self.assertTrue(m.checkgrad())
+        self.assertIs(m._pool._pool, pool)
+        import cPickle
+        m2 = cPickle.loads(cPickle.dumps(m, -1))
+        self.assertIsNone(m._pool._pool)
+        self.assertEqual(m2.log_likelihood(), L)
+
 if __name__ == "__main__":
     print "Running unit tests, please be (very) patient..."
     unittest.main()
@@ -0,0 +1,92 @@
+'''
+Tests for GPy.util.subarray_and_sorting
+'''
+import unittest
+import numpy as np
+from GPy.util.subarray_and_sorting import common_subarrays, common_subarray_indices
+
+def _reference(X, axis):
+    # the grouping by python tuples, as done before vectorising
+    groups = {}
+    for i, x in enumerate(X if axis == 0 else X.T):
+        groups.setdefault(tuple(x), []).append(i)
+    return groups
+
+class CommonSubarraysTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.mask = np.random.rand(40, 13) > .7
+        self.mask[[3, 7], :] = self.mask[0]
+        self.mask[:, [2, 5, 11]] = self.mask[:, [0]]
+
+    def assertGroups(self, X, axis):
+        d = common_subarrays(X, axis)
+        reference = _reference(X, axis)
+        self.assertItemsEqual(d.keys(), reference.keys())
+        for k, ind in reference.iteritems():
+            self.assertEqual(d[k].tolist(), ind)
+
+    def test_bool_rows(self):
+        self.assertGroups(self.mask, 0)
+        self.assertEqual(common_subarrays(self.mask, 0)[tuple(self.mask[0])].tolist()[:3], [0, 3, 7])
+
+    def test_bool_columns(self):
+        self.assertGroups(self.mask, 1)
+        self.assertEqual(common_subarrays(self.mask, 1)[tuple(self.mask[:, 0])].tolist(), [0, 2, 5, 11])
+
+    def test_indices(self):
+        for axis in (0, 1):
+            subarrays, indices = common_subarray_indices(self.mask, axis)
+            X = self.mask if axis == 0 else self.mask.T
+            self.assertEqual(sum(ind.size for ind in indices), X.shape[0])
+            for x, ind in zip(subarrays, indices):
+                self.assertTrue((X[ind] == x).all())
+
+    def test_float(self):
+        X = np.random.randint(0, 3, (30, 4)).astype(float)
+        self.assertGroups(X, 0)
+        self.assertGroups(X, 1)
+        self.assertGroups(X.astype(int), 0)
+
+    def test_signed_zero_and_nan(self):
+        d = common_subarrays(np.array([[0., -0.], [0., 0.]]), 0)
+        self.assertEqual(d[(0., 0.)].tolist(), [0, 1])
+        nan = np.array([np.nan]).view(np.uint64)
+        X = np.array([[np.nan, 1.], [np.nan, 1.]])
+        X[1, 0] = (nan + 1).view(float)[0] # a NaN with a different payload
+        subarrays, indices = common_subarray_indices(X, 0)
+        self.assertEqual(len(indices), 1)
+        self.assertEqual(indices[0].tolist(), [0, 1])
+
+    def test_object(self):
+        X = np.array([['a', None], [1, 2], ['a', None]], dtype=object)
+        d = common_subarrays(X, 0)
+        self.assertEqual(d[('a', None)].tolist(), [0, 2])
+        self.assertEqual(d[(1, 2)].tolist(), [1])
+
+    def test_empty(self):
+        for axis in (0, 1):
+            self.assertEqual(common_subarrays(np.zeros((0, 0), dtype=bool), axis), {})
+        self.assertEqual(common_subarrays(np.zeros((0, 3)), 0), {})
+        self.assertEqual(common_subarrays(np.zeros((3, 0)), 1), {})
+        self.assertEqual(common_subarrays(np.zeros((3, 0)), 0)[()].tolist(), [0, 1, 2])
+        self.assertEqual(common_subarrays(np.zeros((0, 3), dtype=bool), 1)[()].tolist(), [0, 1, 2])
+
+    def test_missing_data_patterns(self):
+        from GPy.inference.latent_function_inference.var_dtc import VarDTCMissingData
+        Y = np.random.randn(*self.mask.shape)
+        Y[self.mask] = np.nan
+        inference = VarDTCMissingData()
+        Ys, traces = inference._subarray_computations(Y)
+        patterns = [(tuple(v), ind.tolist() if isinstance(ind, np.ndarray) else ind)
+                    for v, ind in inference._subarray_indices]
+        reference = [(tuple(~np.array(v)), ind if len(ind) < Y.shape[1] else slice(None))
+                     for v, ind in _reference(np.isnan(Y), 1).iteritems() if not np.all(v)]
+        self.assertItemsEqual(patterns, reference)
+        for y, (v, ind) in zip(Ys, inference._subarray_indices):
+            self.assertFalse(np.isnan(y).any())
+            np.testing.assert_array_equal(y, Y[v][:, ind])
+
+if __name__ == "__main__":
+    unittest.main()
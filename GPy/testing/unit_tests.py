@@ -177,6 +177,261 @@ class GradientTests(unittest.TestCase):
         raise unittest.SkipTest("This is not implemented yet!")
         self.check_model(rbflin, model_type='SparseGPRegression', dimension=1, uncertain_inputs=1)
 
+    def test_GPRegression_more_outputs_than_data(self):
+        ''' Testing the GP regression with a low rank factor of YY^T '''
+        X = np.random.uniform(-3., 3., (10, 1))
+        Y = np.random.randn(10, 50)
+        m = GPy.models.GPRegression(X, Y, kernel=GPy.kern.RBF(1))
+        self.assertTrue(m.checkgrad())
+        K = m.kern.K(X) + np.eye(10) * m.likelihood.variance
+        mu, _ = m._raw_predict(X[:3])
+        np.testing.assert_allclose(mu, np.dot(m.kern.K(X[:3], X), np.linalg.solve(K, Y)))
+
+    def test_predict_batches(self):
+        ''' Testing batched prediction against predicting all points at once '''
+        Xnew = np.random.uniform(-3., 3., (53, 2))
+        for m in [GPy.models.GPRegression(self.X2D, self.Y2D), GPy.models.SparseGPRegression(self.X2D, self.Y2D, num_inducing=5)]:
+            m.randomize()
+            for full, batched in zip(m.predict(Xnew), m.predict(Xnew, batch_size=10)):
+                np.testing.assert_allclose(full, batched)
+            for full, threaded in zip(m.predict(Xnew), m.predict(Xnew, batch_size=7, n_jobs=3)):
+                np.testing.assert_allclose(full, threaded)
+            for empty in m.predict(Xnew[:0], n_jobs=3):
+                self.assertEqual(empty.shape, (0, 1))
+        m = GPy.models.GPRegression(self.X2D, self.Y2D)
+        # with full_cov, n_jobs falls back to predicting all points at once
+        for full, threaded in zip(m.predict(Xnew, full_cov=True), m.predict(Xnew, full_cov=True, n_jobs=-1)):
+            np.testing.assert_allclose(full, threaded)
+        K = m.kern.K(self.X2D) + np.eye(40) * m.likelihood.variance
+        Kx = m.kern.K(Xnew, self.X2D)
+        _, var = m._raw_predict(Xnew)
+        np.testing.assert_allclose(var[:, 0], m.kern.Kdiag(Xnew) - np.sum(np.dot(Kx, np.linalg.inv(K)) * Kx, 1))
+        _, cov = m._raw_predict(Xnew, full_cov=True)
+        np.testing.assert_allclose(np.diag(cov), var[:, 0])
+        # exact inference predicts by triangular solves, without the inverse of K
+        self.assertIsNone(m.posterior._woodbury_inv)
+
+    def test_append_data(self):
+        ''' Testing incremental updates of an exact GP against inference on all data '''
+        Xnew = np.random.uniform(-3., 3., (13, 2))
+        m = GPy.models.GPRegression(self.X2D[:30], self.Y2D[:30])
+        m.randomize()
+        m.append_data(self.X2D[30:], self.Y2D[30:])
+        m.append_data(Xnew[:3], Xnew[:3, :1])
+        m.remove_data(5)
+        k = GPy.kern.RBF(2)
+        k[:] = m.kern[:]
+        m_all = GPy.models.GPRegression(np.vstack((self.X2D, Xnew[:3]))[5:], np.vstack((self.Y2D, Xnew[:3, :1]))[5:], kernel=k)
+        m_all.likelihood.variance[:] = m.likelihood.variance
+        np.testing.assert_allclose(m.log_likelihood(), m_all.log_likelihood())
+        for a, b in zip(m.predict(Xnew), m_all.predict(Xnew)):
+            np.testing.assert_allclose(a, b)
+        m.append_data(Xnew[3:], Xnew[3:, :1], window=20)
+        self.assertEqual(m.num_data, 20)
+        np.testing.assert_allclose(m.posterior.woodbury_chol, np.linalg.cholesky(m.kern.K(m.X) + np.eye(20) * m.likelihood.variance), atol=1e-10)
+
+    def test_export_predictor(self):
+        ''' Testing the exported predictor against the model predictions '''
+        import pickle
+        Xnew = np.random.uniform(-3., 3., (13, 2))
+        for m in [GPy.models.GPRegression(self.X2D, self.Y2D, kernel=GPy.kern.Matern32(2, ARD=True) + GPy.kern.RBF(2)),
+                  GPy.models.SparseGPRegression(self.X2D, self.Y2D, kernel=GPy.kern.Linear(2), num_inducing=5)]:
+            m.randomize()
+            p = pickle.loads(pickle.dumps(m.export_predictor()))
+            mean, var, _, _ = m.predict(Xnew)
+            np.testing.assert_allclose(p.predict(Xnew), (mean, var))
+            mu, cov = m._raw_predict(Xnew[:1], full_cov=True)
+            np.testing.assert_allclose(p.predict(Xnew[:1], full_cov=True, include_likelihood=False), (mu, np.atleast_3d(cov)[:, :, 0]))
+
+    def test_pickle(self):
+        ''' Testing that pickled models drop their caches, reconnect their observers and load parameter states '''
+        import cPickle
+        for m in [GPy.models.GPRegression(self.X2D, self.Y2D, kernel=GPy.kern.RBF(2) + GPy.kern.Linear(2)),
+                  GPy.models.SparseGPRegression(self.X2D, self.Y2D, num_inducing=5)]:
+            m.randomize()
+            self.assertEqual(len(m.inference_method.get_YYTfactor.__getstate__()['cached']), 0)
+            m2 = cPickle.loads(cPickle.dumps(m, -1))
+            self.assertAlmostEqual(m2.log_likelihood(), m.log_likelihood())
+            np.testing.assert_allclose(m2.gradient, m.gradient)
+            m2.randomize()
+            m.set_parameter_state(cPickle.loads(cPickle.dumps(m2.parameter_state(), -1)))
+            self.assertAlmostEqual(m.log_likelihood(), m2.log_likelihood())
+        self.assertRaises(GPy.core.parameterization.parameter_core.HierarchyError, m.set_parameter_state,
+                          GPy.models.GPRegression(self.X2D, self.Y2D).parameter_state())
+
+    def test_VarDTCStreaming(self):
+        ''' Testing the streaming VarDTC against VarDTC '''
+        from GPy.inference.latent_function_inference import VarDTC, VarDTCStreaming
+        Z = self.X2D[:5].copy()
+        for kern in [GPy.kern.RBF, GPy.kern.Linear]:
+            m = GPy.core.SparseGP(self.X2D, self.Y2D, Z, kern(2, ARD=True), GPy.likelihoods.Gaussian(), inference_method=VarDTC())
+            ms = GPy.core.SparseGP(self.X2D, self.Y2D, Z, kern(2, ARD=True), GPy.likelihoods.Gaussian(), inference_method=VarDTCStreaming(batchsize=7))
+            np.testing.assert_allclose(ms.log_likelihood(), m.log_likelihood())
+            np.testing.assert_allclose(ms.gradient, m.gradient, atol=1e-6)
+            self.assertTrue(ms.checkgrad())
+            post, log_marginal, _ = ms.inference_method.inference_chunks(m.kern, Z, m.likelihood,
+                lambda: ((self.X2D[i:i+11], self.Y2D[i:i+11]) for i in xrange(0, 40, 11)))
+            np.testing.assert_allclose(log_marginal, m.log_likelihood())
+            np.testing.assert_allclose(post.woodbury_vector, m.posterior.woodbury_vector, rtol=1e-5, atol=1e-6)
+
+        np.random.seed(3)
+        m = GPy.models.BayesianGPLVM(self.Y2D, 2, init='random', num_inducing=4, inference_method=VarDTC())
+        np.random.seed(3)
+        ms = GPy.models.BayesianGPLVM(self.Y2D, 2, init='random', num_inducing=4, inference_method=VarDTCStreaming(batchsize=7))
+        np.testing.assert_allclose(ms.log_likelihood(), m.log_likelihood())
+        np.testing.assert_allclose(ms.gradient, m.gradient, atol=1e-6)
+
+    def test_SparseGP_append_data(self):
+        ''' Testing online updates of a sparse GP against inference on all data '''
+        Z = self.X2D[:5].copy()
+        m = GPy.models.SparseGPRegression(self.X2D[:25], self.Y2D[:25], Z=Z)
+        m.randomize()
+        m.append_data(self.X2D[25:32], self.Y2D[25:32])
+        m.append_data(self.X2D[32:], self.Y2D[32:], keep_data=False)
+        self.assertEqual(m.num_data, 32)
+        k = GPy.kern.RBF(2)
+        k[:] = m.kern[:]
+        m_all = GPy.models.SparseGPRegression(self.X2D, self.Y2D, kernel=k, Z=np.array(m.Z))
+        m_all.likelihood.variance[:] = m.likelihood.variance
+        np.testing.assert_allclose(m.log_likelihood(), m_all.log_likelihood())
+        np.testing.assert_allclose(m.posterior.woodbury_vector, m_all.posterior.woodbury_vector, rtol=1e-5)
+        np.testing.assert_allclose(m.posterior.woodbury_inv, m_all.posterior.woodbury_inv, rtol=1e-5)
+        Xnew = np.random.uniform(-3., 3., (13, 2))
+        for a, b in zip(m.predict(Xnew), m_all.predict(Xnew)):
+            np.testing.assert_allclose(a, b, rtol=1e-5)
+
+    def test_SVIGP(self):
+        ''' Testing the gradients of the stochastic variational GP on two batches '''
+        m = GPy.models.SVIGPRegression(self.X2D, self.Y2D, num_inducing=5, batchsize=10)
+        m.randomize()
+        self.assertTrue(m.checkgrad())
+        m.load_batch()
+        self.assertTrue(m.checkgrad())
+        m.optimize_adaptive(5, print_interval=10)
+        self.assertEqual(m.iterations, 5)
+        import cPickle
+        m = GPy.core.SVIGP(self.X2D, self.Y2D, self.X2D[:5].copy(), GPy.kern.RBF(2), GPy.likelihoods.Gaussian(), batchsize=10)
+        m.randomize()
+        state = m._getstate()
+        self.assertEqual(len([s for s in state if s is m.Y]), 1)
+        m2 = cPickle.loads(cPickle.dumps(m, -1))
+        self.assertEqual(m2.output_dim, m.output_dim)
+        self.assertAlmostEqual(m2.log_likelihood(), m.log_likelihood())
+        np.testing.assert_allclose(m2.gradient, m.gradient)
+
+    def test_SVIGP_natgrad(self):
+        ''' Testing the natural gradient optimizer on q(u) of the stochastic variational GP '''
+        m = GPy.models.SVIGPRegression(self.X2D, self.Y2D, num_inducing=5, batchsize=40)
+        m.optimize('natgrad', hyper_optimizer=None, max_iters=50, ftol=0)
+        np.testing.assert_allclose(m.vb_grad_natgrad()[0], 0, atol=1e-4)
+        m.optimize('natgrad', max_iters=5)
+        self.assertTrue(m.checkgrad())
+
+    def test_stochastic_optimizers(self):
+        ''' Testing Adam, RMSProp, AdaGrad and SGD on a GP and on the minibatches of the stochastic variational GP '''
+        for optimizer in ['adam', 'rmsprop', 'adagrad', 'sgd']:
+            m = GPy.models.GPRegression(self.X1D, self.Y1D)
+            f = m.objective_function(m._get_params_transformed())
+            m.optimize(optimizer, max_iters=100, learning_rate=1e-3 if optimizer == 'sgd' else 1e-2, schedule='inverse')
+            opt = m.optimization_runs[-1]
+            self.assertTrue(m.objective_function(m._get_params_transformed()) < f)
+            self.assertEqual(len(opt.trace), opt.funct_eval)
+            self.assertEqual(len(opt.learning_rate_trace), opt.funct_eval)
+            # the optimum is the last point the objective was evaluated at
+            self.assertAlmostEqual(m.objective_function(opt.x_opt), opt.trace[-1])
+        m.optimize_SGD(iterations=3)
+        self.assertEqual(m.optimization_runs[-1].momentum, .1)
+        m = GPy.models.SVIGPRegression(self.X2D, self.Y2D, num_inducing=5, batchsize=10)
+        m.optimize('natgrad', max_iters=20, window=4)
+        self.assertEqual(m.epochs, 5)
+        self.assertEqual(len(m.optimization_runs[-1].trace), 20)
+
+    def test_optimize_restarts_parallel(self):
+        ''' Testing the restarts in the worker pool against the serial restarts '''
+        m = GPy.models.GPRegression(self.X1D, self.Y1D)
+        m.optimize_restarts(num_restarts=3, parallel=True, num_processes=2, verbose=False, max_iters=20)
+        self.assertEqual(len(m.optimization_runs), 3)
+        self.assertTrue(all(o.model is m for o in m.optimization_runs))
+        f_best = min(o.f_opt for o in m.optimization_runs)
+        self.assertAlmostEqual(m.objective_function(m._get_params_transformed()), f_best)
+        m.optimize_restarts(num_restarts=3, verbose=False, max_iters=20, dominance_margin=0., dominance_evals=1)
+        self.assertEqual(len(m.optimization_runs), 6)
+        # without time the restarts stop at once, and the model keeps its parameters
+        x = m._get_params_transformed()
+        m.optimize_restarts(num_restarts=3, parallel=True, verbose=False, time_budget=0.)
+        self.assertTrue(all(o.status.startswith('stopped') for o in m.optimization_runs[6:]))
+        np.testing.assert_array_equal(m._get_params_transformed(), x)
+        # failed restarts raise their error, serial restarts with their own traceback
+        import sys, traceback
+        for parallel in [False, True]:
+            self.assertRaises(KeyError, m.optimize_restarts, num_restarts=2, parallel=parallel, verbose=False, optimizer='no such optimizer')
+        try:
+            m.optimize_restarts(num_restarts=2, verbose=False, optimizer='no such optimizer')
+        except KeyError:
+            self.assertEqual(traceback.extract_tb(sys.exc_info()[2])[-1][2], 'get_optimizer')
+
+    def test_MinibatchLoader(self):
+        ''' Testing the epochs of the prefetching minibatch loader on a memmap '''
+        import tempfile, os
+        fd, fname = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+        try:
+            np.save(fname, self.X2D)
+            X = np.load(fname, mmap_mode='r')
+            loader = GPy.util.minibatch.MinibatchLoader([X, self.Y2D, None], 15, seed=0)
+            for epoch in range(3):
+                seen = []
+                for _ in range(2):
+                    e, index, (Xb, Yb, none) = loader.next()
+                    self.assertEqual(e, epoch)
+                    self.assertIsNone(none)
+                    self.assertEqual(type(Xb), np.ndarray)
+                    np.testing.assert_array_equal(Xb, self.X2D[index])
+                    np.testing.assert_array_equal(Yb, self.Y2D[index])
+                    seen.extend(index)
+                self.assertEqual(len(set(seen)), 30)
+            loader.close()
+            del X
+        finally:
+            os.remove(fname)
+
+    def test_VarDTCMissingData_threads(self):
+        ''' Testing the threaded missing data VarDTC against the serial one '''
+        from GPy.inference.latent_function_inference.var_dtc import VarDTCMissingData
+        Y = self.Y2D.copy()
+        Y[np.random.rand(*Y.shape) < .3] = np.nan
+        Y = np.hstack([Y, self.Y2D + 1.])
+        Y[np.random.rand(*Y.shape) < .1] = np.nan
+        Z = self.X2D[:5].copy()
+        m = GPy.core.SparseGP(self.X2D, Y, Z, GPy.kern.RBF(2, ARD=True), GPy.likelihoods.Gaussian(), inference_method=VarDTCMissingData())
+        for n_jobs, batchsize in [(3, 1), (2, 30)]:
+            mt = GPy.core.SparseGP(self.X2D, Y, Z, GPy.kern.RBF(2, ARD=True), GPy.likelihoods.Gaussian(), inference_method=VarDTCMissingData(n_jobs=n_jobs, batchsize=batchsize))
+            self.assertEqual(mt.log_likelihood(), m.log_likelihood())
+            np.testing.assert_array_equal(mt.gradient, m.gradient)
+        # the threads are kept for the following inferences, and not pickled
+        mt.inference_method.batchsize = 1
+        mt.parameters_changed()
+        pool = mt.inference_method._pool._pool
+        self.assertIsNotNone(pool)
+        self.assertTrue(mt.checkgrad())
+        self.assertIs(mt.inference_method._pool._pool, pool)
+        import cPickle
+        inference = cPickle.loads(cPickle.dumps(mt.inference_method, -1))
+        self.assertIsNone(mt.inference_method._pool._pool)
+        self.assertIsNone(inference._pool._pool)
+
+    def test_float32_precision(self):
+        ''' Testing the single precision kernel mode against double precision '''
+        for m in [GPy.models.GPRegression(self.X2D, self.Y2D),
+                  GPy.models.SparseGPRegression(self.X2D, self.Y2D, num_inducing=5)]:
+            ll, grad = m.log_likelihood(), m.gradient.copy()
+            m.set_precision(np.float32)
+            self.assertEqual(m.kern.K(self.X2D).dtype, np.float32)
+            self.assertEqual(m.posterior.woodbury_vector.dtype, np.float64)
+            np.testing.assert_allclose(m.log_likelihood(), ll, rtol=1e-4)
+            np.testing.assert_allclose(m.gradient, grad, rtol=1e-3, atol=1e-3)
+            self.assertTrue(m.checkgrad())
+
     def test_GPLVM_rbf_bias_white_kern_2D(self):
         """ Testing GPLVM with rbf + bias kernel """
         N, input_dim, D = 50, 1, 2
@@ -14,6 +14,8 @@ import subarray_and_sorting
 import caching
 import diag
 import initialization
+import minibatch
+import parallel
 
 try:
     import sympy
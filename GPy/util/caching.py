@@ -1,21 +1,228 @@
 from ..core.parameterization.parameter_core import Observable
-import itertools
+from config import config
+import collections
+import threading
+import weakref
+import numpy as np
+
+def _nbytes(obj):
+    """
+    The number of bytes held by the arrays in obj (which can be a
+    (nested) tuple or list of arrays, as returned by cached functions).
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (tuple, list)):
+        return sum(_nbytes(o) for o in obj)
+    return 0
+
+class CacheRegistry(object):
+    """
+    Process wide registry of all :py:class:`Cacher` objects.
+
+    The registry keeps a running total of the bytes held by all cachers, and
+    enforces a global memory ceiling max_bytes by evicting the least recently
+    used outputs of any cacher. The order in which the outputs were used is
+    only tracked while there is a ceiling. Garbage collected cachers are
+    dropped from the bookkeeping through weak reference callbacks.
+
+    The default ceiling is read from the [cache] section of the configuration
+    file (max_bytes = None means no ceiling).
+
+    Use :py:meth:`stats` to read out the hit, miss and eviction counters, as
+    well as the bytes held, for each cacher.
+
+    The bookkeeping of all cachers is guarded by the registry's lock, so that
+    cached functions can be called from several threads (e.g. the views of
+    MRD with n_jobs). The cached operations themselves run outside the lock.
+    Forked worker processes call :py:meth:`after_fork` before they use any
+    cacher, as the lock could have been held by another thread at the fork.
+    """
+    def __init__(self, max_bytes=None):
+        self.cachers = weakref.WeakSet()
+        self.lock = threading.RLock()
+        # maps (id(cacher), key) to the weak reference of the cacher,
+        # only kept while there is a ceiling
+        self._order = collections.OrderedDict()
+        # maps id(cacher) to [weak reference, bytes held by the cacher]
+        self._refs = {}
+        # the weak references of garbage collected cachers, to be purged
+        self._dead = []
+        # running total of the bytes held by all cachers
+        self._nbytes = 0
+        self.max_bytes = max_bytes
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        with self.lock:
+            self._purge()
+            self._order.clear()
+            if max_bytes is not None:
+                # the recency is only tracked with a ceiling, start from the order within each cacher
+                for ref, _ in self._refs.itervalues():
+                    cacher = ref()
+                    if cacher is not None:
+                        for key in cacher.cached:
+                            self._order[(id(cacher), key)] = ref
+            self._max_bytes = max_bytes
+
+    def register(self, cacher):
+        with self.lock:
+            # purge first, the id of a collected cacher can be reused by the new one
+            self._purge()
+            self.cachers.add(cacher)
+            self._refs[id(cacher)] = [weakref.ref(cacher, self._dead.append), cacher.cached_bytes]
+            self._nbytes += cacher.cached_bytes
+
+    def _purge(self):
+        """
+        Drop the bookkeeping of garbage collected cachers.
+        """
+        if not self._dead:
+            return
+        dead = set()
+        while self._dead:
+            dead.add(id(self._dead.pop()))
+        for cid, (ref, nbytes) in self._refs.items():
+            if id(ref) in dead:
+                self._nbytes -= nbytes
+                del self._refs[cid]
+        for k in [k for k, ref in self._order.iteritems() if id(ref) in dead]:
+            del self._order[k]
+
+    def after_fork(self):
+        """
+        Renew the lock in a forked (worker) process. The cached outputs are
+        kept, they are copies of the outputs of the parent process.
+        Use it as the initializer of multiprocessing pools.
+        """
+        self.lock = threading.RLock()
+
+    def add_bytes(self, cacher, nbytes):
+        """
+        Account for nbytes more (or less, if negative) bytes held by cacher.
+        """
+        cacher.cached_bytes += nbytes
+        self._refs[id(cacher)][1] += nbytes
+        self._nbytes += nbytes
+
+    def touch(self, cacher, key):
+        """
+        Mark the output of cacher for key as the most recently used one.
+        """
+        if self._max_bytes is None:
+            return
+        self._purge()
+        k = (id(cacher), key)
+        self._order.pop(k, None)
+        self._order[k] = self._refs[id(cacher)][0]
+
+    def forget(self, cacher, key):
+        self._order.pop((id(cacher), key), None)
+
+    @property
+    def cached_bytes(self):
+        """
+        The number of bytes held by all cachers together.
+        """
+        with self.lock:
+            self._purge()
+            return self._nbytes
+
+    def enforce(self):
+        """
+        Evict the least recently used outputs, until the memory ceiling is met.
+        """
+        if self._max_bytes is None:
+            return
+        self._purge()
+        while self._nbytes > self._max_bytes and len(self._order) > 0:
+            (_, key), ref = self._order.popitem(last=False)
+            cacher = ref()
+            if cacher is not None:
+                cacher._drop(key)
+
+    def stats(self):
+        """
+        Return a dictionary {name: {'hits', 'misses', 'evictions', 'entries', 'bytes'}}
+        for all registered cachers. Cachers with the same name are summed up.
+        """
+        stats = {}
+        with self.lock:
+            for c in self.cachers:
+                s = stats.setdefault(c.name, dict(hits=0, misses=0, evictions=0, entries=0, bytes=0))
+                s['hits'] += c.hits
+                s['misses'] += c.misses
+                s['evictions'] += c.evictions
+                s['entries'] += len(c.cached)
+                s['bytes'] += c.cached_bytes
+        return stats
+
+    def reset_stats(self):
+        with self.lock:
+            for c in self.cachers:
+                c.hits = c.misses = c.evictions = 0
+
+    def clear(self):
+        """
+        Drop all cached outputs of all cachers.
+        """
+        with self.lock:
+            for c in list(self.cachers):
+                c.reset()
+            self._order.clear()
+
+def _config_max_bytes():
+    if config.has_option('cache', 'max_bytes'):
+        max_bytes = config.get('cache', 'max_bytes')
+        if max_bytes.strip() != 'None':
+            return int(float(max_bytes))
+    return None
+
+registry = CacheRegistry(_config_max_bytes())
 
 class Cacher(object):
     """
+    Cache the outputs of operation, keyed on the identity of its arguments.
 
+    Together with each output, the version (see
+    :py:class:`~GPy.core.parameterization.parameter_core.Observable`) of every
+    observable argument is stored. Looking up an output is a single dict access
+    plus a comparison of these versions, and changing an argument invalidates
+    all outputs depending on it at once, by increasing its version.
 
+    Outputs are evicted in least recently used order, whenever there are more
+    than limit entries or the outputs hold more than max_bytes bytes.
+    Additionally, the global memory ceiling of the :py:class:`CacheRegistry`
+    registry applies to all cachers together.
 
+    Pickling a cacher drops the cached outputs (and the arguments they were
+    computed from) and its counters, so that pickled models do not carry
+    their caches along. A bound method operation is pickled as its object and
+    name, and bound again on unpickling.
 
+    :param operation: the function to cache
+    :param int limit: maximum number of outputs to keep
+    :param int max_bytes: maximum number of bytes the outputs can hold (None: no maximum)
+    :param ignore_args: indices of arguments, for which changes are ignored
     """
 
-    def __init__(self, operation, limit=5, ignore_args=()):
+    def __init__(self, operation, limit=5, ignore_args=(), max_bytes=None):
         self.limit = int(limit)
+        self.max_bytes = max_bytes
         self.ignore_args = ignore_args
         self.operation=operation
-        self.cached_inputs = []
-        self.cached_outputs = []
-        self.inputs_changed = []
+        # maps the ids of the arguments to [args, versions, nbytes, output]
+        # the args are kept, so that the ids cannot be reused while cached
+        self.cached = collections.OrderedDict()
+        self.cached_bytes = 0
+        self.name = getattr(operation, '__module__', '') + '.' + getattr(operation, '__name__', repr(operation))
+        self.hits = self.misses = self.evictions = 0
+        registry.register(self)
 
     def __call__(self, *args):
         """
@@ -24,80 +231,109 @@ class Cacher(object):
 
         #ensure that specified arguments are ignored
         if len(self.ignore_args) != 0:
-            oa = [a for i,a in enumerate(args) if i not in self.ignore_args]
+            observable_args = [a for i,a in enumerate(args) if i not in self.ignore_args and a is not None]
         else:
-            oa = args
-
-        # this makes sure we only add an observer once, and that None can be in args
-        observable_args = []
-        for a in oa:
-            if (not any(a is ai for ai in observable_args)) and a is not None:
-                observable_args.append(a)
+            observable_args = [a for a in args if a is not None]
 
         #make sure that all the found argument really are observable:
         #otherswise don't cache anything, pass args straight though
         if not all([isinstance(arg, Observable) for arg in observable_args]):
             return self.operation(*args)
 
-        # TODO: WARNING !!! Cache OFFSWITCH !!! WARNING
-        # return self.operation(*args)
+        key = tuple([id(a) for a in args])
+        versions = tuple([a._version_ for a in observable_args])
 
-        #if the result is cached, return the cached computation
-        state = [all(a is b for a, b in itertools.izip_longest(args, cached_i)) for cached_i in self.cached_inputs]
-        if any(state):
-            i = state.index(True)
-            if self.inputs_changed[i]:
+        with registry.lock:
+            entry = self.cached.pop(key, None)
+            if entry is not None:
+                if entry[1] == versions:
+                    #cache hit: reinsert as the most recently used entry
+                    self.cached[key] = entry
+                    self.hits += 1
+                    registry.touch(self, key)
+                    return entry[3]
                 #(elements of) the args have changed since we last computed: update
-                self.cached_outputs[i] = self.operation(*args)
-                self.inputs_changed[i] = False
-            return self.cached_outputs[i]
-        else:
-            #first time we've seen these arguments: compute
-
-            #first make sure the depth limit isn't exceeded
-            if len(self.cached_inputs) == self.limit:
-                args_ = self.cached_inputs.pop(0)
-                [a.remove_observer(self, self.on_cache_changed) for a in args_ if a is not None]
-                self.inputs_changed.pop(0)
-                self.cached_outputs.pop(0)
+                registry.add_bytes(self, -entry[2])
+                registry.forget(self, key)
+            self.misses += 1
 
-            #compute
-            self.cached_inputs.append(args)
-            self.cached_outputs.append(self.operation(*args))
-            self.inputs_changed.append(False)
-            [a.add_observer(self, self.on_cache_changed) for a in observable_args]
-            return self.cached_outputs[-1]#Max says return.
+        #compute
+        output = self.operation(*args)
+        nbytes = _nbytes(output)
+        with registry.lock:
+            old = self.cached.pop(key, None)
+            if old is not None:
+                #another thread cached the same key in the meantime
+                registry.add_bytes(self, -old[2])
+            self.cached[key] = [args, versions, nbytes, output]
+            registry.add_bytes(self, nbytes)
+            registry.touch(self, key)
+            self._evict()
+            registry.enforce()
+        return output
 
-    def on_cache_changed(self, arg):
+    def _evict(self):
+        """
+        Drop the least recently used outputs, until the limits are met.
         """
-        A callback funtion, which sets local flags when the elements of some cached inputs change
+        while len(self.cached) > self.limit or (self.max_bytes is not None and len(self.cached) > 0 and self.cached_bytes > self.max_bytes):
+            key, entry = self.cached.popitem(last=False)
+            registry.add_bytes(self, -entry[2])
+            self.evictions += 1
+            registry.forget(self, key)
 
-        this function gets 'hooked up' to the inputs when we cache them, and upon their elements being changed we update here.
+    def _drop(self, key):
         """
-        self.inputs_changed = [any([a is arg for a in args]) or old_ic for args, old_ic in zip(self.cached_inputs, self.inputs_changed)]
+        Evict the output for key (if cached) and return the number of bytes freed.
+        """
+        entry = self.cached.pop(key, None)
+        if entry is None:
+            return 0
+        registry.add_bytes(self, -entry[2])
+        self.evictions += 1
+        return entry[2]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['cached'] = collections.OrderedDict()
+        state['cached_bytes'] = 0
+        state['hits'] = state['misses'] = state['evictions'] = 0
+        if getattr(self.operation, 'im_self', None) is not None:
+            # bound methods cannot be pickled, rebind by name
+            state['operation'] = None
+            state['_bound_operation'] = (self.operation.im_self, self.operation.__name__)
+        return state
+
+    def __setstate__(self, state):
+        bound = state.pop('_bound_operation', None)
+        self.__dict__.update(state)
+        if bound is not None:
+            self.operation = getattr(*bound)
+        registry.register(self)
 
-    def reset(self, obj):
+    def reset(self, obj=None):
         """
         Totally reset the cache
         """
-        [[a.remove_observer(self, self.on_cache_changed) for a in args if isinstance(a, Observable)] for args in self.cached_inputs]
-        [[a.remove_observer(self, self.reset) for a in args if isinstance(a, Observable)] for args in self.cached_inputs]
-        self.cached_inputs = []
-        self.cached_outputs = []
-        self.inputs_changed = []
+        with registry.lock:
+            for key in self.cached:
+                registry.forget(self, key)
+            self.cached.clear()
+            registry.add_bytes(self, -self.cached_bytes)
 
 class Cache_this(object):
     """
     A decorator which can be applied to bound methods in order to cache them
     """
-    def __init__(self, limit=5, ignore_args=()):
+    def __init__(self, limit=5, ignore_args=(), max_bytes=None):
         self.limit = limit
+        self.max_bytes = max_bytes
         self.ignore_args = ignore_args
         self.c = None
     def __call__(self, f):
         def f_wrap(*args):
             if self.c is None:
-                self.c = Cacher(f, self.limit, ignore_args=self.ignore_args)
+                self.c = Cacher(f, self.limit, ignore_args=self.ignore_args, max_bytes=self.max_bytes)
             return self.c(*args)
         f_wrap._cacher = self
         f_wrap.__doc__ = "**cached**\n\n" + (f.__doc__ or "")
@@ -78,7 +78,8 @@ def force_F_ordered(A):
 #         return jitchol(A+np.eye(A.shape[0])*jitter, maxtries-1)
 
 def jitchol(A, maxtries=5):
-    A = np.ascontiguousarray(A)
+    #the cholesky is always done in double precision, also for single precision kernel matrices
+    A = np.ascontiguousarray(A, dtype=np.float64)
     L, info = lapack.dpotrf(A, lower=1)
     if info == 0:
         return L
@@ -499,42 +500,10 @@ def symmetrify(A, upper=False):
     N, M = A.shape
     assert N == M
 
-    c_contig_code = """
-    int iN;
-    for (int i=1; i<N; i++){
-      iN = i*N;
-      for (int j=0; j<i; j++){
-        A[i+j*N] = A[iN+j];
-      }
-    }
-    """
-    f_contig_code = """
-    int iN;
-    for (int i=1; i<N; i++){
-      iN = i*N;
-      for (int j=0; j<i; j++){
-        A[iN+j] = A[i+j*N];
-      }
-    }
-    """
-
-    N = int(N) # for safe type casting
-    if A.flags['C_CONTIGUOUS'] and upper:
-        weave.inline(f_contig_code, ['A', 'N'], extra_compile_args=['-O3'])
-    elif A.flags['C_CONTIGUOUS'] and not upper:
-        weave.inline(c_contig_code, ['A', 'N'], extra_compile_args=['-O3'])
-    elif A.flags['F_CONTIGUOUS'] and upper:
-        weave.inline(c_contig_code, ['A', 'N'], extra_compile_args=['-O3'])
-    elif A.flags['F_CONTIGUOUS'] and not upper:
-        weave.inline(f_contig_code, ['A', 'N'], extra_compile_args=['-O3'])
+    if upper:
+        A[:] = np.triu(A) + np.triu(A, 1).T
     else:
-        if upper:
-            tmp = np.tril(A.T)
-        else:
-            tmp = np.tril(A)
-        A[:] = 0.0
-        A += tmp
-        A += np.tril(tmp, -1).T
+        A[:] = np.tril(A) + np.tril(A, -1).T
 
 
 def symmetrify_murray(A):
@@ -571,6 +540,55 @@ def cholupdate(L, x):
     N = x.size
     weave.inline(code, support_code=support_code, arg_names=['N', 'L', 'x'], type_converters=weave.converters.blitz)
 
+def chol_append(L, K12, K22):
+    """
+    Extend the LOWER cholesky factor L of K (N x N) to the lower cholesky
+    factor of [[K, K12], [K12^T, K22]], by a block cholesky step, in O(N^2 k)
+    for k new rows.
+
+    :param L: lower cholesky factor of K (N x N)
+    :param K12: the covariance of the old and new rows (N x k)
+    :param K22: the covariance of the new rows (k x k)
+    :returns: the lower cholesky factor of the extended matrix ((N+k) x (N+k)), F ordered
+    """
+    N, k = K12.shape
+    L21T, _ = dtrtrs(L, np.asfortranarray(K12), lower=1)
+    Lnew = np.zeros((N + k, N + k), order='F')
+    Lnew[:N, :N] = L
+    Lnew[N:, :N] = L21T.T
+    Lnew[N:, N:] = jitchol(K22 - tdot(L21T.T))
+    return Lnew
+
+def chol_remove_leading(L, k):
+    """
+    The LOWER cholesky factor of K[k:, k:], given the lower cholesky factor L
+    of K, in O(N^2 k).
+
+    With L = [[L11, 0], [L21, L22]], K[k:, k:] = L22 L22^T + L21 L21^T, so
+    the factor is the rank k update of L22 by the columns of L21. Column j of
+    the factor is found by a householder reflection of [L22[j:, j], X[j:]]
+    (X holding what is left of L21), which zeroes X[j] and keeps
+    L22 L22^T + X X^T. This is plain numpy (one reflection per column), it
+    does not need weave like :py:func:`cholupdate`.
+
+    :returns: the lower cholesky factor of K[k:, k:], F ordered
+    """
+    L22 = np.array(L[k:, k:], order='F')
+    X = np.array(L[k:, :k])
+    for j in xrange(L22.shape[0]):
+        x2 = np.dot(X[j], X[j])
+        if x2 == 0:
+            continue
+        r = np.sqrt(L22[j, j]**2 + x2)
+        # the reflection v -> r e_1 for v = [L22[j, j], X[j]], with
+        # u_0 = L22[j, j] - r computed without cancellation (L22[j, j] > 0)
+        u = np.hstack((-x2/(L22[j, j] + r), X[j]))
+        B = np.column_stack((L22[j:, j], X[j:]))
+        B -= np.outer(np.dot(B, u), u*(2./np.dot(u, u)))
+        L22[j:, j] = B[:, 0]
+        X[j:] = B[:, 1:]
+    return L22
+
 def backsub_both_sides(L, X, transpose='left'):
     """ Return L^-T * X * L^-1, assumuing X is symmetrical and L is lower cholesky"""
     if transpose == 'left':
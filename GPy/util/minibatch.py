@@ -0,0 +1,84 @@
+# Copyright (c) 2014, GPy authors (see AUTHORS.txt).
+# Licensed under the BSD 3-clause license (see LICENSE.txt)
+
+import numpy as np
+from multiprocessing.pool import ThreadPool
+
+class MinibatchLoader(object):
+    """
+    Draw minibatches of rows of a set of arrays with the same number of rows.
+
+    Every epoch visits the rows in a new random order, the rows which do not
+    fill a whole batch at the end of an epoch are skipped. The arrays can be
+    in memory or np.memmap (e.g. np.load(..., mmap_mode='r')): only the rows
+    of a batch are read, in increasing order within the batch.
+
+    With prefetch=True the next batch is permuted and gathered on a
+    background thread, while the caller works on the current batch (the
+    linear algebra of the caller releases the GIL).
+
+    :param arrays: list of arrays (or memmaps) to draw the rows from, entries may be None
+    :param int batchsize: number of rows per batch
+    :param bool prefetch: whether to gather the next batch in the background
+    :param seed: seed for the permutations (the loader has its own random state)
+    """
+    def __init__(self, arrays, batchsize, prefetch=True, seed=None):
+        self.arrays = list(arrays)
+        self.num_data = [a for a in self.arrays if a is not None][0].shape[0]
+        assert all(a.shape[0] == self.num_data for a in self.arrays if a is not None), "all arrays need the same number of rows"
+        assert 0 < batchsize <= self.num_data, "batchsize must be between 1 and the number of rows"
+        self.batchsize = batchsize
+        self.prefetch = prefetch
+        self._random = np.random.RandomState(seed)
+        self._permutation = self._random.permutation(self.num_data)
+        self._counter = 0
+        self._epoch = 0
+        self._pool = None
+        self._pending = None
+        self._ready = None
+
+    def _gather(self):
+        #if we've seen all the data, start again with them in a new random order
+        if self._counter + self.batchsize > self.num_data:
+            self._counter = 0
+            self._epoch += 1
+            self._permutation = self._random.permutation(self.num_data)
+        index = np.sort(self._permutation[self._counter:self._counter + self.batchsize])
+        self._counter += self.batchsize
+        return self._epoch, index, [None if a is None else np.asarray(a[index]) for a in self.arrays]
+
+    def next(self):
+        """
+        Return the next batch as (epoch, index, rows), where index are the
+        row indices of the batch and rows is a list with the rows of each array.
+        """
+        if self._ready is not None:
+            batch, self._ready = self._ready, None
+        elif self._pending is not None:
+            batch, self._pending = self._pending.get(), None
+        else:
+            batch = self._gather()
+        if self.prefetch:
+            if self._pool is None:
+                self._pool = ThreadPool(1)
+            self._pending = self._pool.apply_async(self._gather)
+        return batch
+
+    def __iter__(self):
+        return self
+
+    def close(self):
+        """
+        Stop the background thread. The loader can still be used afterwards,
+        it restarts the thread at the next batch.
+        """
+        if self._pending is not None:
+            self._ready = self._pending.get()
+            self._pending = None
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def __getstate__(self):
+        self.close()
+        return self.__dict__.copy()
@@ -0,0 +1,57 @@
+# Copyright (c) 2014, GPy authors (see AUTHORS.txt).
+# Licensed under the BSD 3-clause license (see LICENSE.txt)
+
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+
+class PersistentThreadPool(object):
+    """
+    A pool of threads which is started at its first use and kept for the
+    following ones, such that repeated calls (e.g. one per evaluation of the
+    objective in an optimizer) do not start and stop threads each time.
+
+    The threads are stopped by :py:meth:`close`, and when the pool is pickled,
+    copied or garbage collected. The pool is started again at the next use.
+    It holds no reference to its owner, so it does not keep reference cycles
+    of its owner alive.
+    """
+    def __init__(self):
+        self._pool = None
+        self._processes = None
+
+    def map(self, f, iterable, n_jobs):
+        """
+        Like :py:func:`map`, on min(n_jobs, len(iterable)) threads (-1: one per cpu).
+        Falls back to the builtin map for a single thread.
+        """
+        iterable = list(iterable)
+        processes = min(mp.cpu_count() if n_jobs == -1 else n_jobs, len(iterable))
+        if processes <= 1:
+            return map(f, iterable)
+        if self._pool is None or self._processes != processes:
+            self.close()
+            self._pool = ThreadPool(processes)
+            self._processes = processes
+        return self._pool.map(f, iterable)
+
+    def close(self):
+        """
+        Stop the threads, they are started again at the next use.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+            self._processes = None
+
+    def __getstate__(self):
+        self.close()
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def __deepcopy__(self, memo):
+        return PersistentThreadPool()
+
+    def __del__(self):
+        self.close()
@@ -11,18 +11,20 @@ import numpy as np
 def common_subarrays(X, axis=0):
     """
     Find common subarrays of 2 dimensional X, where axis is the axis to apply the search over.
-    Common subarrays are returned as a dictionary of <subarray, [index]> pairs, where
-    the subarray is a tuple representing the subarray and the index is the index
-    for the subarray in X, where index is the index to the remaining axis.
-    
+    Common subarrays are returned as a dictionary of <subarray, index> pairs, where
+    the subarray is a tuple representing the subarray and the index is the (sorted)
+    integer array of indices of the subarray in X, where index is the index to the remaining axis.
+
+    See :py:func:`common_subarray_indices`, which does the search.
+
     :param :class:`np.ndarray` X: 2d array to check for common subarrays in
-    :param int axis: axis to apply subarray detection over. 
-        When the index is 0, compare rows -- columns, otherwise.   
-    
+    :param int axis: axis to apply subarray detection over.
+        When the index is 0, compare rows -- columns, otherwise.
+
     Examples:
     =========
 
-    In a 2d array:    
+    In a 2d array:
     >>> import numpy as np
     >>> X = np.zeros((3,6), dtype=bool)
     >>> X[[1,1,1],[0,4,5]] = 1; X[1:,[2,3]] = 1
@@ -37,19 +39,80 @@ def common_subarrays(X, axis=0):
     array([[False, False, False],
            [ True,  True,  True],
            [False, False, False]], dtype=bool)
-    >>> d[tuple(X[:,4])] == d[tuple(X[:,0])] == [0, 4, 5]
+    >>> d[tuple(X[:,4])].tolist() == d[tuple(X[:,0])].tolist() == [0, 4, 5]
     True
     >>> d[tuple(X[:,1])]
-    [1]
+    array([1])
+    """
+    subarrays, indices = common_subarray_indices(X, axis)
+    return dict((tuple(x), index) for x, index in zip(subarrays.tolist(), indices))
+
+def common_subarray_indices(X, axis=0):
+    """
+    Like :py:func:`common_subarrays`, but returns the distinct subarrays as
+    the rows of a 2d array, and the (sorted) integer arrays of their indices
+    in X as a list in the same order. This skips making a python tuple of
+    every distinct subarray, which dominates for long subarrays.
+
+    The subarrays are compared as raw bytes (packed to bits for boolean X,
+    e.g. masks of missing values) by sorting with np.unique, so the time is
+    linear in the size of X up to the log factor of sorting its subarrays.
+    Floating point X is normalised first, such that -0.0 and 0.0 (and all
+    NaNs) compare equal. Other (e.g. object) dtypes are grouped in python.
+
+    :param :class:`np.ndarray` X: 2d array to check for common subarrays in
+    :param int axis: axis to apply subarray detection over.
+        When the index is 0, compare rows -- columns, otherwise.
+    :returns: (subarrays, indices)
+
+    >>> import numpy as np
+    >>> X = np.array([[1, 0, 1], [0, 0, 0], [1, 0, 1]], dtype=bool)
+    >>> subarrays, indices = common_subarray_indices(X, axis=0)
+    >>> subarrays.astype(int)
+    array([[0, 0, 0],
+           [1, 0, 1]])
+    >>> indices
+    [array([1]), array([0, 2])]
     """
-    from collections import defaultdict
-    from itertools import count
-    from operator import iadd
     assert X.ndim == 2 and axis in (0,1), "Only implemented for 2D arrays"
-    subarrays = defaultdict(list)
-    cnt = count()
-    np.apply_along_axis(lambda x: iadd(subarrays[tuple(x)], [cnt.next()]), 1-axis, X)
-    return subarrays
+    X = np.asarray(X)
+    if X.dtype.kind not in 'biufc':
+        return _common_subarray_indices_python(X, axis)
+    if X.dtype.kind in 'fc':
+        # equal values have to be equal bytes: adding zero turns -0.0 into 0.0,
+        # and all NaNs get the same payload
+        X = X + X.dtype.type(0)
+        X[np.isnan(X)] = np.nan
+    if X.dtype == bool:
+        # pack along the subarrays before transposing, which saves copying the full mask
+        packed = np.packbits(X, axis=1-axis)
+        if axis == 1:
+            packed = packed.T
+    if axis == 1:
+        X = X.T
+    if X.shape[0] == 0:
+        return X[:0], []
+    if X.shape[1] == 0:
+        # all subarrays are empty, and thus equal
+        return X[:1], [np.arange(X.shape[0])]
+    if X.dtype != bool:
+        packed = np.ascontiguousarray(X).view(np.uint8).reshape(X.shape[0], -1)
+    # one opaque (void) item per subarray, such that np.unique compares whole subarrays
+    packed = np.ascontiguousarray(packed).view(np.dtype((np.void, packed.shape[1]))).ravel()
+    _, first, inverse = np.unique(packed, return_index=True, return_inverse=True)
+    # group the indices by subarray, a stable sort keeps them in order within a group
+    order = np.argsort(inverse, kind='mergesort')
+    splits = np.cumsum(np.bincount(inverse))[:-1]
+    return X[first], np.split(order, splits)
+
+def _common_subarray_indices_python(X, axis):
+    if axis == 1:
+        X = X.T
+    groups = {}
+    for i, x in enumerate(X):
+        groups.setdefault(tuple(x), []).append(i)
+    indices = sorted((np.array(ind, dtype=int) for ind in groups.itervalues()), key=lambda ind: ind[0])
+    return X[[ind[0] for ind in indices]], indices
 
 if __name__ == '__main__':
     import doctest
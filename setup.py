@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import os
-from setuptools import setup
+from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
 
 # Version number
 version = '0.4.6'
@@ -10,6 +11,22 @@ version = '0.4.6'
 def read(fname):
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
 
+class optional_build_ext(build_ext):
+    """
+    Build the OpenMP extensions if a suitable compiler is available: GPy falls
+    back to its NumPy implementations without them.
+    """
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except Exception, e:
+            print "warning: could not build the extension {}, using the numpy backend instead ({})".format(ext.name, e)
+
+psi_omp = Extension(name = 'GPy.kern._src.psi_comp._psi_omp',
+                    sources = ['GPy/kern/_src/psi_comp/_psi_omp.c'],
+                    extra_compile_args = ['-fopenmp', '-O3'],
+                    extra_link_args = ['-fopenmp'])
+
 setup(name = 'GPy',
       version = version,
       author = read('AUTHORS.txt'),
@@ -29,6 +46,8 @@ setup(name = 'GPy',
       },
       classifiers=[
       "License :: OSI Approved :: BSD License"],
+      ext_modules = [psi_omp],
+      cmdclass = {'build_ext': optional_build_ext},
       #ext_modules =  [Extension(name = 'GPy.kern.lfmUpsilonf2py',
       #          sources = ['GPy/kern/src/lfmUpsilonf2py.f90'])],
       )